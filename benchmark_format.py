@@ -0,0 +1,87 @@
+"""
+ Benchmarks the format_classifier based marc.get_format against the
+ original if/elif chain in marc.legacy_get_format on a MARC file and
+ reports any records where the two disagree.
+"""
+__author__ = "Jeremy Nelson"
+
+import argparse
+import datetime
+import sys
+import time
+
+import marc
+from marc import FileInputStream, marc4j
+from record_view import RecordView
+
+arg_parser = argparse.ArgumentParser(description='Benchmark MARC format classification')
+arg_parser.add_argument('filename',
+                        help="[filename] Name of MARC file")
+arg_parser.add_argument('--limit',
+                        type=int,
+                        default=10000,
+                        help="[limit] Number of records to load, default is 10000")
+arg_parser.add_argument('--passes',
+                        type=int,
+                        default=5,
+                        help="[passes] Times each classifier runs over the records")
+
+
+def load_records(filename, limit):
+    marc_reader = marc4j.MarcStreamReader(FileInputStream(filename))
+    records = []
+    while marc_reader.hasNext() and len(records) < limit:
+        records.append(RecordView(marc_reader.next()))
+    return records
+
+def time_classifier(function, records, passes):
+    start = time.time()
+    for i in range(passes):
+        for record in records:
+            function(record)
+    return time.time() - start
+
+def benchmark(filename, limit=10000, passes=5):
+    """
+    Function times both format classifiers and prints a comparison
+
+    :param filename: MARC file
+    :param limit: Number of records to load
+    :param passes: Times each classifier runs over the records
+    """
+    records = load_records(filename, limit)
+    mismatches = 0
+    for record in records:
+        legacy_format = marc.legacy_get_format(record)
+        format = marc.get_format(record)
+        if legacy_format != format:
+            mismatches += 1
+            sys.stderr.write("Mismatch legacy={0} table={1} leader={2}\n".format(
+                legacy_format,
+                format,
+                record.getLeader().toString()))
+    legacy_seconds = time_classifier(marc.legacy_get_format, records, passes)
+    table_seconds = time_classifier(marc.get_format, records, passes)
+    total = float(len(records) * passes) or 1.0
+    print('''Format benchmark at {0} for {1} records x {2} passes
+    legacy_get_format: {3:.3f}s ({4:.1f} us/record)
+    get_format:        {5:.3f}s ({6:.1f} us/record)
+    speedup:           {7:.2f}x
+    cache hits={8} misses={9} mismatches={10}'''.format(
+        datetime.datetime.today().isoformat(),
+        len(records),
+        passes,
+        legacy_seconds,
+        legacy_seconds / total * 1e6,
+        table_seconds,
+        table_seconds / total * 1e6,
+        legacy_seconds / (table_seconds or 1e-9),
+        marc.FORMAT_CLASSIFIER.hits,
+        marc.FORMAT_CLASSIFIER.misses,
+        mismatches))
+    return mismatches
+
+
+if __name__ == '__main__':
+    args = arg_parser.parse_args()
+    benchmark(args.filename, args.limit, args.passes)
@@ -0,0 +1,98 @@
+"""
+ Measures how much compacting records shrinks Solr update payloads on a
+ MARC file, reporting fields, estimated XML bytes and JSON bytes per
+ document before and after solr_update.compact_record.
+"""
+__author__ = "Jeremy Nelson"
+
+import argparse
+import json
+import sys
+
+import marc
+from solr_http import json_value
+from solr_update import compact_record, estimate_size
+
+arg_parser = argparse.ArgumentParser(description='Measure compacted update payloads')
+arg_parser.add_argument('filename',
+                        help="[filename] Name of MARC file")
+arg_parser.add_argument('--ils',
+                        default='III',
+                        help="[ils] ILS of the records, default is III")
+arg_parser.add_argument('--reader',
+                        choices=['marc4j', 'native'],
+                        default=None,
+                        help="[reader] MARC reader, default is marc4j on Jython")
+arg_parser.add_argument('--marc_field',
+                        choices=['text', 'omit', 'base64', 'compressed'],
+                        default='text',
+                        help="[marc_field] marc_record field mode, default is text")
+arg_parser.add_argument('--limit',
+                        type=int,
+                        default=10000,
+                        help="[limit] Number of records to measure, default is 10000")
+
+
+def payload(record):
+    "Returns (fields, estimated XML bytes, JSON bytes) of a record dict"
+    fields = 0
+    for value in record.values():
+        if isinstance(value, (list, tuple, set, frozenset)):
+            fields += len(value)
+        else:
+            fields += 1
+    return (fields,
+            estimate_size(record),
+            len(json.dumps(record, default=json_value)))
+
+def measure(filename, ils='III', reader=None, limit=10000):
+    """
+    Returns totals of payload() for records before and after compacting
+
+    :param filename: Name of MARC file
+    :param ils: ILS
+    :param reader: 'marc4j' or 'native'
+    :param limit: Number of records to measure
+    :rtype: dict with docs, errors, the first error message, before and
+            after
+    """
+    totals = {'docs': 0, 'errors': 0, 'first_error': None,
+              'before': [0, 0, 0], 'after': [0, 0, 0]}
+    marc_reader = marc.open_marc_reader(filename, reader)
+    while marc_reader.hasNext() and totals['docs'] < limit:
+        try:
+            record = marc.get_record(marc_reader.next(), ils)
+        except marc.RecordSuppressedError:
+            continue
+        except Exception:
+            if totals['first_error'] is None:
+                totals['first_error'] = "{0}: {1}".format(sys.exc_info()[0].__name__,
+                                                          sys.exc_info()[1])
+            totals['errors'] += 1
+            continue
+        if record is None:
+            continue
+        totals['docs'] += 1
+        for key, record in (('before', record), ('after', compact_record(record))):
+            totals[key] = [total + value
+                           for total, value in zip(totals[key], payload(record))]
+    return totals
+
+def report(totals):
+    lines = ["Documents: {0} Errors: {1}\n".format(totals['docs'], totals['errors'])]
+    if totals.get('first_error'):
+        lines.append("\tFirst error: {0}\n".format(totals['first_error']))
+    for index, label in enumerate(('Field values', 'XML bytes', 'JSON bytes')):
+        before, after = totals['before'][index], totals['after'][index]
+        lines.append("\t{0}: {1} -> {2} ({3:.1f}% smaller, {4:.0f} per doc)\n".format(
+            label,
+            before,
+            after,
+            100.0 * (before - after) / max(before, 1),
+            float(after) / max(totals['docs'], 1)))
+    return ''.join(lines)
+
+if __name__ == '__main__':
+    args = arg_parser.parse_args()
+    marc.set_marc_field(args.marc_field)
+    print(report(measure(args.filename, args.ils, args.reader, args.limit)))
@@ -0,0 +1,132 @@
+"""
+ Benchmarks SolrJ's XML and javabin update encodings on a MARC file,
+ sending the same batches of documents through CommonsHttpSolrServer to a
+ Solr server or to a local solr_standin, and reports throughput and
+ request sizes for each. Runs on Jython.
+"""
+__author__ = "Jeremy Nelson"
+
+import argparse
+import datetime
+import sys
+
+import marc
+from index_stats import RunStats, clock
+from solr_standin import SolrStandIn
+
+arg_parser = argparse.ArgumentParser(description='Benchmark SolrJ update encodings')
+arg_parser.add_argument('filename',
+                        help="[filename] Name of MARC file")
+arg_parser.add_argument('--solr_url',
+                        default=None,
+                        help="[solr_url] Solr server, default is a local stand-in")
+arg_parser.add_argument('--ils',
+                        default='III',
+                        help="[ils] ILS of the records, default is III")
+arg_parser.add_argument('--latency',
+                        type=float,
+                        default=0.0,
+                        help="[latency] Seconds the local stand-in adds to each response")
+arg_parser.add_argument('--limit',
+                        type=int,
+                        default=10000,
+                        help="[limit] Number of records to load, default is 10000")
+arg_parser.add_argument('--batch_docs',
+                        type=int,
+                        default=1000,
+                        help="[batch_docs] Documents per update request, default is 1000")
+
+
+def load_docs(filename, limit, ils='III'):
+    """
+    Reads up to limit documents, counting the records that fail to
+    extract and writing the first failure to stderr
+
+    :param filename: MARC file
+    :param limit: Number of records to load
+    :param ils: ILS
+    :rtype: tuple of (list of documents, errors)
+    """
+    marc_reader = marc.open_marc_reader(filename)
+    docs, errors = [], 0
+    while marc_reader.hasNext() and len(docs) < limit:
+        try:
+            record = marc.get_record(marc_reader.next(), ils=ils)
+        except marc.RecordSuppressedError:
+            continue
+        except Exception:
+            if not errors:
+                sys.stderr.write("First record error: {0}\n".format(sys.exc_info()[1]))
+            errors += 1
+            continue
+        if record is not None:
+            docs.append(marc.build_solr_doc(record))
+    return docs, errors
+
+def time_format(solr_url, docs, batch_docs, request_format):
+    """
+    Sends docs in batches with one update encoding
+
+    :rtype: tuple of (seconds, RunStats)
+    """
+    stats = RunStats()
+    solr_server = marc.open_solrj_server(solr_url,
+                                         request_format=request_format,
+                                         stats=stats,
+                                         xml_response=True)
+    start = clock()
+    for offset in range(0, len(docs), batch_docs):
+        solr_server.add(docs[offset:offset + batch_docs])
+    return clock() - start, stats
+
+def benchmark(filename, solr_url=None, latency=0.0, limit=10000,
+              batch_docs=1000, ils='III'):
+    """
+    Function times both update encodings and prints a comparison
+
+    :param filename: MARC file
+    :param solr_url: Solr server, None starts a local stand-in
+    :param latency: Seconds the local stand-in adds to each response
+    :param limit: Number of records to load
+    :param batch_docs: Documents per update request
+    :param ils: ILS
+    """
+    standin = None
+    if solr_url is None:
+        standin = SolrStandIn(latency).start()
+        solr_url = standin.url
+    try:
+        docs, errors = load_docs(filename, limit, ils)
+        results = {}
+        for request_format in ('xml', 'javabin'):
+            results[request_format] = time_format(solr_url, docs, batch_docs,
+                                                  request_format)
+    finally:
+        if standin is not None:
+            standin.stop()
+    lines = ["Update encoding benchmark at {0} for {1} docs ({2} errors) in batches of {3} to {4}".format(
+        datetime.datetime.today().isoformat(),
+        len(docs),
+        errors,
+        batch_docs,
+        solr_url)]
+    for request_format in ('xml', 'javabin'):
+        seconds, stats = results[request_format]
+        request_bytes = stats.histograms.get('request_bytes')
+        lines.append("    {0:<8} {1:.3f}s ({2:.1f} docs/s) requests={3} bytes={4:.0f} mean request={5:.0f}".format(
+            request_format,
+            seconds,
+            len(docs) / (seconds or 1e-9),
+            request_bytes.count if request_bytes else 0,
+            request_bytes.total if request_bytes else 0,
+            request_bytes.total / request_bytes.count if request_bytes else 0))
+    xml_seconds, javabin_seconds = results['xml'][0], results['javabin'][0]
+    lines.append("    speedup:  {0:.2f}x".format(xml_seconds / (javabin_seconds or 1e-9)))
+    print('\n'.join(lines))
+    return results
+
+
+if __name__ == '__main__':
+    args = arg_parser.parse_args()
+    benchmark(args.filename, args.solr_url, args.latency, args.limit,
+              args.batch_docs, args.ils)
@@ -0,0 +1,201 @@
+"""
+ :mod:`csv_parts` Writes the CSV rows for Solr's /update/csv handler into
+ part files of a bounded number of rows, then loads the parts with several
+ requests at once so Solr parses them in parallel. Each part's result is
+ reported on its own, and loaded parts can be removed as they finish, so
+ the parts left on disk are the ones that failed and can be loaded again
+ without reloading the rest.
+"""
+__author__ = "Jeremy Nelson"
+
+import csv
+import glob
+import os
+import re
+import sys
+import threading
+
+try:
+    import Queue as queue
+    from urllib import urlencode
+except ImportError:
+    import queue
+    from urllib.parse import urlencode
+
+from index_stats import clock
+from solr_http import ChunkedPost
+
+# Bytes read from a part file per chunk of the upload
+READ_SIZE = 64 * 1024
+
+
+def open_csv(filename):
+    "Opens a CSV file for writing the way the csv module expects"
+    if sys.version_info[0] < 3:
+        return open(filename, 'wb')
+    return open(filename, 'w', newline='', encoding='utf-8')
+
+
+class PartWriter(object):
+    """
+    Writes dict rows to CSV part files, starting a new part with its own
+    header row every part_rows rows. Part files an earlier run left with
+    the same pattern are removed first, so every part on disk belongs to
+    this run.
+
+    :param filename_pattern: Part file name with a {0} for the part number
+    :param fieldnames: CSV column names
+    :param part_rows: Most rows in one part
+    """
+
+    def __init__(self, filename_pattern, fieldnames, part_rows):
+        self.filename_pattern = filename_pattern
+        self.fieldnames = fieldnames
+        self.part_rows = part_rows
+        self.filenames = []
+        self.rows = []
+        self.part_file = None
+        self.writer = None
+        self.clear()
+
+    def clear(self):
+        "Removes existing files matching filename_pattern"
+        for filename in glob.glob(re.sub(r'\{0[^}]*\}', '*', self.filename_pattern)):
+            os.remove(filename)
+
+    def rotate(self):
+        self.close()
+        filename = self.filename_pattern.format(len(self.filenames))
+        self.part_file = open_csv(filename)
+        self.writer = csv.DictWriter(self.part_file, self.fieldnames)
+        self.writer.writerow(dict([(name, name) for name in self.fieldnames]))
+        self.filenames.append(filename)
+        self.rows.append(0)
+
+    def writerow(self, row):
+        if self.writer is None or self.rows[-1] >= self.part_rows:
+            self.rotate()
+        self.writer.writerow(row)
+        self.rows[-1] += 1
+
+    def close(self):
+        if self.part_file is not None:
+            self.part_file.close()
+            self.part_file = None
+
+
+class CommitClient(object):
+    """
+    Sends commits to Solr's XML update handler, giving the solr_update
+    commit policies a client for CSV loads
+
+    :param solr_url: URL to solr server, ending in /
+    """
+
+    def __init__(self, solr_url):
+        self.solr_url = solr_url
+
+    def commit(self, soft=False):
+        params = {}
+        if soft:
+            params['softCommit'] = 'true'
+        url = self.solr_url + 'update'
+        if params:
+            url += '?' + urlencode(params)
+        upload = ChunkedPost(url, 'text/xml; charset=utf-8')
+        upload.write('<commit/>')
+        return upload.close()
+
+
+def load_part(filename, update_url):
+    """
+    Posts one CSV part file to update_url
+
+    :param filename: CSV part file
+    :param update_url: /update/csv URL with its parameters
+    :rtype: dict with filename, bytes, seconds, and error, None if the
+            part loaded
+    """
+    result = {'filename': filename, 'error': None}
+    start = clock()
+    try:
+        part_file = open(filename, 'rb')
+        try:
+            upload = ChunkedPost(update_url, 'text/csv; charset=utf-8')
+            data = part_file.read(READ_SIZE)
+            while data:
+                upload.write(data)
+                data = part_file.read(READ_SIZE)
+            upload.close()
+            result['bytes'] = upload.bytes_sent
+        finally:
+            part_file.close()
+    except Exception:
+        result['error'] = str(sys.exc_info()[1])
+    result['seconds'] = clock() - start
+    return result
+
+def load_parts(filenames, update_url, threads=4, after_part=None,
+               remove_loaded=False):
+    """
+    Loads CSV part files with up to threads requests at once
+
+    :param filenames: CSV part files
+    :param update_url: /update/csv URL with its parameters, without a
+                       commit so the load ends with a single commit
+    :param threads: Parts loaded at once
+    :param after_part: Function called with each loaded part's result,
+                       one part at a time
+    :param remove_loaded: Boolean, remove each part file once it loaded
+    :rtype: List of result dicts in filenames order
+    """
+    pending = queue.Queue()
+    for index, filename in enumerate(filenames):
+        pending.put((index, filename))
+    results = [None] * len(filenames)
+    lock = threading.Lock()
+    def work():
+        while True:
+            try:
+                index, filename = pending.get_nowait()
+            except queue.Empty:
+                return
+            result = load_part(filename, update_url)
+            results[index] = result
+            if remove_loaded and result['error'] is None:
+                os.remove(filename)
+            if after_part is not None and result['error'] is None:
+                lock.acquire()
+                try:
+                    after_part(result)
+                finally:
+                    lock.release()
+    workers = [threading.Thread(target=work, name='csv-part-{0}'.format(i))
+               for i in range(max(1, min(threads, len(filenames))))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+def report(results, rows=None):
+    """
+    Returns one line per part with its rows, size, time and any error
+
+    :param results: List of load_part results
+    :param rows: List of rows per part, from PartWriter.rows
+    :rtype: String
+    """
+    lines = []
+    for index, result in enumerate(results):
+        line = "\t{0}: ".format(result['filename'])
+        if rows is not None:
+            line += "rows={0} ".format(rows[index])
+        if result['error'] is None:
+            line += "bytes={0} time={1:.2f}s loaded\n".format(result['bytes'],
+                                                               result['seconds'])
+        else:
+            line += "time={0:.2f}s FAILED {1}\n".format(result['seconds'],
+                                                         result['error'])
+        lines.append(line)
+    return ''.join(lines)
@@ -0,0 +1,208 @@
+"""
+ :mod:`field_mapping` Declarative MARC tag to Solr field mapping table
+ and the compiler that turns the table into a list of extractor
+ functions run against every record.
+
+ A mapping table is a list of :class:`FieldMapping` tuples built with
+ :func:`field`, :func:`computed`, and :func:`step`. :func:`compile_mappings`
+ is called once at startup; mappings that read the same tags are merged
+ into one extractor so the tags are only fetched once per record.
+"""
+__author__ = "Jeremy Nelson"
+
+from collections import namedtuple
+
+FieldMapping = namedtuple('FieldMapping',
+                          ['names',
+                           'tags',
+                           'subfields',
+                           'normalizer',
+                           'multi_valued',
+                           'formatter',
+                           'repeat',
+                           'function'])
+
+
+def field(name,
+          tags=(),
+          subfields=None,
+          normalizer=None,
+          multi_valued=False,
+          formatter=None,
+          repeat=True):
+    """
+    Declares a Solr field read straight from MARC tags. Each field's
+    value is its data (control fields), formatter(field), or the data of
+    each listed subfield code. Single-valued fields take the first value
+    of the first field found in tag order and are left unset if there is
+    none; multi-valued fields are always set and extend any list already
+    in the record.
+
+    :param name: Solr field name
+    :param tags: MARC tags, in priority order
+    :param subfields: String of subfield codes or None
+    :param normalizer: Function applied to each value
+    :param multi_valued: Boolean, True for a list of values
+    :param formatter: Function taking a MARC field, used when subfields
+                      is None
+    :param repeat: Boolean, False only uses the first subfield of a code
+    :rtype: FieldMapping
+    """
+    return FieldMapping((name,), tuple(tags), subfields, normalizer,
+                        multi_valued, formatter, repeat, None)
+
+def computed(name, function, multi_valued=False):
+    """
+    Declares a Solr field computed by function(marc_record, record, ils),
+    the return value is set in the record.
+
+    :param name: Solr field name
+    :param function: Extractor function
+    :param multi_valued: Boolean
+    :rtype: FieldMapping
+    """
+    return FieldMapping((name,), (), None, None, multi_valued, None, True,
+                        function)
+
+def step(names, function):
+    """
+    Declares a step that sets several Solr fields at once,
+    function(marc_record, record, ils) updates the record in place.
+
+    :param names: Sequence of Solr field names set by the step
+    :param function: Extractor function
+    :rtype: FieldMapping
+    """
+    return FieldMapping(tuple(names), (), None, None, False, None, True,
+                        _Step(function))
+
+class _Step(object):
+
+    def __init__(self, function):
+        self.function = function
+
+
+def fieldnames(mappings):
+    """
+    Returns the Solr field names set by a mapping table in table order
+
+    :param mappings: List of FieldMapping
+    :rtype: List
+    """
+    output = []
+    for mapping in mappings:
+        for name in mapping.names:
+            if name not in output:
+                output.append(name)
+    return output
+
+def field_values(mapping, fields):
+    """
+    Returns the raw values a field mapping reads from a list of fields
+
+    :param mapping: FieldMapping
+    :param fields: List of MARC fields
+    :rtype: List
+    """
+    values = []
+    for marc_field in fields:
+        if mapping.subfields is None:
+            if mapping.formatter is not None:
+                values.append(mapping.formatter(marc_field))
+            else:
+                values.append(marc_field.getData())
+            continue
+        for code in mapping.subfields:
+            if mapping.repeat:
+                subfields = marc_field.getSubfields(code)
+            else:
+                subfields = [marc_field.getSubfield(code)]
+            for subfield in subfields:
+                if subfield is not None:
+                    values.append(subfield.getData())
+    if mapping.normalizer is not None:
+        values = [mapping.normalizer(value) for value in values]
+    return values
+
+def _set_values(mapping, record, fields_by_tag):
+    name = mapping.names[0]
+    if mapping.multi_valued:
+        fields = []
+        for tag in mapping.tags:
+            fields.extend(fields_by_tag[tag])
+        values = field_values(mapping, fields)
+        existing = record.get(name)
+        if existing:
+            values = list(existing) + values
+        record[name] = values
+        return
+    for tag in mapping.tags:
+        if fields_by_tag[tag]:
+            values = field_values(mapping, fields_by_tag[tag][:1])
+            if values:
+                record[name] = values[0]
+            return
+
+def _tag_extractor(tags, mappings):
+    "Builds one extractor for all field mappings reading the same tags"
+    def extractor(marc_record, record, ils):
+        fields_by_tag = {}
+        for tag in tags:
+            fields_by_tag[tag] = marc_record.getVariableFields(tag)
+        for mapping in mappings:
+            _set_values(mapping, record, fields_by_tag)
+    return extractor
+
+def _computed_extractor(mapping):
+    name, function = mapping.names[0], mapping.function
+    def extractor(marc_record, record, ils):
+        record[name] = function(marc_record, record, ils)
+    return extractor
+
+def _step_extractor(mapping):
+    function = mapping.function.function
+    def extractor(marc_record, record, ils):
+        function(marc_record, record, ils)
+    return extractor
+
+def compile_mappings(mappings):
+    """
+    Compiles a mapping table into a list of extractor functions with the
+    signature extractor(marc_record, record, ils). Tag mappings sharing
+    the same tags are merged into a single extractor placed where the
+    first of them appears in the table; computed fields and steps keep
+    their table position so they can read values set before them.
+
+    :param mappings: List of FieldMapping
+    :rtype: List of functions
+    """
+    extractors, groups = [], {}
+    for mapping in mappings:
+        if mapping.function is None:
+            if not mapping.tags:
+                continue
+            if mapping.tags in groups:
+                groups[mapping.tags].append(mapping)
+                continue
+            groups[mapping.tags] = [mapping]
+            extractors.append(_tag_extractor(mapping.tags,
+                                             groups[mapping.tags]))
+        elif isinstance(mapping.function, _Step):
+            extractors.append(_step_extractor(mapping))
+        else:
+            extractors.append(_computed_extractor(mapping))
+    return extractors
+
+def run_extractors(extractors, marc_record, record, ils=None):
+    """
+    Runs compiled extractors against a MARC record
+
+    :param extractors: List returned by compile_mappings
+    :param marc_record: MARC record or RecordView
+    :param record: Dictionary of indexed values
+    :param ils: ILS
+    :rtype: dict
+    """
+    for extractor in extractors:
+        extractor(marc_record, record, ils)
+    return record
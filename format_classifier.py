@@ -0,0 +1,212 @@
+"""
+ :mod:`format_classifier` Decision-table version of the Kochief derived
+ format rules in :func:`marc.get_format`. A record's format depends only
+ on a handful of leader, 006, 007, and 008 positions (plus the 502 for
+ some theses), so classifications are memoized on those positions.
+"""
+__author__ = "Jeremy Nelson"
+
+import logging
+import re
+
+# Cell that matches any value in a decision table row
+ANY = None
+
+# Returned from the tables when the 502 decides between Thesis and
+# Manuscript
+THESIS_502 = '502 Thesis'
+
+THESIS_RE = re.compile(r"Thesis")
+
+SERIAL_FREQUENCIES = 'bcdefijqstw'
+
+# Physical description from the 007, columns are
+# (leader/6, 007/0, 007/1, 007/4, 007/6) and the first matching row wins
+PHYSICAL_TABLE = [
+    (ANY, 'a', 'd', ANY, ANY, 'Atlas'),
+    (ANY, 'a', ANY, ANY, ANY, 'Map'),
+    (ANY, 'c', 'j', ANY, ANY, 'Floppy Disk'),
+    (ANY, 'c', 'r', ANY, ANY, 'Electronic'),
+    (ANY, 'c', 'om', ANY, ANY, 'CDROM'),
+    (ANY, 'd', ANY, ANY, ANY, 'Globe'),
+    (ANY, 'h', ANY, ANY, ANY, 'Microfilm'),
+    (ANY, 'k', 'c', ANY, ANY, 'Collage'),
+    (ANY, 'k', 'dl', ANY, ANY, 'Drawing'),
+    (ANY, 'k', 'e', ANY, ANY, 'Painting'),
+    (ANY, 'k', 'fj', ANY, ANY, 'Print'),
+    (ANY, 'k', 'g', ANY, ANY, 'Photonegative'),
+    (ANY, 'k', 'o', ANY, ANY, 'Flash Card'),
+    (ANY, 'k', 'n', ANY, ANY, 'Chart'),
+    (ANY, 'k', ANY, ANY, ANY, 'Photo'),
+    (ANY, 'm', 'f', ANY, ANY, 'Videocassette'),
+    (ANY, 'm', 'r', ANY, ANY, 'Filmstrip'),
+    (ANY, 'm', ANY, ANY, ANY, 'Motion picture'),
+    (ANY, 'o', ANY, ANY, ANY, 'kit'),
+    (ANY, 'q', ANY, ANY, ANY, 'musical score'),
+    ('i', 's', 's', ANY, ANY, 'Book On Cassette'),
+    ('i', 's', 'd', ANY, 'gz', 'Book On CD'),
+    ('j', 's', 's', ANY, ANY, 'Cassette'),
+    ('j', 's', 'd', ANY, 'gz', 'Music CD'),
+    ('j', 's', 'd', ANY, 'e', 'LP Record'),
+    (ANY, 'v', 'f', ANY, ANY, 'VHS Video'),
+    (ANY, 'v', 'd', 'vg', ANY, 'DVD Video'),
+    (ANY, 'v', 'd', 's', ANY, 'Blu-ray Video'),
+    (ANY, 'v', 'd', 'b', ANY, 'VHS Video'),
+    (ANY, 'v', 'r', ANY, ANY, 'Video Reel'),
+]
+
+# Type of record from the leader and 008, columns are
+# (leader/6, leader/7, 008 longer than 18, 008 longer than 22,
+#  008/21, 008/23, 008/24, 008/33). An empty format stops the search.
+LEADER_TABLE = [
+    ('a', 'a', ANY, ANY, ANY, ANY, ANY, ANY, 'Series'),
+    ('a', 'c', ANY, ANY, ANY, ANY, ANY, ANY, 'Collection'),
+    ('a', 'm', ANY, 'y', ANY, 'd', ANY, ANY, 'Large Print Book'),
+    ('a', 'm', ANY, 'y', ANY, 's', ANY, ANY, 'Electronic'),
+    ('a', 'm', ANY, ANY, ANY, ANY, ANY, ANY, 'Book'),
+    ('a', 's', 'y', ANY, SERIAL_FREQUENCIES, ANY, ANY, ANY, 'Journal'),
+    ('a', 's', 'y', ANY, 'm', ANY, ANY, ANY, 'Book'),
+    ('a', 's', ANY, ANY, ANY, ANY, ANY, ANY, 'Journal'),
+    ('b', ANY, ANY, ANY, ANY, ANY, ANY, ANY, 'Manuscript'),
+    ('e', ANY, ANY, ANY, ANY, ANY, ANY, ANY, 'Map'),
+    ('c', ANY, ANY, ANY, ANY, ANY, ANY, ANY, 'Musical Score'),
+    ('g', ANY, ANY, ANY, ANY, ANY, ANY, ANY, 'Video'),
+    ('d', ANY, ANY, ANY, ANY, ANY, ANY, ANY, 'Manuscript noted music'),
+    ('j', ANY, ANY, ANY, ANY, ANY, ANY, ANY, 'Music Sound Recordings'),
+    ('i', '#', ANY, ANY, ANY, ANY, ANY, ANY, ''),
+    ('i', ANY, ANY, ANY, ANY, ANY, ANY, ANY, 'Spoken Sound Recodings'),
+    ('k', ANY, ANY, 'y', ANY, ANY, ANY, 'i', 'Poster'),
+    ('k', ANY, ANY, 'y', ANY, ANY, ANY, 'o', 'Flash Cards'),
+    ('k', ANY, ANY, 'y', ANY, ANY, ANY, 'n', 'Charts'),
+    ('m', ANY, ANY, ANY, ANY, ANY, ANY, ANY, 'Electronic'),
+    ('p', 'c', ANY, ANY, ANY, ANY, ANY, ANY, 'Collection'),
+    ('p', ANY, ANY, ANY, ANY, ANY, ANY, ANY, 'Mixed Materials'),
+    ('o', ANY, ANY, 'y', ANY, ANY, ANY, 'b', 'Kit'),
+    ('r', ANY, ANY, ANY, ANY, ANY, ANY, 'g', 'Games'),
+    ('t', ANY, ANY, 'y', ANY, ANY, 'm', ANY, 'Thesis'),
+    ('t', ANY, ANY, 'y', ANY, ANY, 'b', ANY, 'Book'),
+    ('t', ANY, ANY, 'y', ANY, ANY, ANY, ANY, THESIS_502),
+    ('t', ANY, ANY, ANY, ANY, ANY, ANY, ANY, 'Manuscript'),
+]
+
+# Fixed-length data elements from the 006, columns are (006/0, 006/6)
+F006_TABLE = [
+    ('t', ANY, 'Manuscript'),
+    ('m', ANY, 'Electronic'),
+    (ANY, 'o', 'Electronic'),
+]
+
+
+def _char(value, position):
+    if len(value) > position:
+        return value[position]
+    return ''
+
+def _data(record, tag):
+    field = record.getVariableField(tag)
+    if field is not None:
+        return field.getData()
+    return None
+
+def format_key(record):
+    """
+    Returns the tuple of the leader, 006, 007, and 008 positions the
+    format rules read, the classifier's cache key.
+
+    :param record: MARC record
+    :rtype: tuple
+    """
+    leader = record.getLeader().toString()
+    field007 = _data(record, '007') or ''
+    field008 = _data(record, '008') or ''
+    field006 = _data(record, '006')
+    if len(leader) > 7 and len(field007) > 5:
+        physical = (field007[0], field007[1], field007[4],
+                    _char(field007, 6))
+    else:
+        physical = ('', '', '', '')
+    if field006 is None:
+        fixed006 = (None, None)
+    else:
+        fixed006 = (_char(field006, 0), _char(field006, 6))
+    return (leader[6], leader[7]) + physical +\
+           ('y' if len(field008) > 18 else 'n',
+            'y' if len(field008) > 22 else 'n',
+            _char(field008, 21),
+            _char(field008, 23),
+            _char(field008, 24),
+            _char(field008, 33)) + fixed006
+
+def _match(row, values):
+    for cell, value in zip(row, values):
+        if cell is not ANY and (not value or value not in cell):
+            return False
+    return True
+
+def _lookup(table, values):
+    for row in table:
+        if _match(row[:-1], values):
+            return row[-1]
+    return ''
+
+def classify_key(key):
+    """
+    Runs a format key through the decision tables. Returns THESIS_502
+    when the record's 502 has to be checked.
+
+    :param key: tuple from format_key
+    :rtype: String of Format
+    """
+    (leader6, leader7, c0, c1, c4, c6, len18, len22,
+     f21, f23, f24, f33, f006_0, f006_6) = key
+    format = _lookup(PHYSICAL_TABLE, (leader6, c0, c1, c4, c6))
+    if not format and c0 == 'v' and c1 == 'd':
+        logging.error("UNKNOWN field007 {0} for record".format(c4))
+    if not format:
+        format = _lookup(LEADER_TABLE, (leader6, leader7, len18, len22,
+                                        f21, f23, f24, f33))
+    if not format and f006_0 is not None:
+        format = _lookup(F006_TABLE, (f006_0, f006_6))
+    if not format:
+        logging.error("309 UNKNOWN FORMAT Leader: %s/%s" % (leader6, leader7))
+        format = 'Unknown'
+    return format
+
+
+class FormatClassifier(object):
+    """
+    Memoizes classify_key on the format key, the cache is cleared when it
+    grows past maxsize.
+
+    :param maxsize: Maximum number of cached keys
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.cache = {}
+        self.hits, self.misses = 0, 0
+
+    def classify(self, record):
+        """
+        Returns the record's format before any location overrides
+
+        :param record: MARC record
+        :rtype: String of Format
+        """
+        key = format_key(record)
+        try:
+            format = self.cache[key]
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            format = classify_key(key)
+            if len(self.cache) >= self.maxsize:
+                self.cache.clear()
+            self.cache[key] = format
+        if format == THESIS_502:
+            desc502 = record.getVariableField("502")
+            if desc502 is not None and THESIS_RE.search(desc502.toString()):
+                format = 'Thesis'
+            else:
+                format = 'Manuscript'
+        return format
@@ -0,0 +1,316 @@
+"""
+ :mod:`index_stats` Timing and run statistics for MARC indexing runs,
+ including the opt-in per-extractor profiler used by :mod:`marc`.
+"""
+__author__ = "Jeremy Nelson"
+
+import datetime
+import json
+import math
+import threading
+import time
+
+try:
+    # Jython's time.time() only has millisecond resolution
+    import java.lang.System as System
+    def clock():
+        return System.nanoTime() / 1e9
+except ImportError:
+    clock = getattr(time, 'perf_counter', time.time)
+
+# Number of histogram buckets per doubling of the elapsed time
+BUCKETS_PER_OCTAVE = 4
+
+
+class Histogram(object):
+    """
+    Log-scale histogram of elapsed times, cheap enough to update for
+    every record and mergeable across runs. Values are multiplied by
+    scale before bucketing, microseconds for times in seconds by default;
+    use a scale of 1 for sizes and counts.
+
+    :param scale: Multiplier applied to values before bucketing
+    """
+
+    def __init__(self, scale=1e6):
+        self.scale = scale
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = 0.0
+        self.buckets = {}
+
+    def add(self, value):
+        """
+        Adds an elapsed time in seconds, or a value in the histogram's
+        units
+
+        :param value: Elapsed time or value
+        """
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+        scaled = value * self.scale
+        if scaled < 1.0:
+            bucket = 0
+        else:
+            bucket = int(math.log(scaled, 2) * BUCKETS_PER_OCTAVE) + 1
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, percent):
+        """
+        Returns the upper bound of the bucket holding the percentile,
+        capped at the largest value seen
+
+        :param percent: Percentile between 0 and 100
+        :rtype: float
+        """
+        if not self.count:
+            return 0.0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                upper = 2 ** (float(bucket) / BUCKETS_PER_OCTAVE) / self.scale
+                return min(upper, self.maximum)
+        return self.maximum
+
+    def merge(self, other):
+        """
+        Adds another histogram's samples to this one
+
+        :param other: Histogram
+        """
+        self.count += other.count
+        self.total += other.total
+        if other.minimum is not None and (self.minimum is None or
+                                          other.minimum < self.minimum):
+            self.minimum = other.minimum
+        self.maximum = max(self.maximum, other.maximum)
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def to_dict(self):
+        return {'count': self.count,
+                'scale': self.scale,
+                'total': self.total,
+                'mean': self.total / self.count if self.count else 0.0,
+                'min': self.minimum or 0.0,
+                'max': self.maximum,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                'buckets': dict([(str(key), value)
+                                 for key, value in self.buckets.items()])}
+
+    @classmethod
+    def from_dict(cls, values):
+        histogram = cls(values.get('scale', 1e6))
+        histogram.count = values['count']
+        histogram.total = values['total']
+        histogram.minimum = values['min'] if values['count'] else None
+        histogram.maximum = values['max']
+        histogram.buckets = dict([(int(key), value)
+                                  for key, value in values['buckets'].items()])
+        return histogram
+
+
+class ExtractorProfiler(object):
+    """
+    Times named functions by swapping timing wrappers into a module's
+    namespace. Nothing is wrapped until instrument is called, so the
+    profiler costs nothing when it is off.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.timings = {}
+        self.originals = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        """
+        Records an elapsed time for a name
+
+        :param name: Extractor or step name
+        :param seconds: Elapsed time
+        """
+        self.lock.acquire()
+        try:
+            if name not in self.timings:
+                self.timings[name] = Histogram()
+            self.timings[name].add(seconds)
+        finally:
+            self.lock.release()
+
+    def timed(self, name, function):
+        """
+        Returns function wrapped to record its elapsed time under name
+
+        :param name: Extractor name
+        :param function: Function to time
+        """
+        profiler = self
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.add(name, clock() - start)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+
+    def instrument(self, namespace, names):
+        """
+        Replaces the named functions in namespace, usually a module's
+        globals(), with timed wrappers
+
+        :param namespace: dict of functions
+        :param names: Names of the functions to time
+        """
+        for name in names:
+            if name not in self.originals:
+                self.originals[name] = namespace[name]
+                namespace[name] = self.timed(name, namespace[name])
+        self.enabled = True
+
+    def uninstrument(self, namespace):
+        """
+        Restores the original functions in namespace
+
+        :param namespace: dict of functions
+        """
+        for name, function in self.originals.items():
+            namespace[name] = function
+        self.originals = {}
+        self.enabled = False
+
+    def reset(self):
+        self.timings = {}
+
+    def to_dict(self):
+        return dict([(name, histogram.to_dict())
+                     for name, histogram in self.timings.items()])
+
+    def merge(self, values):
+        """
+        Adds timings from another profiler's to_dict output
+
+        :param values: dict of histogram dicts
+        """
+        for name, histogram in values.items():
+            if name not in self.timings:
+                self.timings[name] = Histogram()
+            self.timings[name].merge(Histogram.from_dict(histogram))
+
+    def report(self):
+        """
+        Returns a text table of the timings, slowest total first
+
+        :rtype: String
+        """
+        lines = ["\nExtractor timings (ms)\n",
+                 "\t{0:<22}{1:>10}{2:>12}{3:>9}{4:>9}{5:>9}{6:>9}\n".format(
+                     'name', 'count', 'total', 'mean', 'p50', 'p90', 'p99')]
+        by_total = sorted(self.timings.items(),
+                          key=lambda item: item[1].total,
+                          reverse=True)
+        for name, histogram in by_total:
+            lines.append(
+                "\t{0:<22}{1:>10}{2:>12.1f}{3:>9.3f}{4:>9.3f}{5:>9.3f}{6:>9.3f}\n".format(
+                    name,
+                    histogram.count,
+                    histogram.total * 1e3,
+                    histogram.total / histogram.count * 1e3,
+                    histogram.percentile(50) * 1e3,
+                    histogram.percentile(90) * 1e3,
+                    histogram.percentile(99) * 1e3))
+        return ''.join(lines)
+
+    def write_json(self, filename, **extra):
+        """
+        Writes the timings and any extra run values to a JSON file
+
+        :param filename: Output file name
+        """
+        values = {'created': datetime.datetime.today().isoformat(),
+                  'timings': self.to_dict()}
+        values.update(extra)
+        json_file = open(filename, 'w')
+        try:
+            json.dump(values, json_file, indent=2, sort_keys=True)
+        finally:
+            json_file.close()
+
+
+class RunStats(object):
+    """
+    Named histograms of the values seen during one submission run, such
+    as batch sizes, printed in the end of run summary and written to the
+    profile JSON.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, value, scale=1.0):
+        """
+        Adds a value to the named histogram
+
+        :param name: Statistic name
+        :param value: Value
+        :param scale: Histogram scale used if the histogram is new
+        """
+        self.lock.acquire()
+        try:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(scale)
+            self.histograms[name].add(value)
+        finally:
+            self.lock.release()
+
+    def to_dict(self):
+        return dict([(name, histogram.to_dict())
+                     for name, histogram in self.histograms.items()])
+
+    def merge(self, values):
+        """
+        Adds histograms from another RunStats' to_dict output
+
+        :param values: dict of histogram dicts
+        """
+        for name, histogram in values.items():
+            histogram = Histogram.from_dict(histogram)
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(histogram.scale)
+            self.histograms[name].merge(histogram)
+
+    def report(self):
+        """
+        Returns one summary line per statistic
+
+        :rtype: String
+        """
+        def number(value):
+            if abs(value) >= 100:
+                return "{0:.0f}".format(value)
+            return "{0:.3g}".format(value)
+        lines = []
+        for name in sorted(self.histograms):
+            histogram = self.histograms[name]
+            lines.append(
+                "\t{0}: count={1} total={2} mean={3} p50={4} p90={5} max={6}\n".format(
+                    name,
+                    histogram.count,
+                    number(histogram.total),
+                    number(histogram.total / (histogram.count or 1)),
+                    number(histogram.percentile(50)),
+                    number(histogram.percentile(90)),
+                    number(histogram.maximum)))
+        return ''.join(lines)
@@ -0,0 +1,440 @@
+"""
+ :mod:`iso2709` Pure-Python MARC 21 (ISO 2709) reader and writer.
+
+ Records are sliced out of a read buffer with the leader's record length
+ and keep a memoryview of their bytes. The directory is only parsed when
+ a field is first asked for, and a field's bytes are only decoded when
+ its data or subfields are read. The record and field classes expose the
+ subset of the MARC4J API used by :mod:`marc`, :mod:`sharder`, and
+ :mod:`random_marc_generator` so they run on CPython as well as Jython.
+"""
+__author__ = "Jeremy Nelson"
+
+LEADER_LENGTH = 24
+DIRECTORY_ENTRY_LENGTH = 12
+FIELD_TERMINATOR = b'\x1e'
+RECORD_TERMINATOR = b'\x1d'
+SUBFIELD_DELIMITER = u'\x1f'
+
+# Bytes read from the input stream at a time
+CHUNK_SIZE = 1 << 20
+
+try:
+    _view = memoryview
+except NameError:
+    _view = lambda value: value
+
+
+def _bytes(value):
+    "Returns bytes for a memoryview or bytes slice"
+    if isinstance(value, bytes):
+        return value
+    return value.tobytes()
+
+
+class MarcReadError(Exception):
+    """
+    Raised when the input is not a well-formed ISO 2709 record
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class Leader(object):
+    """
+    Record leader, MARC4J's Leader.toString() is all :mod:`marc` uses
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def getRecordLength(self):
+        return int(self.value[0:5])
+
+    def getBaseAddressOfData(self):
+        return int(self.value[12:17])
+
+    def getCharCodingScheme(self):
+        return self.value[9]
+
+    def toString(self):
+        return self.value
+
+    def __str__(self):
+        return self.value
+
+
+class Subfield(object):
+
+    def __init__(self, code, data):
+        self.code = code
+        self.data = data
+
+    def getCode(self):
+        return self.code
+
+    def getData(self):
+        return self.data
+
+    def toString(self):
+        return u'${0}{1}'.format(self.code, self.data)
+
+    __str__ = toString
+
+
+class ControlField(object):
+    """
+    Control field (001-009), decoded on first getData()
+    """
+
+    def __init__(self, tag, raw, encoding):
+        self.tag = tag
+        self.raw = raw
+        self.encoding = encoding
+        self._data = None
+
+    def getTag(self):
+        return self.tag
+
+    def getData(self):
+        if self._data is None:
+            self._data = _bytes(self.raw).decode(self.encoding,
+                                                 'replace').rstrip(u'\x1e')
+        return self._data
+
+    data = property(getData)
+
+    def toString(self):
+        return u'{0} {1}'.format(self.tag, self.getData())
+
+    __str__ = toString
+
+
+class DataField(object):
+    """
+    Data field, the indicators and subfields are decoded on first access
+    """
+
+    def __init__(self, tag, raw, encoding):
+        self.tag = tag
+        self.raw = raw
+        self.encoding = encoding
+        self._subfields = None
+        self._indicators = None
+
+    def _decode(self):
+        text = _bytes(self.raw).decode(self.encoding,
+                                       'replace').rstrip(u'\x1e')
+        self._indicators = (text[0:1] or u' ', text[1:2] or u' ')
+        self._subfields = [Subfield(value[0:1], value[1:])
+                           for value in text[2:].split(SUBFIELD_DELIMITER)[1:]
+                           if value]
+
+    def getTag(self):
+        return self.tag
+
+    def getIndicator1(self):
+        if self._indicators is None:
+            self._decode()
+        return self._indicators[0]
+
+    def getIndicator2(self):
+        if self._indicators is None:
+            self._decode()
+        return self._indicators[1]
+
+    indicator1 = property(getIndicator1)
+    indicator2 = property(getIndicator2)
+
+    def getSubfields(self, code=None):
+        """
+        Returns all subfields, or all subfields with the code
+
+        :param code: Subfield code
+        :rtype: List
+        """
+        if self._subfields is None:
+            self._decode()
+        if code is None:
+            return self._subfields
+        return [subfield for subfield in self._subfields
+                if subfield.code == code]
+
+    subfields = property(getSubfields)
+
+    def getSubfield(self, code):
+        """
+        Returns the first subfield with the code or None
+
+        :param code: Subfield code
+        """
+        if self._subfields is None:
+            self._decode()
+        for subfield in self._subfields:
+            if subfield.code == code:
+                return subfield
+        return None
+
+    def toString(self):
+        return u'{0} {1}{2}{3}'.format(self.tag,
+                                       self.getIndicator1(),
+                                       self.getIndicator2(),
+                                       u''.join([subfield.toString()
+                                                 for subfield in self.getSubfields()]))
+
+    __str__ = toString
+
+
+class Record(object):
+    """
+    Lazily parsed MARC record backed by the record's raw bytes
+
+    :param raw: bytes or memoryview of one ISO 2709 record
+    """
+
+    def __init__(self, raw):
+        self.raw = _view(raw)
+        self.leader = Leader(_bytes(self.raw[0:LEADER_LENGTH]).decode('latin-1'))
+        if self.leader.getCharCodingScheme() == 'a':
+            self.encoding = 'utf-8'
+        else:
+            self.encoding = 'latin-1'
+        self._directory = None
+        self._fields = {}
+
+    def directory(self):
+        """
+        Returns the parsed directory, a list of (tag, start, length) in
+        record order with start relative to the record
+
+        :rtype: List
+        """
+        if self._directory is None:
+            try:
+                base = self.leader.getBaseAddressOfData()
+                entries = _bytes(self.raw[LEADER_LENGTH:base - 1]).decode('latin-1')
+                self._directory = [(entries[i:i + 3],
+                                    base + int(entries[i + 7:i + 12]),
+                                    int(entries[i + 3:i + 7]))
+                                   for i in range(0,
+                                                  len(entries) - DIRECTORY_ENTRY_LENGTH + 1,
+                                                  DIRECTORY_ENTRY_LENGTH)]
+            except ValueError:
+                raise MarcReadError("Invalid directory in record {0}".format(
+                    self.leader.toString()))
+        return self._directory
+
+    def _field(self, position):
+        if position not in self._fields:
+            tag, start, length = self.directory()[position]
+            raw = self.raw[start:start + length]
+            if tag < '010' and tag.isdigit():
+                self._fields[position] = ControlField(tag, raw, self.encoding)
+            else:
+                self._fields[position] = DataField(tag, raw, self.encoding)
+        return self._fields[position]
+
+    def getLeader(self):
+        return self.leader
+
+    def getVariableField(self, tag):
+        """
+        Returns the first field with the tag or None
+
+        :param tag: MARC tag
+        """
+        for position, entry in enumerate(self.directory()):
+            if entry[0] == tag:
+                return self._field(position)
+        return None
+
+    def getVariableFields(self, tags=None):
+        """
+        Returns all fields, or the fields with a tag or any of a list of
+        tags, in record order
+
+        :param tags: None, MARC tag or list of MARC tags
+        :rtype: List
+        """
+        if tags is None:
+            return [self._field(position)
+                    for position in range(len(self.directory()))]
+        if isinstance(tags, str):
+            tags = (tags,)
+        return [self._field(position)
+                for position, entry in enumerate(self.directory())
+                if entry[0] in tags]
+
+    def getControlNumber(self):
+        field001 = self.getVariableField('001')
+        if field001 is not None:
+            return field001.getData()
+        return None
+
+    def as_marc(self):
+        """
+        Returns the record's ISO 2709 bytes
+
+        :rtype: bytes
+        """
+        return _bytes(self.raw)
+
+    def toString(self):
+        lines = [u'LEADER {0}'.format(self.leader.toString())]
+        for field in self.getVariableFields():
+            lines.append(field.toString())
+        return u'\n'.join(lines) + u'\n'
+
+    __str__ = toString
+
+
+def record_length(raw, offset=0):
+    """
+    Returns the record length from the leader starting at offset
+
+    :param raw: bytes or buffer
+    :param offset: Offset of the leader
+    :rtype: int
+    """
+    value = _bytes(raw[offset:offset + 5])
+    if len(value) < 5 or not value.isdigit():
+        raise MarcReadError("Invalid record length {0!r} at {1}".format(value,
+                                                                         offset))
+    return int(value)
+
+
+class MarcReader(object):
+    """
+    Reads records from a binary stream, slicing each record from a large
+    read buffer without copying it. Supports both iteration and MARC4J's
+    hasNext()/next() so it can stand in for MarcStreamReader.
+
+    :param stream: Binary file-like object
+    :param chunk_size: Bytes read from the stream at a time
+    """
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = b''
+        self.position = 0
+        self.offset = 0
+        self._next = None
+
+    def _fill(self, needed):
+        "Reads until needed bytes are available past the position"
+        available = len(self.buffer) - self.position
+        if available >= needed:
+            return True
+        chunks = [self.buffer[self.position:]]
+        while available < needed:
+            chunk = self.stream.read(max(self.chunk_size, needed - available))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            available += len(chunk)
+        self.buffer = b''.join(chunks)
+        self.position = 0
+        return available >= needed
+
+    def read(self):
+        """
+        Returns the next record or None at the end of the stream
+
+        :rtype: Record
+        """
+        # Skip line breaks some exports put between records
+        while self._fill(1) and self.buffer[self.position:self.position + 1] in (b'\n', b'\r'):
+            self.position += 1
+            self.offset += 1
+        if not self._fill(5):
+            if len(self.buffer) > self.position:
+                raise MarcReadError("Truncated record at {0}".format(self.offset))
+            return None
+        length = record_length(self.buffer, self.position)
+        if length < LEADER_LENGTH or not self._fill(length):
+            raise MarcReadError("Truncated record at {0}".format(self.offset))
+        start = self.position
+        self.position += length
+        self.offset += length
+        return Record(_view(self.buffer)[start:self.position])
+
+    def hasNext(self):
+        if self._next is None:
+            self._next = self.read()
+        return self._next is not None
+
+    def next(self):
+        if self._next is None:
+            self._next = self.read()
+        record, self._next = self._next, None
+        if record is None:
+            raise StopIteration
+        return record
+
+    __next__ = next
+
+    def __iter__(self):
+        return self
+
+
+class MarcWriter(object):
+    """
+    Writes records to a binary stream as ISO 2709, the native counterpart
+    of MARC4J's MarcStreamWriter
+
+    :param stream: Binary file-like object
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, record):
+        """
+        Writes a record, a RecordView's underlying record is written
+
+        :param record: Record or RecordView
+        """
+        record = getattr(record, 'record', record)
+        self.stream.write(record.as_marc())
+
+    def close(self):
+        self.stream.close()
+
+
+def as_marc(fields, leader=None):
+    """
+    Builds the ISO 2709 bytes for a record, used to create test and
+    sample records.
+
+    :param fields: List of (tag, value) with value the control field data
+                   or (indicators, [(code, data), ...]) for data fields
+    :param leader: 24 character leader, lengths are filled in
+    :rtype: bytes
+    """
+    if leader is None:
+        leader = u'00000nam a2200000 a 4500'
+    directory, data = [], []
+    offset = 0
+    for tag, value in fields:
+        if isinstance(value, tuple):
+            indicators, subfields = value
+            text = indicators + u''.join([SUBFIELD_DELIMITER + code + subfield
+                                          for code, subfield in subfields])
+        else:
+            text = value
+        encoded = text.encode('utf-8') + FIELD_TERMINATOR
+        directory.append(u'{0}{1:04d}{2:05d}'.format(tag, len(encoded),
+                                                     offset).encode('latin-1'))
+        data.append(encoded)
+        offset += len(encoded)
+    directory = b''.join(directory) + FIELD_TERMINATOR
+    base = LEADER_LENGTH + len(directory)
+    length = base + offset + 1
+    leader = u'{0:05d}{1}a{2}{3:05d}{4}'.format(length, leader[5:9], leader[10:12],
+                                               base, leader[17:])
+    return leader.encode('latin-1') + directory + b''.join(data) + RECORD_TERMINATOR
@@ -8,8 +8,10 @@
 """
 __author__ = "Jeremy Nelson"
 import argparse
+import array
+import base64
 import codecs
-import csv,re,sys,time,datetime
+import csv,re,sys,time,datetime,traceback
 import os
 import urllib 
 import urllib2
@@ -22,14 +24,37 @@ for jar_file in os.listdir(JAR_DIR):
 
 import pysolr
 import xml.etree.ElementTree as et
-import java.lang.System as System
-import java.io.FileInputStream as FileInputStream
-import java.io.FileOutputStream as FileOutputStream
-import org.marc4j as marc4j
-import org.apache.solr.client.solrj.SolrServerException as SolrServerException
-import org.apache.solr.client.solrj.impl.CommonsHttpSolrServer as CommonsHttpSolrServer
-import org.apache.solr.common.SolrInputDocument as SolrInputDocument
-import unicodedata,urllib,logging
+try:
+    import java.lang.System as System
+    import java.io.FileInputStream as FileInputStream
+    import java.io.FileOutputStream as FileOutputStream
+    import org.marc4j as marc4j
+    import org.apache.solr.client.solrj.SolrServerException as SolrServerException
+    import org.apache.solr.client.solrj.impl.CommonsHttpSolrServer as CommonsHttpSolrServer
+    import org.apache.solr.client.solrj.impl.StreamingUpdateSolrServer as StreamingUpdateSolrServer
+    import org.apache.solr.client.solrj.impl.BinaryRequestWriter as BinaryRequestWriter
+    import org.apache.solr.client.solrj.impl.XMLResponseParser as XMLResponseParser
+    import org.apache.solr.client.solrj.request.RequestWriter as RequestWriter
+    import org.apache.commons.io.output.CountingOutputStream as CountingOutputStream
+    import org.apache.commons.httpclient.Header as Header
+    import org.apache.solr.client.solrj.request.AbstractUpdateRequest as AbstractUpdateRequest
+    import org.apache.solr.client.solrj.request.UpdateRequest as UpdateRequest
+    import org.apache.solr.common.SolrInputDocument as SolrInputDocument
+    import java.util.ArrayList as ArrayList
+    import java.io.ByteArrayOutputStream as ByteArrayOutputStream
+except ImportError:
+    # Running on CPython, MARC is read with iso2709 and only the pysolr
+    # and CSV submissions are available
+    System = FileInputStream = FileOutputStream = marc4j = None
+    CommonsHttpSolrServer = StreamingUpdateSolrServer = SolrInputDocument = None
+    BinaryRequestWriter = XMLResponseParser = RequestWriter = None
+    ArrayList = ByteArrayOutputStream = None
+    CountingOutputStream = Header = None
+    AbstractUpdateRequest = UpdateRequest = None
+    class SolrServerException(Exception):
+        pass
+import threading,unicodedata,urllib,logging,zlib
+import iso2709
 from erm_update import load_csv
 
 ##logging.basicConfig(filename='%slog/%s-marc-solr-indexer.log' % (settings.BASE_DIR,
@@ -38,6 +63,12 @@ from erm_update import load_csv
 
 ELECTRONIC_JRNLS = load_csv()
 
+# Default MARC reader, the native reader is used when MARC4J is not available
+if marc4j is None:
+    MARC_READER = 'native'
+else:
+    MARC_READER = 'marc4j'
+
 
 try:
     set
@@ -46,6 +77,18 @@ except NameError:
 
 # local libs
 import marc_maps,tutt_maps
+from format_classifier import FormatClassifier
+from index_stats import ExtractorProfiler,RunStats,clock
+from pipeline import ExtractionPipeline,iter_reader
+from solr_update import Batcher,DEFAULT_BATCH_BYTES,PySolrClient,compact_record,estimate_size
+from solr_update import UpdateErrorLog,make_batch_controller,make_commit_policy
+from solr_http import ChunkedPost,ConcurrentUpdateClient,DEFAULT_GZIP_LEVEL,SolrUpdateError,gzip_body
+import csv_parts
+from solr_router import DEFAULT_ROUTE,RoutedClient,make_router
+from solr_schema import SchemaConformer,load_schema
+from field_mapping import compile_mappings,computed,field,run_extractors,step
+from record_view import RecordView
+from sharder import check_suppressed
 
 ISBN_RE = re.compile(r'(\b\d{10}\b|\b\d{13}\b)')
 LOCATION_RE = re.compile(r'\(\d+\)')
@@ -54,51 +97,6 @@ REF_LOC_RE = re.compile(r'(tarf*)')
 PER_LOC_RE = re.compile(r'(tper*)')
 UPC_RE = re.compile(r'\b\d{12}\b')
 
-FIELDNAMES = [
-    'access',
-    'audience',
-    'author',
-    'bib_num',
-    'callnum',
-    'callnumlayerone',
-    'collection',
-    'contents',
-    'corporate_name',
-    'ctrl_num',
-    'description',
-    'era',
-    'format',
-    'full_title',
-    'full_lc_subject',
-    'genre',
-    'holdings',
-    'id',
-    'imprint',
-    'isbn',
-    'issn',
-    'item_ids',
-    'language',
-    'language_dubbed',
-    'language_subtitles',
-    'lc_firstletter',
-    'location',
-    'marc_record',
-    'oclc_num',
-    'notes',
-    'personal_name',
-    'place',
-    'publisher',
-    'publisher_location',
-    'pubyear',
-    'series',
-    'summary',
-    'title',
-    'title_sort',
-    'topic',
-    'upc',
-    'url',
-]
-
 
 class RowDict(dict):
     """
@@ -175,20 +173,21 @@ def format_field(field):
     pymarc.format_field() logic
 
     :param field: MARC4j field
+    :rtype: unicode
     """
-    if field.tag < '010' and self.tag.isdigit():
+    if field.tag < '010' and field.tag.isdigit():
         return field.getData()
-    fielddata = ''
+    fielddata = u''
     for subfield in field.subfields:
         if subfield.code == '6':
             continue
         if not field.tag.startswith('6'):
-            fielddata += ' {0}'.format(subfield.getData())
+            fielddata += u' {0}'.format(subfield.getData())
         else:
             if subfield.code not in ('v','x','y','z'):
-                fielddata += ' {0}'.format(subfield.getData())
+                fielddata += u' {0}'.format(subfield.getData())
             else:
-                fielddata += ' -- {0}'.format(subfield.getData())
+                fielddata += u' -- {0}'.format(subfield.getData())
     return fielddata.strip()
 
 def get_access(record):
@@ -197,6 +196,7 @@ def get_access(record):
     :param record: MARC record
     :rtype: String message
     '''
+    record = RecordView.wrap(record)
     field994s = record.getVariableField('994')
     if access_search.search(field994s.toString()):
         return 'Online'
@@ -209,6 +209,7 @@ def get_author(record):
 
     :param record: MARC record
     """
+    record = RecordView.wrap(record)
     field100 = record.getVariableField('100')
     if field100 is not None:
         return format_field(field100)
@@ -222,12 +223,29 @@ def get_author(record):
 
 
 
+FORMAT_CLASSIFIER = FormatClassifier()
+
 def get_format(record):
-    '''Generates format, extends existing Kochief function.
+    '''Generates format from the format_classifier decision tables, then
+    checks the location for format overrides.
 
     :param record: MARC record
     :rtype: String of Format
     '''
+    record = RecordView.wrap(record)
+    format = FORMAT_CLASSIFIER.classify(record)
+    # Some formats are determined by location
+    return lookup_location(record, format)
+
+def legacy_get_format(record):
+    '''Generates format, extends existing Kochief function. Superseded by
+    get_format, kept as the reference the format_classifier tables are
+    benchmarked and checked against.
+
+    :param record: MARC record
+    :rtype: String of Format
+    '''
+    record = RecordView.wrap(record)
     format = ''
     field007 = record.getVariableField('007')
     if field007 is not None:
@@ -438,6 +456,7 @@ def lookup_location(record,format=None):
     :param record: MARC Record
     :param format: current format
     """
+    record = RecordView.wrap(record)
     location_list = locations = record.getVariableFields('994')
     for location in location_list:
          subfield_a = location.getSubfield('a')
@@ -458,6 +477,7 @@ def get_subject_names(record):
     :param record: MARC record, required
     :rtype: List of subject terms
     """
+    record = RecordView.wrap(record)
     output = []
     subject_name_fields = record.getVariableFields('600')
     for field in subject_name_fields:
@@ -590,6 +610,7 @@ def get_languages(language_codes):
 def get_callnumber(record):
     """Follows CC's practice, you may have different priority order
     for your call number."""
+    record = RecordView.wrap(record)
     callnumber = ''
     field086 = record.getVariableField('086')
     field099 = record.getVariableField('099')
@@ -611,6 +632,7 @@ def get_callnumber(record):
 def get_holdings(record):
     """Extracts serial holding from 850 and 945 fields
     """
+    record = RecordView.wrap(record)
     holdings = []
     all945s = record.getVariableFields('945')
     for field in all945s:
@@ -626,6 +648,7 @@ def get_holdings(record):
 def get_items(record,ils=None):
     """Extracts item id from bib record for web service call
     to active ILS."""
+    record = RecordView.wrap(record)
     items = []
     all945s = record.getVariableFields('945')
     for f945 in all945s:
@@ -639,6 +662,7 @@ lc_stub_search = re.compile(r"([A-Z]+)")
 
 def get_lcletter(record):
     '''Extracts LC letters from call number.'''
+    record = RecordView.wrap(record)
     lc_descriptions = []
     callnum = ''
     field050 = record.getVariableField('050')
@@ -668,6 +692,7 @@ def get_location(record):
     """Uses CC's location codes in Millennium to map physical
     location of the item to human friendly description from
     the tutt_maps LOCATION_CODE_MAP dict"""
+    record = RecordView.wrap(record)
     output = []
     locations = record.getVariableFields('994')
     code = None
@@ -687,6 +712,11 @@ def get_location(record):
             output.append('Unknown')
     return set(output)
 
+SUBJECT_TAGS = set(['600', '610', '611', '630', '648', '650',
+                    '651', '653', '654', '655', '656', '657',
+                    '658', '662', '690',
+                    '691', '696', '697', '698', '699'])
+
 def get_subjects(marc_record,record):
     """
     Helper function extracts all 6xx subject fields and adds to
@@ -696,13 +726,10 @@ def get_subjects(marc_record,record):
     :param record: Dictionary of indexed values
     :rtype dict: Returns modified record dict
     """
-    subject_fields = []  # gets all 65X fields
-    for tag in ['600', '610', '611', '630', '648', '650',
-                '651', '653', '654', '655', '656', '657',
-                '658', '662', '690',
-                '691', '696', '697', '698', '699']:
-        all_fields = marc_record.getVariableFields(tag)
-        subject_fields.extend(all_fields)
+    marc_record = RecordView.wrap(marc_record)
+    # gets all 6XX subject fields from the record's 6xx bucket
+    subject_fields = [field for field in marc_record.getRange('6')
+                      if field.getTag() in SUBJECT_TAGS]
     eras = []
     genres = []
     topics = []
@@ -746,6 +773,87 @@ def get_subjects(marc_record,record):
     record['full_lc_subject'] = set(full_lc_subjects)
     return record
 
+def get_marc_text(marc_record):
+    """
+    Returns the text rendering of the MARC record for the marc_record
+    field
+
+    :param marc_record: MARC record
+    """
+    return marc_record.__str__()  # Should output to MARCMaker format
+
+# What the marc_record field holds: 'text' the MARCMaker style rendering,
+# 'omit' no field, 'base64' the ISO 2709 bytes in base64, or 'compressed'
+# the zlib compressed ISO 2709 bytes in base64. Set per run with
+# set_marc_field.
+MARC_FIELD_MODES = ('text', 'omit', 'base64', 'compressed')
+MARC_FIELD = 'text'
+
+def set_marc_field(mode):
+    """
+    Sets what the marc_record field holds for the records that follow
+
+    :param mode: One of MARC_FIELD_MODES
+    """
+    global MARC_FIELD
+    if mode not in MARC_FIELD_MODES:
+        raise ValueError("marc_record field mode must be one of {0}, not {1!r}".format(
+            ', '.join(MARC_FIELD_MODES), mode))
+    MARC_FIELD = mode
+
+def get_marc_bytes(marc_record):
+    """
+    Returns the ISO 2709 bytes of a MARC record, the native reader's
+    records keep theirs, MARC4J records are written out again
+
+    :param marc_record: MARC record or RecordView
+    :rtype: String
+    """
+    marc_record = getattr(marc_record, 'record', marc_record)
+    if hasattr(marc_record, 'as_marc'):
+        return marc_record.as_marc()
+    output = ByteArrayOutputStream()
+    marc_writer = marc4j.MarcStreamWriter(output)
+    marc_writer.write(marc_record)
+    marc_writer.close()
+    return output.toByteArray().tostring()
+
+def get_marc_field(marc_record):
+    """
+    Returns the marc_record field value in the MARC_FIELD mode, None when
+    the field is omitted so the text is never rendered
+
+    :param marc_record: MARC record
+    """
+    if MARC_FIELD == 'omit':
+        return None
+    if MARC_FIELD == 'text':
+        return get_marc_text(marc_record)
+    raw = get_marc_bytes(marc_record)
+    if MARC_FIELD == 'compressed':
+        raw = zlib.compress(raw, 9)
+    return base64.b64encode(raw)
+
+def read_marc_field(value, mode):
+    """
+    Returns the ISO 2709 bytes stored in a base64 or compressed
+    marc_record field
+
+    :param value: Stored marc_record field value
+    :param mode: 'base64' or 'compressed'
+    :rtype: String
+    """
+    raw = base64.b64decode(value)
+    if mode == 'compressed':
+        raw = zlib.decompress(raw)
+    return raw
+
+def add_marc_field(marc_record, record, ils=None):
+    "Sets the record's marc_record field unless it is omitted"
+    value = get_marc_field(marc_record)
+    if value is not None:
+        record['marc_record'] = value
+
 def get_record(marc_record, ils=None):
     """
     Pulls the fields from a MARCReader record into a dictionary.
@@ -759,6 +867,8 @@ def get_record(marc_record, ils=None):
     George, Henry, 1839-1897.
     """
     record = {}
+    # Bucket the fields by tag once, every extractor below reads the view
+    marc_record = RecordView.wrap(marc_record)
     # TODO: split ILS-specific into separate parsers that subclass this one:
     # horizonmarc, iiimarc, etc.
     try:
@@ -782,9 +892,11 @@ def get_record(marc_record, ils=None):
         #record['id'] = ''
         # if it has no id let's not include it
         return
+    if ils == 'III' and 'id' not in record:
+        return
     # Checks and updates record by checking ELECTRONIC_JRNLS
     # for additional information from check-in records
-    if ELECTRONIC_JRNLS.has_key(record['id']):
+    if ELECTRONIC_JRNLS.has_key(record.get('id')):
         record_result = ELECTRONIC_JRNLS[record['id']]
         try:
             record.update(record_result)
@@ -796,7 +908,7 @@ def get_record(marc_record, ils=None):
         suppressed_codes = field999.getSubfields('f')
         for code in suppressed_codes:
             if code.getData() == 'n':
-                error_msg = "NOT INDEXING {0} RECORD".format(record['id'])
+                error_msg = "NOT INDEXING {0} RECORD".format(record.get('id'))
                 raise RecordSuppressedError(error_msg)
     # should ctrl_num default to 001 or 035?
     field001 = marc_record.getVariableField('001')
@@ -824,7 +936,7 @@ def get_record(marc_record, ils=None):
         languages_dubbed = get_languages(language_dubbed_codes)
         record['language_dubbed'] = []
         for language in languages_dubbed:
-            if language != record['language']:
+            if language != record.get('language'):
                 record['language_dubbed'].append(language)
         language_subtitles_codes = field041.getSubfields('b')
         languages_subtitles = get_languages(language_subtitles_codes)
@@ -936,42 +1048,727 @@ def get_record(marc_record, ils=None):
         url_subfield = field.getSubfields('u')
         for url in  url_subfield:
             record['url'].append(url.getData())
-    record['marc_record'] = marc_record.__str__()  # Should output to MARCMaker format
+    add_marc_field(marc_record, record)
     return record
 
+def get_bib_id(marc_record, ils=None):
+    """
+    Returns the record's bib id following the same rules as get_record,
+    907 subfield a with a fall back to the 035 for III records.
+
+    :param marc_record: MARC record
+    :param ils: ILS
+    :rtype: String or None
+    """
+    if ils != 'III':
+        return None
+    field907 = marc_record.getVariableField('907')
+    if field907 is None or field907.getSubfield('a') is None:
+        return None
+    bib_id = field907.getSubfield('a').getData()
+    if bib_id is not None and len(bib_id) >= 10:
+        return bib_id[1:-1]
+    bib_id = None
+    for field in marc_record.getVariableFields('035'):
+        sub_a = field.getSubfield('a')
+        if sub_a is not None:
+            sub_a = sub_a.getData()[1:-1]
+            if sub_a.startswith('b') and len(sub_a) == 8:
+                bib_id = sub_a
+    return bib_id
+
+def parse_041(record, marc_record):
+    """
+    Function parses 041 MARC field for dubbed and subtitle languages,
+    must run after parse_008 sets the record's language.
+
+    :param record: Dictionary of MARC record values
+    :param marc_record: MARC record
+    """
+    field041 = marc_record.getVariableField('041')
+    if field041 is not None:
+        languages_dubbed = get_languages(field041.getSubfields('a'))
+        record['language_dubbed'] = []
+        for language in languages_dubbed:
+            if language != record.get('language'):
+                record['language_dubbed'].append(language)
+        languages_subtitles = get_languages(field041.getSubfields('b'))
+        if languages_subtitles:
+            record['language_subtitles'] = languages_subtitles
+    return record
+
+def parse_title_sort(record, marc_record):
+    """
+    Function sets the title_sort from the 245 with the nonfiling
+    characters removed
+
+    :param record: Dictionary of MARC record values
+    :param marc_record: MARC record
+    """
+    field245 = marc_record.getVariableField('245')
+    if field245 is not None:
+        try:
+            nonfiling = int(field245.indicator2)
+        except ValueError:
+            nonfiling = 0
+        record['title_sort'] = format_field(field245)[nonfiling:].strip()
+    return record
+
+def get_series(record):
+    """
+    Returns first subfield a and v of the 440 and 490 series fields
+
+    :param record: MARC record
+    """
+    series = []
+    for tag in ('440', '490'):
+        for field in record.getVariableFields(tag):
+            for code in ('a', 'v'):
+                subfield = field.getSubfield(code)
+                if subfield is not None:
+                    series.append(subfield.getData())
+    return series
+
+def get_names(record, tag, codes):
+    """
+    Returns a name for each subfield code of the tag's fields, joining
+    repeated subfields
+
+    :param record: MARC record
+    :param tag: MARC tag, 700 or 710
+    :param codes: Subfield codes
+    """
+    names = []
+    for field in record.getVariableFields(tag):
+        for code in codes:
+            subfields = field.getSubfields(code)
+            names.append(' '.join([x.getData().strip() for x in subfields]))
+    return names
+
+NOTE_TAGS = ('500','501','502','503','504','505','506','507',
+             '509','510','512','513','514','515','516','517',
+             '518','519','521','545','547','590')
+
+# Declarative mapping from MARC to the Solr fields, in the order get_record
+# sets them. Local fields can be appended before compile_mappings is called.
+FIELD_MAPPINGS = [
+    field('ctrl_num', tags=('001',)),
+    field('oclc_num', tags=('001',),
+          normalizer=lambda value: value.replace("|a", "")),
+    step(('pubyear', 'audience', 'language'),
+         lambda marc_record, record, ils: parse_008(record, marc_record)),
+    computed('isbn',
+             lambda marc_record, record, ils: id_match(
+                 marc_record.getVariableFields('020'), ISBN_RE),
+             multi_valued=True),
+    computed('upc',
+             lambda marc_record, record, ils: id_match(
+                 marc_record.getVariableFields('024'), UPC_RE),
+             multi_valued=True),
+    step(('language_dubbed', 'language_subtitles'),
+         lambda marc_record, record, ils: parse_041(record, marc_record)),
+    computed('access', lambda marc_record, record, ils: get_access(marc_record)),
+    computed('author', lambda marc_record, record, ils: get_author(marc_record)),
+    computed('callnum',
+             lambda marc_record, record, ils: get_callnumber(marc_record)),
+    computed('callnumlayerone', lambda marc_record, record, ils: record['callnum']),
+    computed('format', lambda marc_record, record, ils: get_format(marc_record)),
+    computed('holdings',
+             lambda marc_record, record, ils: (record.get('holdings', []) +
+                                               get_holdings(marc_record)),
+             multi_valued=True),
+    computed('item_ids',
+             lambda marc_record, record, ils: get_items(marc_record, ils),
+             multi_valued=True),
+    computed('lc_firstletter',
+             lambda marc_record, record, ils: get_lcletter(marc_record),
+             multi_valued=True),
+    computed('location',
+             lambda marc_record, record, ils: get_location(marc_record),
+             multi_valued=True),
+    field('full_title', tags=('245',), formatter=format_field),
+    step(('title_sort',),
+         lambda marc_record, record, ils: parse_title_sort(record,
+                                                           marc_record)),
+    field('title', tags=('245',), subfields='a', repeat=False,
+          normalizer=lambda value: value.strip(' /:;')),
+    field('imprint', tags=('260',), formatter=format_field),
+    field('publisher_location', tags=('260',), subfields='a', repeat=False,
+          normalizer=normalize),
+    field('publisher', tags=('260',), subfields='b', repeat=False,
+          normalizer=normalize),
+    field('description', tags=('300',), formatter=format_field,
+          multi_valued=True),
+    computed('series', lambda marc_record, record, ils: get_series(marc_record),
+             multi_valued=True),
+    field('notes', tags=NOTE_TAGS, formatter=format_field, multi_valued=True),
+    field('contents', tags=('505',), subfields='a', repeat=False,
+          multi_valued=True),
+    field('summary', tags=('520',), formatter=format_field, multi_valued=True),
+    step(('genre', 'topic', 'place', 'era', 'full_lc_subject'),
+         lambda marc_record, record, ils: get_subjects(marc_record, record)),
+    computed('personal_name',
+             lambda marc_record, record, ils: get_names(marc_record, '700',
+                                                        'abcd'),
+             multi_valued=True),
+    computed('corporate_name',
+             lambda marc_record, record, ils: get_names(marc_record, '710',
+                                                        'ab'),
+             multi_valued=True),
+    field('url', tags=('856',), subfields='u', multi_valued=True),
+    step(('marc_record',),
+         lambda marc_record, record, ils: add_marc_field(marc_record, record)),
+    # Not set from the MARC record, kept as CSV columns
+    field('bib_num'),
+    field('collection'),
+    field('issn'),
+]
+
+RECORD_EXTRACTORS = compile_mappings(FIELD_MAPPINGS)
+
+# CSV columns in the order csv_solr_submission writes them, every field
+# FIELD_MAPPINGS produces and the id
+FIELDNAMES = [
+    'access',
+    'audience',
+    'author',
+    'bib_num',
+    'callnum',
+    'callnumlayerone',
+    'collection',
+    'contents',
+    'corporate_name',
+    'ctrl_num',
+    'description',
+    'era',
+    'format',
+    'full_title',
+    'full_lc_subject',
+    'genre',
+    'holdings',
+    'id',
+    'imprint',
+    'isbn',
+    'issn',
+    'item_ids',
+    'language',
+    'language_dubbed',
+    'language_subtitles',
+    'lc_firstletter',
+    'location',
+    'marc_record',
+    'oclc_num',
+    'notes',
+    'personal_name',
+    'place',
+    'publisher',
+    'publisher_location',
+    'pubyear',
+    'series',
+    'summary',
+    'title',
+    'title_sort',
+    'topic',
+    'upc',
+    'url',
+]
+
+def get_mapped_record(marc_record, ils=None, extractors=None):
+    """
+    Builds the record dict by running the compiled FIELD_MAPPINGS
+    extractors, get_record is the reference implementation it must
+    agree with.
+
+    :param marc_record: MARC record
+    :param ils: ILS, default to None
+    :param extractors: Compiled extractors, default to RECORD_EXTRACTORS
+    :rtype: dict or None if the record has no bib id
+    """
+    if extractors is None:
+        extractors = RECORD_EXTRACTORS
+    marc_record = RecordView.wrap(marc_record)
+    record = {}
+    bib_id = get_bib_id(marc_record, ils)
+    if ils == 'III':
+        if bib_id is None:
+            return
+        record['id'] = bib_id
+    if ELECTRONIC_JRNLS.has_key(record.get('id')):
+        record.update(ELECTRONIC_JRNLS[record['id']])
+    if check_suppressed(marc_record):
+        raise RecordSuppressedError(
+            "NOT INDEXING {0} RECORD".format(record.get('id')))
+    return run_extractors(extractors, marc_record, record, ils)
+
+PROFILER = ExtractorProfiler()
+
+# Functions timed when profiling, looked up through the module globals by
+# get_record and the FIELD_MAPPINGS extractors
+PROFILED_FUNCTIONS = (
+    'get_record',
+    'get_mapped_record',
+    'parse_008',
+    'parse_041',
+    'id_match',
+    'get_access',
+    'get_author',
+    'get_callnumber',
+    'get_format',
+    'lookup_location',
+    'get_holdings',
+    'get_items',
+    'get_lcletter',
+    'get_location',
+    'get_subjects',
+    'get_marc_text',
+    'get_marc_bytes',
+)
+
+def enable_profiling():
+    """
+    Turns on per-extractor timing by swapping timed wrappers into the
+    module for the PROFILED_FUNCTIONS.
+    """
+    PROFILER.instrument(globals(), PROFILED_FUNCTIONS)
+
+def disable_profiling():
+    """
+    Restores the untimed extractors
+    """
+    PROFILER.uninstrument(globals())
+
+# Set to False by parallel_index, which writes one combined report instead
+PROFILE_EACH_FILE = True
+
+# Semaphore bounding the Solr batches in flight across parallel workers,
+# set by parallel_index
+BATCH_SEMAPHORE = None
+
+# Update requests, one per batch, a streaming SolrJ server queues before
+# add blocks
+STREAMING_QUEUE_SIZE = 20
+
+if StreamingUpdateSolrServer is not None:
+    class LoggingStreamingSolrServer(StreamingUpdateSolrServer):
+        """
+        StreamingUpdateSolrServer that writes failed update requests to a
+        solr_update.UpdateErrorLog instead of only logging them through
+        slf4j. The failed documents are not available to handleError, so
+        the log records the error and the time of the failure.
+
+        :param solr_url: URL to solr server
+        :param queue_size: Update requests queued before add blocks
+        :param threads: Background connections draining the queue
+        :param log_filename: Log file, opened on the first failure
+        """
+
+        def __init__(self, solr_url, queue_size, threads, log_filename):
+            StreamingUpdateSolrServer.__init__(self, solr_url, queue_size, threads)
+            self.error_log = UpdateErrorLog(log_filename)
+
+        def handleError(self, ex):
+            self.error_log.failed(ex)
+
+        def close(self):
+            "Closes the error log and reports the failed batches"
+            self.error_log.close()
+            sys.stderr.write(self.error_log.report())
+
+if RequestWriter is not None:
+    def write_measured(writer_class, writer, request, output_stream):
+        """
+        Writes an update request, gzip compressed when the writer has a
+        gzip_level, recording its size as request_bytes
+        """
+        counter = CountingOutputStream(output_stream)
+        if writer.gzip_level:
+            buffer = ByteArrayOutputStream()
+            writer_class.write(writer, request, buffer)
+            body = buffer.toByteArray().tostring()
+            if writer.stats is not None:
+                writer.stats.add('uncompressed_bytes', len(body))
+            counter.write(array.array('b', gzip_body(body, writer.gzip_level)))
+        else:
+            writer_class.write(writer, request, counter)
+        if writer.stats is not None:
+            writer.stats.add('request_bytes', counter.getByteCount())
+
+    class MeasuredXMLRequestWriter(RequestWriter):
+        "SolrJ's default XML update encoding, recording request sizes"
+        stats = None
+        gzip_level = 0
+
+        def write(self, request, output_stream):
+            write_measured(RequestWriter, self, request, output_stream)
+
+    class MeasuredBinaryRequestWriter(BinaryRequestWriter):
+        "javabin update encoding, recording request sizes"
+        stats = None
+        gzip_level = 0
+
+        def write(self, request, output_stream):
+            write_measured(BinaryRequestWriter, self, request, output_stream)
+
+def open_solrj_server(solr_url, streaming=0, queue_size=STREAMING_QUEUE_SIZE,
+                      request_format='xml', stats=None, xml_response=False,
+                      gzip_level=0):
+    """
+    Opens a SolrJ server, CommonsHttpSolrServer sends every add on the
+    calling thread, with streaming the adds are queued and sent by
+    background connections
+
+    :param solr_url: URL to solr server
+    :param streaming: Background connections, 0 for synchronous adds
+    :param queue_size: Update requests queued before add blocks
+    :param request_format: Update encoding, 'xml' or 'javabin'. The
+                           streaming server always sends XML.
+    :param stats: index_stats.RunStats, the size of every update request
+                  is recorded as request_bytes
+    :param xml_response: Boolean, ask for XML responses instead of javabin
+    :param gzip_level: Compression level of the update request bodies,
+                       compressed by the thread sending them and sent with
+                       Content-Encoding: gzip, 0 sends them uncompressed.
+                       Only the add requests are compressed, commits sent
+                       as form parameters need a server without it.
+    """
+    if request_format not in ('xml', 'javabin'):
+        raise ValueError("Unknown update request format {0}".format(
+            request_format))
+    if not streaming:
+        solr_server = CommonsHttpSolrServer(solr_url)
+        if request_format == 'javabin':
+            writer = MeasuredBinaryRequestWriter()
+        else:
+            writer = MeasuredXMLRequestWriter()
+        writer.stats = stats
+        writer.gzip_level = gzip_level
+        solr_server.setRequestWriter(writer)
+        if gzip_level:
+            solr_server.getHttpClient().getHostConfiguration().getParams().setParameter(
+                'http.default-headers', ArrayList([Header('Content-Encoding', 'gzip')]))
+        if xml_response:
+            solr_server.setParser(XMLResponseParser())
+        return solr_server
+    if request_format != 'xml':
+        raise ValueError("The streaming SolrJ server only sends XML updates")
+    if gzip_level:
+        raise ValueError("The streaming SolrJ server does not compress updates")
+    log_filename = 'solr-index-errors-{0}.log'.format(
+        datetime.datetime.today().strftime("%Y-%m-%d"))
+    return LoggingStreamingSolrServer(solr_url, queue_size, streaming,
+                                      log_filename)
+
+class SolrJClient(object):
+    """
+    Adapts a SolrJ server to the add/commit calls the solr_update commit
+    policies use
+
+    :param solr_server: SolrJ SolrServer
+    :param commit_server: SolrJ SolrServer commits are sent to, defaults
+                          to solr_server
+    """
+
+    def __init__(self, solr_server, commit_server=None):
+        self.solr_server = solr_server
+        self.commit_server = commit_server or solr_server
+        self.streaming = (StreamingUpdateSolrServer is not None and
+                          isinstance(solr_server, StreamingUpdateSolrServer))
+
+    def add(self, docs, commit_within=None):
+        if commit_within is None:
+            return self.solr_server.add(docs)
+        request = UpdateRequest()
+        request.add(docs)
+        request.setCommitWithin(commit_within)
+        return request.process(self.solr_server)
+
+    def commit(self, soft=False):
+        if not soft:
+            return self.commit_server.commit()
+        request = UpdateRequest()
+        request.setAction(AbstractUpdateRequest.ACTION.COMMIT, False, False)
+        request.setParam('softCommit', 'true')
+        return request.process(self.commit_server)
+
+    def flush(self):
+        "Waits for a streaming server to send everything queued"
+        if self.streaming:
+            self.solr_server.blockUntilFinished()
+
+    def close(self):
+        if self.streaming:
+            self.solr_server.close()
+
+def open_solrj_client(solr_url, streaming=0, request_format='xml',
+                      stats=None, gzip_level=0, adaptive=None):
+    """
+    Opens a SolrJClient for a submission, see open_solrj_server. With
+    gzip_level the commits go through a second, uncompressed server.
+    Adaptive batch sizing needs each add's latency, which a streaming
+    server does not report, so the two are not used together.
+
+    :param adaptive: Adaptive batch size spec of the submission
+    :rtype: SolrJClient
+    """
+    if streaming and adaptive is not None:
+        raise ValueError("Adaptive batch sizing does not work with a streaming SolrJ server")
+    solr_server = open_solrj_server(solr_url,
+                                    streaming,
+                                    request_format=request_format,
+                                    stats=stats,
+                                    gzip_level=gzip_level)
+    commit_server = None
+    if gzip_level:
+        commit_server = CommonsHttpSolrServer(solr_url)
+    return SolrJClient(solr_server, commit_server)
+
+def open_update_client(open_client, solr_url, stats, nodes=None, route=None,
+                       batch_docs=1000, batch_bytes=None, adaptive=None):
+    """
+    Opens the update client of a submission, one client for solr_url or,
+    given nodes, a solr_router.RoutedClient that sends each document
+    straight to its node
+
+    :param open_client: Function of (url, stats) returning a client
+    :param solr_url: URL to solr server
+    :param stats: index_stats.RunStats of the run
+    :param nodes: List of Solr node URLs, None sends everything to solr_url
+    :param route: Routing rule spec, see solr_router.make_router
+    :param batch_docs: Documents per add to one node
+    :param batch_bytes: Estimated bytes per add to one node, None for no limit
+    :param adaptive: Adaptive batch size spec of every node
+    """
+    if not nodes:
+        return open_client(solr_url, stats)
+    return RoutedClient(nodes, open_client, make_router(route), batch_docs,
+                        batch_bytes, adaptive)
+
+def send_batch(client, docs, commit_policy=None):
+    """
+    Adds a batch of documents to Solr, waiting for a free slot first when
+    BATCH_SEMAPHORE is set, then lets the commit policy commit. A client
+    with its own semaphore sends the batch later on another thread and
+    waits for the slot itself.
+
+    :param client: SolrJClient or solr_update.PySolrClient
+    :param docs: List of documents
+    :param commit_policy: solr_update.CommitPolicy
+    :rtype: float seconds the add took, not counting the wait for a slot,
+            or the latency of a client that reports one, such as
+            solr_router.RoutedClient
+    """
+    commit_within = None
+    if commit_policy is not None:
+        commit_within = commit_policy.commit_within
+    semaphore = BATCH_SEMAPHORE
+    if getattr(client, 'semaphore', None) is not None:
+        semaphore = None
+    if semaphore is not None:
+        semaphore.acquire()
+    start = clock()
+    try:
+        client.add(docs, commit_within=commit_within)
+    finally:
+        elapsed = clock() - start
+        if semaphore is not None:
+            semaphore.release()
+    if commit_policy is not None:
+        commit_policy.after_batch(client)
+    if getattr(client, 'latency', None) is not None:
+        return client.latency()
+    return elapsed
+
+def finish_commits(client, commit_policy):
+    """
+    Runs the commit policy's final commit and reports the time spent
+    committing, adding it to the extractor timings when profiling
+
+    :param client: SolrJClient or solr_update.PySolrClient, None for CSV
+    :param commit_policy: solr_update.CommitPolicy
+    """
+    if client is not None:
+        commit_policy.finish(client)
+    sys.stderr.write(commit_policy.report())
+    if PROFILER.enabled and commit_policy.commit_times.count:
+        PROFILER.merge({'solr_commit': commit_policy.commit_times.to_dict()})
+
+def write_profile(marc_filename, json_filename=None, run_stats=None):
+    """
+    Prints the extractor timings and writes them as JSON if profiling
+    is enabled, then starts the timings over for the next file
+
+    :param marc_filename: Full path and name of the MARC 21 file indexed
+    :param json_filename: JSON file name, defaults to
+                          profile-{marc file name}.json
+    :param run_stats: index_stats.RunStats written with the timings
+    """
+    if not PROFILER.enabled or not PROFILE_EACH_FILE:
+        return
+    if json_filename is None:
+        json_filename = 'profile-{0}.json'.format(
+            os.path.splitext(os.path.basename(marc_filename))[0])
+    sys.stderr.write(PROFILER.report())
+    extra = {'marc_filename': marc_filename}
+    if run_stats is not None:
+        extra['run_stats'] = run_stats.to_dict()
+    PROFILER.write_json(json_filename, **extra)
+    sys.stderr.write("\tProfile written to {0}\n".format(json_filename))
+    PROFILER.reset()
+
+def open_marc_reader(marc_filename, reader=None):
+    """
+    Opens a MARC file with MARC4J's MarcStreamReader or the native
+    iso2709 reader, both support hasNext() and next()
+
+    :param marc_filename: Full path and name of MARC 21 file
+    :param reader: 'marc4j' or 'native', defaults to marc4j on Jython
+    """
+    if reader is None:
+        reader = MARC_READER
+    if reader == 'native':
+        return iso2709.MarcReader(open(marc_filename, 'rb'))
+    return marc4j.MarcStreamReader(FileInputStream(marc_filename))
+
+def error_filename(marc_filename=None):
+    """
+    Returns the day's MARC file name for records that failed to index,
+    one per input file so parallel workers do not overwrite each other's
+
+    :param marc_filename: MARC file being indexed
+    """
+    day = datetime.datetime.today().strftime("%Y-%m-%d")
+    if marc_filename is None:
+        return 'solr-index-errors-{0}.mrc'.format(day)
+    return 'solr-index-errors-{0}-{1}.mrc'.format(
+        day, os.path.splitext(os.path.basename(marc_filename))[0])
+
+def open_error_writer(reader=None, marc_filename=None):
+    """
+    Opens the day's MARC file for records of marc_filename that failed to
+    index, see error_filename
+
+    :param reader: 'marc4j' or 'native', defaults to marc4j on Jython
+    :param marc_filename: MARC file being indexed
+    """
+    if reader is None:
+        reader = MARC_READER
+    filename = error_filename(marc_filename)
+    if reader == 'native':
+        return iso2709.MarcWriter(open(filename, 'wb'))
+    return marc4j.MarcStreamWriter(FileOutputStream(filename))
+
 def get_row(record):
     """Converts record dict to row for CSV input."""
     row = RowDict(record)
     return row
 
 def get_multi(solr_url):
-    """Inspect solr schema.xml for multivalue fields."""
-    multivalue_fieldnames = []
-    solr_schema_url = "{0}admin/file/?file=schema.xml".format(solr_url)
-    solr_schema = urllib2.urlopen(solr_schema_url).read()
-    schema = et.fromstring(solr_schema)
-    fields_element = schema.find('fields')
-    field_elements = fields_element.findall('field')
-    for field in field_elements:
-        if field.get('multiValued') == 'true':
-            multivalue_fieldnames.append(field.get('name'))
-    return multivalue_fieldnames
-
-def load_solr(csv_file,solr_url):
+    """Multivalue fields from the solr schema, cached by solr_schema."""
+    return load_schema(solr_url).multi_valued_fields()
+
+# Record fields renamed to fit the Solr schema before they are sent,
+# record name: schema name
+SCHEMA_RENAMES = {}
+
+def open_schema_conformer(solr_url, check_schema=True):
     """
-    Load CSV file into Solr.  solr_params are a dictionary of parameters
-    sent to solr on the index request.
+    Returns a solr_schema.SchemaConformer that drops or renames the record
+    fields the Solr schema does not have, None when check_schema is False
+    or the schema cannot be read, in which case records are sent as they
+    are
+
+    :param solr_url: URL to solr server
+    :param check_schema: Boolean, fit records to the schema
+    """
+    if not check_schema:
+        return None
+    try:
+        schema = load_schema(solr_url)
+    except Exception:
+        sys.stderr.write("Unable to read the Solr schema, fields are not checked: {0}\n".format(
+            sys.exc_info()[1]))
+        return None
+    return SchemaConformer(schema, SCHEMA_RENAMES)
+
+def csv_params(solr_url, commit_policy=None):
+    """
+    Returns the /update/csv request parameters, a split on | for every
+    multi-valued field in the schema and the commit policy's parameters
+
+    :param solr_url: URL to solr server
+    :param commit_policy: solr_update.CommitPolicy, None for only the
+                          split parameters
+    :rtype: dict
     """
-    file_path = os.path.abspath(csv_file)
     solr_params = {}
     for fieldname in get_multi(solr_url):
         tag_split = "f.%s.split" % fieldname
         solr_params[tag_split] = 'true'
         tag_separator = "f.%s.separator" % fieldname
         solr_params[tag_separator] = '|'
+    if commit_policy is not None:
+        solr_params.update(commit_policy.params())
+    return solr_params
+
+def open_csv_stream(solr_url, commit_policy):
+    """
+    Opens a chunked POST to /update/csv that the CSV rows are written to
+    as they are made, so Solr ingests while the MARC file is read
+
+    :param solr_url: URL to solr server
+    :param commit_policy: solr_update.CommitPolicy
+    :rtype: solr_http.ChunkedPost
+    """
+    params = urllib.urlencode(csv_params(solr_url, commit_policy))
+    update_url = solr_url + 'update/csv?{0}'.format(params)
+    print("\nStreaming records into Solr {0}...".format(update_url))
+    return ChunkedPost(update_url, 'text/csv; charset=utf-8')
+
+def load_csv_parts(part_writer, solr_url, commit_policy, threads=4):
+    """
+    Loads the CSV part files with threads requests at once and no commit
+    per request, lets the commit policy commit once at the end, and
+    reports each part. Each part is removed once it loads, so only the
+    failed parts stay on disk to be loaded again.
+
+    :param part_writer: csv_parts.PartWriter the rows were written with
+    :param solr_url: URL to solr server
+    :param commit_policy: solr_update.CommitPolicy
+    :param threads: Parts loaded at once
+    :rtype: List of csv_parts.load_part results
+    """
+    solr_params = csv_params(solr_url)
+    if commit_policy.commit_within is not None:
+        solr_params['commitWithin'] = str(commit_policy.commit_within)
+    update_url = solr_url + 'update/csv?{0}'.format(urllib.urlencode(solr_params))
+    print("\nLoading {0} CSV parts into Solr {1}...".format(
+        len(part_writer.filenames), update_url))
+    commit_client = csv_parts.CommitClient(solr_url)
+    results = csv_parts.load_parts(
+        part_writer.filenames,
+        update_url,
+        threads,
+        after_part=lambda result: commit_policy.after_batch(commit_client),
+        remove_loaded=True)
+    finish_commits(commit_client, commit_policy)
+    sys.stderr.write(csv_parts.report(results, part_writer.rows))
+    failed = [result['filename'] for result in results if result['error']]
+    if failed:
+        sys.stderr.write("\t{0} of {1} parts failed, load them again with load_solr\n".format(
+            len(failed), len(results)))
+    return results
+
+def load_solr(csv_file,solr_url,commit_policy=None):
+    """
+    Load CSV file into Solr.  solr_params are a dictionary of parameters
+    sent to solr on the index request, the split parameters come from
+    the schema and the commit parameters from the commit policy.
+    """
+    commit_policy = make_commit_policy(commit_policy)
+    file_path = os.path.abspath(csv_file)
+    solr_params = csv_params(solr_url, commit_policy)
     solr_params['stream.file'] = file_path
     solr_params['stream.contentType'] = 'text/plain;charset=utf-8'
-    solr_params['commit'] = 'true'
     params = urllib.urlencode(solr_params)
     update_url = solr_url + 'update/csv?{0}'.format(params)
     print("\nLoading records into Solr {0}...".format(update_url))
@@ -985,61 +1782,50 @@ def load_solr(csv_file,solr_url):
 
 
 
-def solr_submission(solr_url, marc_filename, ils='III'):
+def prepare_record(record, conformer=None):
     """
-    Uses Solr java library to create a document batch to send to a Solr server
+    Fits a record dict to the Solr schema and compacts it, dropping empty
+    values and repeated values, before it is serialized
 
-    :param solr_url: URL to solr server
-    :param marc_filename: Full path and name of MARC 21 file
-    :param ils: ILS, default to III
+    :param record: Dictionary of indexed values
+    :param conformer: solr_schema.SchemaConformer or None
+    :rtype: dict
+    """
+    if conformer is not None:
+        record = conformer(record)
+    return compact_record(record)
+
+def build_solr_doc(record):
+    """
+    Converts a record dict to a SolrJ SolrInputDocument, multi-valued
+    fields are added as one java.util.ArrayList each instead of SolrJ
+    converting the Python list
+
+    :param record: Dictionary of indexed values
+    :rtype: SolrInputDocument
+    """
+    solr_doc = SolrInputDocument()
+    for key,value in record.iteritems():
+        if isinstance(value, (list, tuple, set, frozenset)):
+            value = ArrayList(value)
+        solr_doc.addField(key,value)
+    return solr_doc
+
+def write_finished(start, count, error_count, suppressed, run_stats=None,
+                   conformer=None, solr_client=None):
+    """
+    Writes the end of run summary for a SolrJ submission to stderr
+
+    :param start: datetime the run started
+    :param count: Number of MARC records read
+    :param error_count: Number of records that failed
+    :param suppressed: Number of suppressed records
+    :param run_stats: index_stats.RunStats, such as the batch sizes
+    :param conformer: solr_schema.SchemaConformer, reports the fields it
+                      changed
+    :param solr_client: Update client, a solr_router.RoutedClient reports
+                        each node's throughput
     """
-    marc_file = FileInputStream(marc_filename)
-    marc_reader = marc4j.MarcStreamReader(marc_file)
-    error_file = FileOutputStream('solr-index-errors-{0}.mrc'.format(
-        datetime.datetime.today().strftime("%Y-%m-%d")))
-    error_writer = marc4j.MarcStreamWriter(error_file)
-    docs,count,error_count,suppressed = [],0,0,0
-    start = datetime.datetime.today()
-    solr_server = CommonsHttpSolrServer(solr_url)
-    while marc_reader.hasNext():
-        try:
-            count += 1
-            marc_record = marc_reader.next()
-            record = get_record(marc_record, ils=ils)
-            if record is not None:
-                solr_doc = SolrInputDocument()
-                for key,value in record.iteritems():
-                    solr_doc.addField(key,value)
-                docs.append(solr_doc)
-            if count % 1000:
-                sys.stderr.write(".")
-            else:
-                sys.stderr.write(str(count))
-                solr_server.add(docs)
-                solr_response = solr_server.commit()
-                docs = []
-                System.gc()
-                sys.stderr.write(" solr-update:{0} time-lapsed: {1} ".format(count,
-                (datetime.datetime.now()-start).seconds / 60.0))
-        except RecordSuppressedError, e:
-            suppressed += 1
-            continue
-        except Exception, e:
-            import traceback, os.path
-            tb = traceback.extract_stack()
-            traceback.print_exc(tb)
-            exc_type,exc_obj,exc_tb = sys.exc_info()
-            error = "Failed to process MARC error={0} {1} count={2}\n".format(exc_obj,
-                                                                              exc_tb,
-                                                                              count)
-            error_count += 1
-            sys.stderr.write(error)
-            return
-            if marc_record is not None:
-                error_writer.write(marc_record)
-    if len(docs) > 0:
-        solr_server.add(docs)
-        solr_server.commit()
     finished_indexing = datetime.datetime.today()
     total_minutes = (finished_indexing-start).seconds / 60.0
     index_finished_msg = "\nTotal MARC records of {0}\n".format(count)
@@ -1049,130 +1835,493 @@ def solr_submission(solr_url, marc_filename, ils='III'):
     '''.format(start.isoformat(),
         finished_indexing.isoformat(),
         total_minutes,
-        count / total_minutes)
+        count / (total_minutes or 1.0))
     index_finished_msg += "\tErrors:{0} Suppressed:{1}\n".format(error_count,suppressed)
+    if run_stats is not None:
+        index_finished_msg += run_stats.report()
+    if conformer is not None:
+        index_finished_msg += conformer.report()
+    if hasattr(solr_client, 'report'):
+        index_finished_msg += solr_client.report()
     sys.stderr.write(index_finished_msg)
 
+def write_record_error(error_writer, marc_record, count):
+    """
+    Reports the record whose extraction raised the exception being
+    handled and writes it to the error file
 
-def py_solr_submission(solr_url, marc_filename, ils='III'):
+    :param error_writer: Writer from open_error_writer
+    :param marc_record: The failed MARC record, None if it could not be read
+    :param count: Number of the record in the file
+    """
+    traceback.print_exc()
+    sys.stderr.write("Failed to process MARC error={0} count={1}\n".format(
+        sys.exc_info()[1],
+        count))
+    if marc_record is not None:
+        error_writer.write(marc_record)
+
+def pipelined_solr_submission(solr_url, marc_filename, ils='III', reader=None,
+                              workers=4, ordered=False, queue_size=1000,
+                              commit_policy=None, batch_docs=1000,
+                              batch_bytes=DEFAULT_BATCH_BYTES, adaptive=None,
+                              streaming=0, request_format='xml',
+                              check_schema=True, marc_field=None,
+                              gzip_level=0, nodes=None, route=None):
+    """
+    Threaded version of solr_submission, MARC records are read on one
+    thread, get_record and the SolrInputDocument conversion run on a pool
+    of worker threads, and the batches are sent to Solr from the calling
+    thread. A record that fails is logged and written to the error file
+    without stopping the run.
+
+    :param solr_url: URL to solr server
+    :param marc_filename: Full path and name of MARC 21 file
+    :param ils: ILS, default to III
+    :param reader: MARC reader, 'marc4j' or 'native'
+    :param workers: Number of extraction threads
+    :param ordered: Boolean, send documents to Solr in file order
+    :param queue_size: Bound of the queues between the stages
+    :param streaming: Background connections of a streaming SolrJ server,
+                      0 sends each batch on the calling thread
+    :param request_format: Update encoding, 'xml' or the smaller and
+                           faster to build 'javabin'
+    :param check_schema: Boolean, drop or rename the fields the Solr schema
+                         does not have before sending
+    :param marc_field: marc_record field mode from MARC_FIELD_MODES, None
+                       keeps the current MARC_FIELD
+    :param gzip_level: Compression level of the update request bodies, 0
+                       sends them uncompressed; not with streaming
+    :param nodes: List of Solr node URLs, each document is sent straight
+                  to its node with a batch per node; solr_url is still
+                  used for the schema
+    :param route: Routing rule, 'hash' or 'hash:<field>', default hash of
+                  the id
+    :param commit_policy: solr_update commit policy or spec, default final
+    :param batch_docs: Documents per Solr add
+    :param batch_bytes: Estimated bytes per Solr add, None for no limit
+    :param adaptive: Adaptive batch size spec '<target seconds>[:<min>:<max>]'
+                     or solr_update.AdaptiveBatchSize, None for fixed
+                     batch_docs; not with streaming
+    """
+    if marc_field is not None:
+        set_marc_field(marc_field)
+    marc_reader = open_marc_reader(marc_filename, reader)
+    error_writer = open_error_writer(reader, marc_filename)
+    commit_policy = make_commit_policy(commit_policy)
+    run_stats = RunStats()
+    def open_client(url, stats):
+        return open_solrj_client(url,
+                                 streaming,
+                                 request_format=request_format,
+                                 stats=stats,
+                                 gzip_level=gzip_level,
+                                 adaptive=adaptive)
+    solr_client = open_update_client(open_client, solr_url, run_stats,
+                                     nodes, route, batch_docs, batch_bytes,
+                                     adaptive)
+    batcher = Batcher(batch_docs, batch_bytes, run_stats,
+                      make_batch_controller(adaptive))
+    conformer = open_schema_conformer(solr_url, check_schema)
+    state = {'count': 0, 'errors': 0, 'suppressed': 0}
+    start = datetime.datetime.today()
+
+    def extract(marc_record):
+        record = get_record(marc_record, ils=ils)
+        if record is not None:
+            record = prepare_record(record, conformer)
+            return build_solr_doc(record), estimate_size(record)
+
+    def progress():
+        state['count'] += 1
+        if state['count'] % 1000:
+            sys.stderr.write(".")
+        else:
+            sys.stderr.write(str(state['count']))
+
+    def write(marc_record, result):
+        progress()
+        if result is not None and batcher.add(*result):
+            batcher.sent(send_batch(solr_client, batcher.take(), commit_policy))
+            sys.stderr.write(" solr-update:{0} time-lapsed: {1} ".format(
+                state['count'],
+                (datetime.datetime.now()-start).seconds / 60.0))
+
+    def error(marc_record, exc_info):
+        progress()
+        if isinstance(exc_info[1], RecordSuppressedError):
+            state['suppressed'] += 1
+            return
+        state['errors'] += 1
+        sys.stderr.write("Failed to process MARC error={0} count={1}\n".format(
+            exc_info[1],
+            state['count']))
+        error_writer.write(marc_record)
+
+    extraction = ExtractionPipeline(extract,
+                                    write,
+                                    error,
+                                    workers=workers,
+                                    queue_size=queue_size,
+                                    ordered=ordered)
+    extraction.run(iter_reader(marc_reader))
+    if len(batcher) > 0:
+        batcher.sent(send_batch(solr_client, batcher.take(), commit_policy))
+    solr_client.flush()
+    finish_commits(solr_client, commit_policy)
+    solr_client.close()
+    error_writer.close()
+    write_finished(start, state['count'], state['errors'], state['suppressed'],
+                   run_stats, conformer, solr_client)
+    write_profile(marc_filename, run_stats=run_stats)
+
+def solr_submission(solr_url, marc_filename, ils='III', reader=None,
+                    workers=0, ordered=False, commit_policy=None,
+                    batch_docs=1000, batch_bytes=DEFAULT_BATCH_BYTES,
+                    adaptive=None, streaming=0, request_format='xml',
+                    check_schema=True, marc_field=None, gzip_level=0,
+                    nodes=None, route=None):
+    """
+    Uses Solr java library to create a document batch to send to a Solr server
+
+    :param solr_url: URL to solr server
+    :param marc_filename: Full path and name of MARC 21 file
+    :param ils: ILS, default to III
+    :param reader: MARC reader, 'marc4j' or 'native'
+    :param workers: Number of extraction threads, 0 runs serially
+    :param ordered: Boolean, keep file order when workers are used
+    :param streaming: Background connections of a streaming SolrJ server
+                      that queues the batches, failed batches are written
+                      to solr-index-errors-{date}.log; 0 sends each batch
+                      on the calling thread
+    :param request_format: Update encoding, 'xml' or the smaller and
+                           faster to build 'javabin'
+    :param check_schema: Boolean, drop or rename the fields the Solr schema
+                         does not have before sending
+    :param marc_field: marc_record field mode from MARC_FIELD_MODES, None
+                       keeps the current MARC_FIELD
+    :param gzip_level: Compression level of the update request bodies, 0
+                       sends them uncompressed; not with streaming
+    :param nodes: List of Solr node URLs, each document is sent straight
+                  to its node with a batch per node; solr_url is still
+                  used for the schema
+    :param route: Routing rule, 'hash' or 'hash:<field>', default hash of
+                  the id
+    :param commit_policy: solr_update commit policy or spec, default final
+    :param batch_docs: Documents per Solr add
+    :param batch_bytes: Estimated bytes per Solr add, None for no limit
+    :param adaptive: Adaptive batch size spec '<target seconds>[:<min>:<max>]'
+                     or solr_update.AdaptiveBatchSize, None for fixed
+                     batch_docs; not with streaming
+    """
+    if workers:
+        return pipelined_solr_submission(solr_url,
+                                         marc_filename,
+                                         ils=ils,
+                                         reader=reader,
+                                         workers=workers,
+                                         ordered=ordered,
+                                         commit_policy=commit_policy,
+                                         batch_docs=batch_docs,
+                                         batch_bytes=batch_bytes,
+                                         adaptive=adaptive,
+                                         streaming=streaming,
+                                         request_format=request_format,
+                                         check_schema=check_schema,
+                                         marc_field=marc_field,
+                                         gzip_level=gzip_level,
+                                         nodes=nodes,
+                                         route=route)
+    if marc_field is not None:
+        set_marc_field(marc_field)
+    marc_reader = open_marc_reader(marc_filename, reader)
+    error_writer = open_error_writer(reader, marc_filename)
+    count,error_count,suppressed = 0,0,0
+    start = datetime.datetime.today()
+    commit_policy = make_commit_policy(commit_policy)
+    run_stats = RunStats()
+    def open_client(url, stats):
+        return open_solrj_client(url,
+                                 streaming,
+                                 request_format=request_format,
+                                 stats=stats,
+                                 gzip_level=gzip_level,
+                                 adaptive=adaptive)
+    solr_client = open_update_client(open_client, solr_url, run_stats,
+                                     nodes, route, batch_docs, batch_bytes,
+                                     adaptive)
+    batcher = Batcher(batch_docs, batch_bytes, run_stats,
+                      make_batch_controller(adaptive))
+    conformer = open_schema_conformer(solr_url, check_schema)
+    try:
+        while marc_reader.hasNext():
+            count += 1
+            marc_record = doc = None
+            try:
+                marc_record = marc_reader.next()
+                record = get_record(marc_record, ils=ils)
+                if record is not None:
+                    record = prepare_record(record, conformer)
+                    doc = build_solr_doc(record)
+            except RecordSuppressedError:
+                suppressed += 1
+                continue
+            except Exception:
+                error_count += 1
+                write_record_error(error_writer, marc_record, count)
+                continue
+            if count % 1000:
+                sys.stderr.write(".")
+            else:
+                sys.stderr.write(str(count))
+            if doc is not None and batcher.add(doc, estimate_size(record)):
+                batcher.sent(send_batch(solr_client, batcher.take(), commit_policy))
+                if commit_policy.name == 'batch':
+                    System.gc()
+                sys.stderr.write(" solr-update:{0} time-lapsed: {1} ".format(count,
+                (datetime.datetime.now()-start).seconds / 60.0))
+        if len(batcher) > 0:
+            batcher.sent(send_batch(solr_client, batcher.take(), commit_policy))
+        solr_client.flush()
+        finish_commits(solr_client, commit_policy)
+        solr_client.close()
+    finally:
+        error_writer.close()
+    write_finished(start, count, error_count, suppressed, run_stats, conformer,
+                   solr_client)
+    write_profile(marc_filename, run_stats=run_stats)
+    return {'filename': marc_filename,
+            'count': count,
+            'errors': error_count,
+            'suppressed': suppressed,
+            'run_stats': run_stats.to_dict()}
+
+
+def py_solr_submission(solr_url, marc_filename, ils='III', reader=None,
+                       commit_policy=None, batch_docs=1500,
+                       batch_bytes=DEFAULT_BATCH_BYTES, adaptive=None,
+                       connections=0, check_schema=True, marc_field=None,
+                       gzip_level=0, nodes=None, route=None):
     """
     Uses solr python library to create a document batch to send to a Solr server
 
     :param solr_url: URL to solr server
     :param marc_filename: Full path and name of MARC 21 file
     :param ils: ILS, default to III
+    :param reader: MARC reader, 'marc4j' or 'native'
+    :param commit_policy: solr_update commit policy or spec, default final
+    :param batch_docs: Documents per Solr add
+    :param batch_bytes: Estimated bytes per Solr add, None for no limit
+    :param adaptive: Adaptive batch size spec '<target seconds>[:<min>:<max>]'
+                     or solr_update.AdaptiveBatchSize, None for fixed
+                     batch_docs; needs connections 0 and no gzip_level
+    :param connections: Batches sent to Solr at once over keep-alive
+                        connections by solr_http.ConcurrentUpdateClient,
+                        0 sends each batch with pysolr and waits for it
+    :param check_schema: Boolean, drop or rename the fields the Solr schema
+                         does not have before sending
+    :param marc_field: marc_record field mode from MARC_FIELD_MODES, None
+                       keeps the current MARC_FIELD
+    :param gzip_level: Compression level of the update request bodies,
+                       compressed on the ConcurrentUpdateClient sender
+                       threads with one connection if connections is 0;
+                       0 sends them uncompressed
+    :param nodes: List of Solr node URLs, each document is sent straight
+                  to its node with a batch per node; solr_url is still
+                  used for the schema
+    :param route: Routing rule, 'hash' or 'hash:<field>', default hash of
+                  the id
+    :rtype: dict of the record, error, and suppressed counts and the
+            run statistics
     """
-    marc_file = FileInputStream(marc_filename)
-    marc_reader = marc4j.MarcStreamReader(marc_file)
-    error_file = FileOutputStream('solr-index-errors-{0}.mrc'.format(datetime.datetime.today().strftime("%Y-%m-%d")))
-    error_writer = marc4j.MarcStreamWriter(error_file)
-    solr_server = pysolr.Solr(solr_url)
-    docs,count,error_count,suppressed = [],0,0,0
+    if gzip_level:
+        # pysolr can not compress its requests
+        connections = connections or 1
+    if connections and adaptive is not None:
+        raise ValueError("Adaptive batch sizing does not work with concurrent connections")
+    if marc_field is not None:
+        set_marc_field(marc_field)
+    marc_reader = open_marc_reader(marc_filename, reader)
+    error_writer = open_error_writer(reader, marc_filename)
+    commit_policy = make_commit_policy(commit_policy)
+    run_stats = RunStats()
+    def open_client(url, stats):
+        if connections:
+            return ConcurrentUpdateClient(url,
+                                          in_flight=connections,
+                                          stats=stats,
+                                          gzip_level=gzip_level,
+                                          semaphore=BATCH_SEMAPHORE)
+        return PySolrClient(pysolr.Solr(url))
+    solr_client = open_update_client(open_client, solr_url, run_stats,
+                                     nodes, route, batch_docs, batch_bytes,
+                                     adaptive)
+    batcher = Batcher(batch_docs, batch_bytes, run_stats,
+                      make_batch_controller(adaptive))
+    conformer = open_schema_conformer(solr_url, check_schema)
+    count,error_count,suppressed = 0,0,0
     start = datetime.datetime.today()
-    while marc_reader.hasNext():
-        try:
+    try:
+        while marc_reader.hasNext():
             count += 1
-            marc_record = marc_reader.next()
-            record = get_record(marc_record, ils=ils)
-            if record is not None:
-                docs.append(record)
+            marc_record = record = None
+            try:
+                marc_record = marc_reader.next()
+                record = get_record(marc_record, ils=ils)
+                if record is not None:
+                    record = prepare_record(record, conformer)
+            except RecordSuppressedError:
+                suppressed += 1
+                continue
+            except Exception:
+                error_count += 1
+                write_record_error(error_writer, marc_record, count)
+                continue
             if count%1000:
                 sys.stderr.write(".")
             else:
                 sys.stderr.write(str(count))
-            if not count%1500:
-                solr_server.add(docs)
-                docs = []
-                System.gc()
+            if record is not None and batcher.add(record, estimate_size(record)):
+                batcher.sent(send_batch(solr_client, batcher.take(), commit_policy))
+                if System is not None and commit_policy.name == 'batch':
+                    System.gc()
                 sys.stderr.write(" solr-update:{0} ".format(count))
-        except RecordSuppressedError, e:
-            suppressed += 1
-            continue
-        except Exception, e:
-            import traceback, os.path
-            tb = traceback.extract_stack()
-            traceback.print_exc(tb)
-            exc_type,exc_obj,exc_tb = sys.exc_info()
-            error = "Failed to process MARC error={0} {1} count={2}\n".format(exc_obj,
-                                                                              exc_tb,
-                                                                              count)
-            error_count += 1
-            sys.stderr.write(error)
-            return
-            if marc_record is not None:
-                error_writer.write(marc_record)
-    if len(docs) > 0:
-        solr_server.add(docs)
+        if len(batcher) > 0:
+            batcher.sent(send_batch(solr_client, batcher.take(), commit_policy))
+        solr_client.flush()
+        finish_commits(solr_client, commit_policy)
+        solr_client.close()
+    finally:
+        error_writer.close()
     finished_indexing = datetime.datetime.today()
     index_finished_msg = "\nTotal MARC records of {0}\n".format(count)
     index_finished_msg += "\tIndexed Started:{0}\n\tFinished:{1}\n\t Total Time:{2} mins\n".format(start.isoformat(),
                                                                                                    finished_indexing.isoformat(),
                                                                                                    (finished_indexing-start).seconds / 60.0)
     index_finished_msg += "\tErrors:{0} Suppressed:{1}\n".format(error_count,suppressed)
+    index_finished_msg += run_stats.report()
+    if conformer is not None:
+        index_finished_msg += conformer.report()
+    if nodes:
+        index_finished_msg += solr_client.report()
     sys.stderr.write(index_finished_msg)
-
-
-def csv_solr_submission(solr_url,marc_filename,ils='III'):
+    write_profile(marc_filename, run_stats=run_stats)
+    result = {'filename': marc_filename,
+              'count': count,
+              'errors': error_count,
+              'suppressed': suppressed,
+              'run_stats': run_stats.to_dict()}
+    if nodes:
+        result['nodes'] = solr_client.to_dict()
+    return result
+
+
+def csv_solr_submission(solr_url,marc_filename,ils='III',reader=None,
+                        commit_policy=None,stream=False,part_rows=0,
+                        load_threads=4,check_schema=True,marc_field=None):
     """
     Uses Solrj to create a document batch to send to a Solr server
 
     :param solr_url: URL to solr server
     :param marc_filename: Full path and name of MARC 21 file
     :param ils: ILS, default to III
+    :param reader: MARC reader, 'marc4j' or 'native'
+    :param commit_policy: solr_update commit policy or spec, default final
+    :param stream: Boolean, stream the rows to Solr in a chunked POST
+                   instead of writing a temporary CSV file for Solr to
+                   read, which needs Solr to share the file system
+    :param part_rows: Write tmp{name}-part{n}.csv files of at most this
+                      many rows and load them in parallel, 0 writes one
+                      file; takes the place of stream
+    :param load_threads: Part files loaded at once
+    :param check_schema: Boolean, drop or rename the fields the Solr schema
+                         does not have before sending
+    :param marc_field: marc_record field mode from MARC_FIELD_MODES, None
+                       keeps the current MARC_FIELD
     """
-    marc_file = FileInputStream(marc_filename)
-    marc_reader = marc4j.MarcStreamReader(marc_file)
-    error_file = FileOutputStream('solr-index-errors-{0}.mrc'.format(datetime.datetime.today().strftime("%Y-%m-%d")))
-    error_writer = marc4j.MarcStreamWriter(error_file)
+    if marc_field is not None:
+        set_marc_field(marc_field)
+    marc_reader = open_marc_reader(marc_filename, reader)
+    error_writer = open_error_writer(reader, marc_filename)
+    commit_policy = make_commit_policy(commit_policy)
 ##    solr_server = CommonsHttpSolrServer(solr_url)
     docs,count,error_count = [],0,0
     start = datetime.datetime.now()
+    conformer = open_schema_conformer(solr_url, check_schema)
+    csv_fieldnames = FIELDNAMES
+    if conformer is not None:
+        csv_fieldnames = conformer.fieldnames(FIELDNAMES)
     fieldname_dict = {}
-    for fieldname in FIELDNAMES:
+    for fieldname in csv_fieldnames:
         fieldname_dict[fieldname] = fieldname
     import os.path
     csv_filename = 'tmp{0}.csv'.format(os.path.splitext(marc_filename)[0])
-    csv_file_handle = open(csv_filename,'wb')
-    csv_writer = csv.DictWriter(csv_file_handle,
-                                FIELDNAMES)
-
-
-    csv_writer.writerow(fieldname_dict)
-    while marc_reader.hasNext():
-        try:
+    if part_rows:
+        stream = False
+        csv_writer = csv_parts.PartWriter(
+            'tmp{0}-part{{0:03d}}.csv'.format(
+                os.path.splitext(os.path.basename(marc_filename))[0]),
+            csv_fieldnames,
+            part_rows)
+        csv_file_handle = csv_writer
+    elif stream:
+        csv_file_handle = open_csv_stream(solr_url, commit_policy)
+    else:
+        csv_file_handle = open(csv_filename,'wb')
+    if not part_rows:
+        csv_writer = csv.DictWriter(csv_file_handle,
+                                    csv_fieldnames)
+        csv_writer.writerow(fieldname_dict)
+    try:
+        while marc_reader.hasNext():
             count += 1
-            marc_record = marc_reader.next()
-            record = get_record(marc_record, ils=ils)
-            if record is not None:
-                row = get_row(record)
-                if row is not None:
-                    csv_writer.writerow(row)
+            marc_record = row = None
+            try:
+                marc_record = marc_reader.next()
+                record = get_record(marc_record, ils=ils)
+                if record is not None:
+                    if conformer is not None:
+                        record = conformer(record)
+                    row = get_row(record)
+            except Exception:
+                error_count += 1
+                write_record_error(error_writer, marc_record, count)
+                continue
+            if row is not None:
+                csv_writer.writerow(row)
             if count%1000:
                 sys.stderr.write(".")
             else:
                 sys.stderr.write(str(count))
-        except Exception, e:
-            import traceback, os.path
-            tb = traceback.extract_stack()
-            traceback.print_exc(tb)
-            exc_type,exc_obj,exc_tb = sys.exc_info()
-            error = "Failed to process MARC error={0} {1} count={2}\n".format(exc_obj,
-                                                                              exc_tb,
-                                                                              count)
-            error_count += 1
-            sys.stderr.write(error)
-            return
-            if marc_record is not None:
-                error_writer.write(marc_record)
+    except Exception:
+        # A failed write leaves the upload or the CSV files half written
+        if stream:
+            csv_file_handle.abort()
+        else:
+            csv_file_handle.close()
+        raise
+    finally:
+        error_writer.close()
     try:
-        csv_file_handle.close()
+        if stream:
+            print("Solr response:")
+            print(csv_file_handle.close())
+        else:
+            csv_file_handle.close()
         finished_indexing = datetime.datetime.now()
         index_finished_msg = "\nTotal MARC records of {0}\n".format(count)
         index_finished_msg += "\tIndexed Started:{0} Finished:{1} Total Time:{2} mins\n".format(start.isoformat(),
                                                                                                 finished_indexing.isoformat(),
                                                                                                 (finished_indexing-start).seconds / 60.0)
-        load_solr(csv_filename,solr_url)
+        if part_rows:
+            load_csv_parts(csv_writer, solr_url, commit_policy, load_threads)
+        else:
+            if not stream:
+                load_solr(csv_filename,solr_url,commit_policy)
+            finish_commits(None, commit_policy)
         index_finished_msg += "\tErrors:{0}\n".format(error_count)
+        if conformer is not None:
+            index_finished_msg += conformer.report()
         sys.stderr.write(index_finished_msg)
 ##        start_solr_ingest = datetime.datetime.now()
 ##        sys.stderror.write("Starting ingesting into Solr {0}\n".format(start_solr_ingest.isoformat()))
@@ -1180,11 +2329,17 @@ def csv_solr_submission(solr_url,marc_filename,ils='III'):
         final_time = datetime.datetime.now()
         sys.stderr.write("Finished at {0} for total time of {1}".format(final_time.isoformat(),
                                                                           (final_time-start).seconds / 60))
-    except SolrServerException:
-        error = "\nError Ingesting docs into Solr: {0}\n".format(sys.exc_info()[0])
+        write_profile(marc_filename)
+    except (SolrServerException, SolrUpdateError):
+        error = "\nError Ingesting docs into Solr: {0}\n".format(sys.exc_info()[1])
         sys.stderr.write(error)
+        raise
     finally:
-        csv_file_handle.close()
+        if not stream:
+            csv_file_handle.close()
+    return {'filename': marc_filename,
+            'count': count,
+            'errors': error_count}
 
 
 ##def write_csv(marc_file_handle, csv_file_handle, collections=None,
@@ -1305,7 +2460,85 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('solr_server', help="Solr Server URL")
     parser.add_argument('marc_location',  help="MARC21 file location")
+    parser.add_argument('--reader',
+                        choices=['marc4j', 'native'],
+                        default=MARC_READER,
+                        help="MARC reader, native is the pure-Python iso2709 reader")
+    parser.add_argument('--profile',
+                        action='store_true',
+                        help="Time each extractor and write profile-*.json reports")
+    parser.add_argument('--commit',
+                        default=None,
+                        help="Commit policy: batch, final, within:<ms> or soft:<seconds>")
+    parser.add_argument('--batch_docs',
+                        type=int,
+                        default=1500,
+                        help="Documents per Solr add")
+    parser.add_argument('--batch_bytes',
+                        type=int,
+                        default=DEFAULT_BATCH_BYTES,
+                        help="Estimated bytes per Solr add, a batch is sent at whichever limit comes first")
+    parser.add_argument('--adaptive',
+                        default=None,
+                        help="Resize batches to hold Solr add latency: <target seconds>[:<min docs>:<max docs>]")
+    parser.add_argument('--connections',
+                        type=int,
+                        default=0,
+                        help="Batches in flight to Solr over keep-alive connections, 0 waits for each batch")
+    parser.add_argument('--marc_field',
+                        choices=MARC_FIELD_MODES,
+                        default='text',
+                        help="marc_record field: text, omit, base64 of the ISO 2709 bytes, or compressed")
+    parser.add_argument('--gzip',
+                        type=int,
+                        nargs='?',
+                        const=DEFAULT_GZIP_LEVEL,
+                        default=0,
+                        help="Gzip update request bodies at this level, 1-9, {0} if no level is given".format(DEFAULT_GZIP_LEVEL))
+    parser.add_argument('--nodes',
+                        default=None,
+                        help="Comma separated Solr node URLs, each document is sent to the node that owns it")
+    parser.add_argument('--route',
+                        default=DEFAULT_ROUTE,
+                        help="Routing rule for --nodes: hash or hash:<field>, default hash of the id")
+    parser.add_argument('--no_schema_check',
+                        action='store_true',
+                        help="Send fields without checking them against the Solr schema")
+    parser.add_argument('--processes',
+                        type=int,
+                        default=0,
+                        help="Index this many shard files at once with parallel_index")
+    parser.add_argument('--max_batches',
+                        type=int,
+                        default=None,
+                        help="Cap on Solr batches in flight across --processes workers")
     args = parser.parse_args()
+    if args.adaptive is not None and (args.connections or args.gzip):
+        parser.error("--adaptive needs --connections 0 and no --gzip")
+    nodes = None
+    if args.nodes:
+        nodes = [node.strip() for node in args.nodes.split(',') if node.strip()]
+    if args.processes:
+        import parallel_index
+        parallel_index.index_directory(args.solr_server,
+                                       args.marc_location,
+                                       processes=args.processes,
+                                       max_batches=args.max_batches,
+                                       reader=args.reader,
+                                       profile=args.profile,
+                                       commit_policy=args.commit,
+                                       batch_docs=args.batch_docs,
+                                       batch_bytes=args.batch_bytes,
+                                       adaptive=args.adaptive,
+                                       connections=args.connections,
+                                       check_schema=not args.no_schema_check,
+                                       marc_field=args.marc_field,
+                                       gzip_level=args.gzip,
+                                       nodes=nodes,
+                                       route=args.route)
+        sys.exit(0)
+    if args.profile:
+        enable_profiling()
     shard_walker = next(os.walk(args.marc_location))[2]
     sharding_start = datetime.datetime.utcnow()
     print(
@@ -1316,7 +2549,18 @@ if __name__ == '__main__':
         if os.path.splitext(filename)[1] == '.mrc':
             py_solr_submission(args.solr_server,
                                os.path.join(args.marc_location,
-                                            filename))
+                                            filename),
+                               reader=args.reader,
+                               commit_policy=args.commit,
+                               batch_docs=args.batch_docs,
+                               batch_bytes=args.batch_bytes,
+                               adaptive=args.adaptive,
+                               connections=args.connections,
+                               check_schema=not args.no_schema_check,
+                               marc_field=args.marc_field,
+                               gzip_level=args.gzip,
+                               nodes=nodes,
+                               route=args.route)
     sharding_end = datetime.datetime.utcnow()
     print("MARC indexing finished at {0}".format(sharding_end.isoformat()))
     print(
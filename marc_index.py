@@ -0,0 +1,391 @@
+"""
+ :mod:`marc_index` Record boundary index of a MARC file. One pass reads
+ only the 5 byte record length at the start of each leader and seeks past
+ the rest of the record, collecting the (offset, length) of every record
+ in arrays. The index is saved beside the MARC file, {file}.idx, so
+ finding record N, splitting a file for parallel work, or resuming a run
+ become seeks. The bib id of every record, from the 907 subfield a, can be
+ kept in the index as well. The index records the MARC file's size,
+ modification time and a digest of its first and last blocks, and is
+ rebuilt when any of them change.
+"""
+__author__ = "Jeremy Nelson"
+
+import argparse
+import array
+import datetime
+import hashlib
+import os
+import struct
+import sys
+
+import iso2709
+
+arg_parser = argparse.ArgumentParser(description='Index the records of MARC files')
+arg_parser.add_argument('filename',
+                        nargs="+",
+                        help="[filename] Name of MARC file to index")
+arg_parser.add_argument('--bib_ids',
+                        action='store_true',
+                        help="[bib_ids] Keep the 907 subfield a bib id of every record")
+
+# First bytes of an index file, the number changes with the layout
+MAGIC = b'MARCIDX2'
+
+# Byte order flag, offsets and lengths are written in the machine's order
+# and swapped when read on the other
+BYTE_ORDERS = {'little': 0, 'big': 1}
+
+# Magic, byte order, has bib ids, record count, MARC file size, MARC file
+# modification time, SHA-1 of the MARC file's first and last blocks
+HEADER = struct.Struct('<8sBBxxQQd20s')
+
+# Bytes read from each end of a MARC file for its digest
+DIGEST_BLOCK = 64 * 1024
+
+SUBFIELD_DELIMITER = b'\x1f'
+
+
+class MarcIndexError(Exception):
+    """
+    Raised for an index file that can not be read or does not match its
+    MARC file
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def offset_array(values=()):
+    """
+    Returns an array of 8 byte integers, 'q' where the array module has
+    it and 'l' on platforms where a long is 8 bytes
+
+    :param values: Initial values
+    :rtype: array.array
+    """
+    for typecode in ('q', 'l'):
+        try:
+            offsets = array.array(typecode, values)
+        except ValueError:
+            continue
+        if offsets.itemsize == 8:
+            return offsets
+    raise MarcIndexError("No 8 byte array type for record offsets")
+
+def array_bytes(values):
+    "Returns the bytes of an array, tobytes on Python 3 and tostring on 2"
+    if hasattr(values, 'tobytes'):
+        return values.tobytes()
+    return values.tostring()
+
+def extend_array(values, data):
+    "Appends the items in data, bytes read from array_bytes"
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+
+def file_signature(marc_filename):
+    """
+    Returns what an index checks to tell whether a MARC file changed: its
+    size, modification time and the SHA-1 of its first and last
+    DIGEST_BLOCK bytes
+
+    :param marc_filename: MARC file name
+    :rtype: tuple of (size, mtime, digest)
+    """
+    size = os.path.getsize(marc_filename)
+    digest = hashlib.sha1()
+    marc_file = open(marc_filename, 'rb')
+    try:
+        digest.update(marc_file.read(DIGEST_BLOCK))
+        if size > DIGEST_BLOCK:
+            marc_file.seek(max(DIGEST_BLOCK, size - DIGEST_BLOCK))
+            digest.update(marc_file.read(DIGEST_BLOCK))
+    finally:
+        marc_file.close()
+    return size, os.path.getmtime(marc_filename), digest.digest()
+
+def raw_field(raw, tag):
+    """
+    Returns the data of the first field with tag, without its
+    terminator, read from a record's directory without parsing the rest
+    of the record; None if there is no such field
+
+    :param raw: ISO 2709 bytes of one record
+    :param tag: MARC tag
+    :rtype: bytes
+    """
+    base = int(raw[12:17])
+    tag = tag.encode('ascii') if not isinstance(tag, bytes) else tag
+    for entry in range(iso2709.LEADER_LENGTH, base - 1,
+                       iso2709.DIRECTORY_ENTRY_LENGTH):
+        if raw[entry:entry + 3] == tag:
+            length = int(raw[entry + 3:entry + 7])
+            start = base + int(raw[entry + 7:entry + 12])
+            return raw[start:start + length].rstrip(iso2709.FIELD_TERMINATOR)
+    return None
+
+def raw_subfield(data, code):
+    """
+    Returns the first subfield with code of a data field's bytes, None if
+    it has none
+
+    :param data: Field data from raw_field
+    :param code: Subfield code
+    :rtype: bytes
+    """
+    code = code.encode('ascii') if not isinstance(code, bytes) else code
+    for subfield in data.split(SUBFIELD_DELIMITER)[1:]:
+        if subfield[:1] == code:
+            return subfield[1:]
+    return None
+
+def raw_bib_id(raw):
+    """
+    Returns a record's bib id the way marc.get_bib_id does for III
+    records, 907 subfield a without the leading period and check digit,
+    or None
+
+    :param raw: ISO 2709 bytes of one record
+    :rtype: String
+    """
+    field907 = raw_field(raw, '907')
+    if field907 is None:
+        return None
+    bib_id = raw_subfield(field907, 'a')
+    if bib_id is None or len(bib_id) < 10:
+        return None
+    return bib_id[1:-1].decode('latin-1')
+
+
+class MarcIndex(object):
+    """
+    Offsets and lengths of the records of one MARC file
+
+    :param offsets: offset_array of record offsets
+    :param lengths: array of record lengths, typecode 'I'
+    :param bib_ids: List of bib ids, None if they were not kept
+    :param signature: file_signature of the MARC file when it was indexed
+    """
+
+    def __init__(self, offsets, lengths, bib_ids=None,
+                 signature=(0, 0.0, b'')):
+        self.offsets = offsets
+        self.lengths = lengths
+        self.bib_ids = bib_ids
+        self.signature = signature
+        self.size = signature[0]
+        self.positions = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        """
+        Returns (offset, length) of record index
+
+        :rtype: tuple
+        """
+        return self.offsets[index], self.lengths[index]
+
+    def read(self, marc_file, index):
+        """
+        Returns the ISO 2709 bytes of record index
+
+        :param marc_file: MARC file opened in binary mode
+        :param index: Record number, 0 is the first
+        :rtype: bytes
+        """
+        marc_file.seek(self.offsets[index])
+        return marc_file.read(self.lengths[index])
+
+    def find(self, bib_id):
+        """
+        Returns the record number of a bib id, None if the index has no
+        record with it or no bib ids
+
+        :param bib_id: Bib id as stored in Solr
+        :rtype: int
+        """
+        if self.bib_ids is None:
+            return None
+        if self.positions is None:
+            self.positions = dict([(value, index)
+                                   for index, value in enumerate(self.bib_ids)
+                                   if value])
+        return self.positions.get(bib_id)
+
+    def reader(self, marc_filename, start=0):
+        """
+        Returns an iso2709.MarcReader positioned at record start, for
+        resuming a run
+
+        :param marc_filename: The indexed MARC file
+        :param start: Record number to read first
+        :rtype: iso2709.MarcReader
+        """
+        marc_file = open(marc_filename, 'rb')
+        if start < len(self):
+            marc_file.seek(self.offsets[start])
+        else:
+            marc_file.seek(0, os.SEEK_END)
+        return iso2709.MarcReader(marc_file)
+
+    def split(self, parts):
+        """
+        Splits the records into at most parts runs of about the same
+        number of bytes
+
+        :param parts: Number of runs
+        :rtype: List of (first record, end record) with end exclusive
+        """
+        total = sum(self.lengths)
+        runs, start, done = [], 0, 0
+        for index, length in enumerate(self.lengths):
+            done += length
+            if done * parts >= total * (len(runs) + 1):
+                runs.append((start, index + 1))
+                start = index + 1
+        if start < len(self):
+            runs.append((start, len(self)))
+        return runs
+
+    def write(self, filename):
+        """
+        Writes the index file
+
+        :param filename: Index file name, see index_filename
+        """
+        index_file = open(filename, 'wb')
+        try:
+            index_file.write(HEADER.pack(MAGIC,
+                                         BYTE_ORDERS[sys.byteorder],
+                                         self.bib_ids is not None,
+                                         len(self),
+                                         self.signature[0],
+                                         self.signature[1],
+                                         self.signature[2]))
+            index_file.write(array_bytes(self.offsets))
+            index_file.write(array_bytes(self.lengths))
+            if self.bib_ids is not None:
+                index_file.write(u'\n'.join([value or u'' for value in self.bib_ids]).encode('utf-8'))
+        finally:
+            index_file.close()
+
+    @classmethod
+    def load(cls, filename, marc_filename=None):
+        """
+        Reads an index file, raises MarcIndexError if it is not an index
+        or, given marc_filename, the MARC file's size, modification time or
+        digest changed since it was indexed
+
+        :param filename: Index file name
+        :param marc_filename: The indexed MARC file
+        :rtype: MarcIndex
+        """
+        index_file = open(filename, 'rb')
+        try:
+            header = index_file.read(HEADER.size)
+            if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+                raise MarcIndexError("{0} is not a MARC index".format(filename))
+            magic, byte_order, has_ids, count, size, mtime, digest = HEADER.unpack(header)
+            signature = (size, mtime, digest)
+            if marc_filename is not None and file_signature(marc_filename) != signature:
+                raise MarcIndexError("{0} changed since it was indexed".format(
+                    marc_filename))
+            offsets, lengths = offset_array(), array.array('I')
+            for values, item_count in ((offsets, count), (lengths, count)):
+                data = index_file.read(values.itemsize * item_count)
+                if len(data) != values.itemsize * item_count:
+                    raise MarcIndexError("{0} is truncated".format(filename))
+                extend_array(values, data)
+                if byte_order != BYTE_ORDERS[sys.byteorder]:
+                    values.byteswap()
+            bib_ids = None
+            if has_ids:
+                bib_ids = [value or None
+                           for value in index_file.read().decode('utf-8').split(u'\n')]
+                if count == 0:
+                    bib_ids = []
+        finally:
+            index_file.close()
+        return cls(offsets, lengths, bib_ids, signature)
+
+
+def index_filename(marc_filename):
+    "Returns the index file kept beside a MARC file"
+    return marc_filename + '.idx'
+
+def build_index(marc_filename, bib_ids=False):
+    """
+    Indexes a MARC file in one pass. Without bib ids only the record
+    length of each leader is read and the rest of the record skipped.
+
+    :param marc_filename: MARC file name
+    :param bib_ids: Boolean, also keep each record's bib id
+    :rtype: MarcIndex
+    """
+    offsets, lengths = offset_array(), array.array('I')
+    ids = [] if bib_ids else None
+    signature = file_signature(marc_filename)
+    size = signature[0]
+    marc_file = open(marc_filename, 'rb')
+    try:
+        offset = 0
+        while offset < size:
+            marc_file.seek(offset)
+            head = marc_file.read(5)
+            # Skip line breaks some exports put between records
+            while head[:1] in (b'\n', b'\r'):
+                offset += 1
+                head = head[1:] + marc_file.read(1)
+            if not head:
+                break
+            length = iso2709.record_length(head)
+            if length < iso2709.LEADER_LENGTH or offset + length > size:
+                raise iso2709.MarcReadError("Truncated record at {0}".format(offset))
+            offsets.append(offset)
+            lengths.append(length)
+            if ids is not None:
+                ids.append(raw_bib_id(head + marc_file.read(length - 5)))
+            offset += length
+    finally:
+        marc_file.close()
+    return MarcIndex(offsets, lengths, ids, signature)
+
+def open_index(marc_filename, bib_ids=False):
+    """
+    Returns the index of a MARC file, read from its index file when that
+    is current and has the bib ids asked for, otherwise built and saved
+
+    :param marc_filename: MARC file name
+    :param bib_ids: Boolean, the index needs the bib ids
+    :rtype: MarcIndex
+    """
+    filename = index_filename(marc_filename)
+    if os.path.exists(filename):
+        try:
+            index = MarcIndex.load(filename, marc_filename)
+            if index.bib_ids is not None or not bib_ids:
+                return index
+        except MarcIndexError:
+            pass
+    index = build_index(marc_filename, bib_ids)
+    index.write(filename)
+    return index
+
+
+if __name__ == '__main__':
+    args = arg_parser.parse_args()
+    for marc_filename in args.filename:
+        start = datetime.datetime.today()
+        index = build_index(marc_filename, args.bib_ids)
+        index.write(index_filename(marc_filename))
+        seconds = (datetime.datetime.today() - start).total_seconds()
+        print("Indexed {0} records of {1} in {2:.1f}s to {3}".format(
+            len(index), marc_filename, seconds, index_filename(marc_filename)))
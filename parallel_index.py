@@ -0,0 +1,321 @@
+"""
+ :mod:`parallel_index` Indexes a directory of MARC shard files, as cut
+ by :mod:`sharder`, into Solr with several shard files in flight at once.
+
+ On CPython each shard file is indexed by :func:`marc.py_solr_submission`
+ in a pool of worker processes. Jython has no multiprocessing module but
+ also no GIL, so there the workers are threads. Either way a shared
+ semaphore caps the Solr batches in flight across all workers, and the
+ per-file counts, batch sizes and extractor timings are combined into one
+ report.
+"""
+__author__ = "Jeremy Nelson"
+
+import argparse
+import datetime
+import os
+import sys
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+from index_stats import ExtractorProfiler, RunStats
+from solr_http import DEFAULT_GZIP_LEVEL
+from solr_router import DEFAULT_ROUTE
+from solr_schema import load_schema
+from solr_update import DEFAULT_BATCH_BYTES
+
+arg_parser = argparse.ArgumentParser(description='Index a directory of MARC shards into Solr')
+arg_parser.add_argument('solr_server', help="Solr Server URL")
+arg_parser.add_argument('marc_location', help="Directory of MARC21 shard files")
+arg_parser.add_argument('--processes',
+                        type=int,
+                        default=4,
+                        help="[processes] Number of shard files indexed at once, default is 4")
+arg_parser.add_argument('--max_batches',
+                        type=int,
+                        default=None,
+                        help="[max_batches] Solr batches in flight across all workers, default is --processes")
+arg_parser.add_argument('--reader',
+                        choices=['marc4j', 'native'],
+                        default=None,
+                        help="[reader] MARC reader used by the workers")
+arg_parser.add_argument('--commit',
+                        default=None,
+                        help="[commit] Commit policy: batch, final, within:<ms> or soft:<seconds>")
+arg_parser.add_argument('--batch_docs',
+                        type=int,
+                        default=1500,
+                        help="[batch_docs] Documents per Solr add, default is 1500")
+arg_parser.add_argument('--batch_bytes',
+                        type=int,
+                        default=DEFAULT_BATCH_BYTES,
+                        help="[batch_bytes] Estimated bytes per Solr add, a batch is sent at whichever limit comes first")
+arg_parser.add_argument('--adaptive',
+                        default=None,
+                        help="[adaptive] Resize each worker's batches to hold Solr add latency: <target seconds>[:<min docs>:<max docs>]")
+arg_parser.add_argument('--connections',
+                        type=int,
+                        default=0,
+                        help="[connections] Batches each worker keeps in flight to Solr, 0 waits for each batch")
+arg_parser.add_argument('--marc_field',
+                        choices=['text', 'omit', 'base64', 'compressed'],
+                        default='text',
+                        help="[marc_field] marc_record field: text, omit, base64 of the ISO 2709 bytes, or compressed")
+arg_parser.add_argument('--gzip',
+                        type=int,
+                        nargs='?',
+                        const=DEFAULT_GZIP_LEVEL,
+                        default=0,
+                        help="[gzip] Gzip update request bodies at this level, 1-9, {0} if no level is given".format(DEFAULT_GZIP_LEVEL))
+arg_parser.add_argument('--nodes',
+                        default=None,
+                        help="[nodes] Comma separated Solr node URLs, each document is sent to the node that owns it")
+arg_parser.add_argument('--route',
+                        default=DEFAULT_ROUTE,
+                        help="[route] Routing rule for --nodes: hash or hash:<field>, default hash of the id")
+arg_parser.add_argument('--no_schema_check',
+                        action='store_true',
+                        help="[no_schema_check] Send fields without checking them against the Solr schema")
+arg_parser.add_argument('--profile',
+                        action='store_true',
+                        help="Time each extractor and write a combined report")
+
+
+def shard_filenames(marc_location):
+    """
+    Returns the .mrc files in a directory, sorted by name
+
+    :param marc_location: Directory of MARC shard files
+    :rtype: List
+    """
+    filenames = next(os.walk(marc_location))[2]
+    return [os.path.join(marc_location, filename)
+            for filename in sorted(filenames)
+            if os.path.splitext(filename)[1] == '.mrc']
+
+def _init_worker(semaphore, profile):
+    "Configures the marc module in a worker process or for worker threads"
+    import marc
+    marc.BATCH_SEMAPHORE = semaphore
+    marc.PROFILE_EACH_FILE = False
+    if profile:
+        marc.enable_profiling()
+
+def _index_file(task):
+    "Indexes one shard file, returns its counts and timings"
+    solr_url, marc_filename, options, collect_timings = task
+    import marc
+    try:
+        result = marc.py_solr_submission(solr_url, marc_filename, **options)
+    except Exception:
+        sys.stderr.write("Failed to index {0}: {1}\n".format(marc_filename,
+                                                              sys.exc_info()[1]))
+        result = None
+    if result is None:
+        result = {'filename': marc_filename, 'failed': True}
+    if collect_timings and marc.PROFILER.enabled:
+        # One file at a time per process, so the timings are this file's
+        result['timings'] = marc.PROFILER.to_dict()
+        marc.PROFILER.reset()
+    return result
+
+def combine_results(results):
+    """
+    Adds up the per-file counts, run statistics and extractor timings
+
+    :param results: List of dicts returned for each shard file
+    :rtype: tuple of (totals dict, ExtractorProfiler, RunStats)
+    """
+    totals = {'files': 0, 'count': 0, 'errors': 0, 'suppressed': 0,
+              'failed_files': [], 'nodes': {}}
+    profiler = ExtractorProfiler()
+    run_stats = RunStats()
+    for result in results:
+        totals['files'] += 1
+        if result.get('failed'):
+            totals['failed_files'].append(result['filename'])
+        for key in ('count', 'errors', 'suppressed'):
+            totals[key] += result.get(key, 0)
+        if 'timings' in result:
+            profiler.merge(result['timings'])
+        if 'run_stats' in result:
+            run_stats.merge(result['run_stats'])
+        for node, values in result.get('nodes', {}).items():
+            totals['nodes'][node] = totals['nodes'].get(node, 0) + values['docs']
+    return totals, profiler, run_stats
+
+def _run_processes(tasks, processes, semaphore_size, profile):
+    semaphore = multiprocessing.BoundedSemaphore(semaphore_size)
+    pool = multiprocessing.Pool(processes, _init_worker, (semaphore, profile))
+    try:
+        return list(pool.imap_unordered(_index_file, tasks))
+    finally:
+        pool.close()
+        pool.join()
+
+def _run_threads(tasks, processes, semaphore_size, profile):
+    _init_worker(threading.BoundedSemaphore(semaphore_size), profile)
+    pending, results = queue.Queue(), []
+    for task in tasks:
+        pending.put(task)
+    def work():
+        while True:
+            try:
+                task = pending.get_nowait()
+            except queue.Empty:
+                return
+            results.append(_index_file(task))
+    threads = [threading.Thread(target=work) for i in range(processes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def index_directory(solr_url,
+                    marc_location,
+                    processes=4,
+                    max_batches=None,
+                    ils='III',
+                    reader=None,
+                    profile=False,
+                    report_filename='profile-combined.json',
+                    commit_policy=None,
+                    batch_docs=1500,
+                    batch_bytes=DEFAULT_BATCH_BYTES,
+                    adaptive=None,
+                    connections=0,
+                    check_schema=True,
+                    marc_field=None,
+                    gzip_level=0,
+                    nodes=None,
+                    route=None):
+    """
+    Indexes every .mrc file in marc_location, processes files at a time
+
+    :param solr_url: URL to solr server
+    :param marc_location: Directory of MARC shard files
+    :param processes: Number of files indexed at once
+    :param max_batches: Solr batches in flight across all workers,
+                        defaults to processes
+    :param ils: ILS, default to III
+    :param reader: MARC reader, 'marc4j' or 'native'
+    :param profile: Boolean, time the extractors
+    :param report_filename: Combined JSON report written when profiling
+    :param commit_policy: Commit policy spec used for every file, each
+                          worker commits its own file
+    :param batch_docs: Documents per Solr add
+    :param batch_bytes: Estimated bytes per Solr add, None for no limit
+    :param adaptive: Adaptive batch size spec, each worker adapts its own
+                     batches; needs connections 0 and no gzip_level
+    :param connections: Batches in flight to Solr per worker, 0 waits for
+                        each batch
+    :param check_schema: Boolean, drop or rename the fields the Solr schema
+                         does not have, the schema is fetched once and
+                         cached for the workers
+    :param marc_field: marc_record field mode, see marc.MARC_FIELD_MODES
+    :param gzip_level: Compression level of the update request bodies, 0
+                       sends them uncompressed
+    :param nodes: List of Solr node URLs every worker routes documents to
+    :param route: Routing rule for nodes, see solr_router.make_router
+    :rtype: dict of totals
+    """
+    if adaptive is not None and (connections or gzip_level):
+        raise ValueError("Adaptive batch sizing does not work with concurrent connections")
+    start = datetime.datetime.utcnow()
+    filenames = shard_filenames(marc_location)
+    print("Parallel MARC indexing of {0} files in {1} with {2} workers".format(
+        len(filenames), marc_location, processes))
+    print("Started at {0}".format(start.isoformat()))
+    semaphore_size = max_batches or processes
+    if check_schema:
+        # Writes the schema cache file the workers then read
+        try:
+            load_schema(solr_url)
+        except Exception:
+            sys.stderr.write("Unable to read the Solr schema: {0}\n".format(
+                sys.exc_info()[1]))
+    # Keyword arguments of marc.py_solr_submission for every file
+    options = {'ils': ils,
+               'reader': reader,
+               'commit_policy': commit_policy,
+               'batch_docs': batch_docs,
+               'batch_bytes': batch_bytes,
+               'adaptive': adaptive,
+               'connections': connections,
+               'check_schema': check_schema,
+               'marc_field': marc_field,
+               'gzip_level': gzip_level,
+               'nodes': nodes,
+               'route': route}
+    if multiprocessing is not None:
+        tasks = [(solr_url, filename, options, True)
+                 for filename in filenames]
+        results = _run_processes(tasks, processes, semaphore_size, profile)
+    else:
+        tasks = [(solr_url, filename, options, False)
+                 for filename in filenames]
+        results = _run_threads(tasks, processes, semaphore_size, profile)
+    totals, profiler, run_stats = combine_results(results)
+    if multiprocessing is None and profile:
+        import marc
+        profiler = marc.PROFILER
+    end = datetime.datetime.utcnow()
+    minutes = (end - start).seconds / 60.0
+    sys.stderr.write('''\nParallel indexing finished at {0}
+    Files:{1} Failed files:{2}
+    Total MARC records:{3} Errors:{4} Suppressed:{5}
+    Total Time:{6} mins for {7} records per min\n'''.format(
+        end.isoformat(),
+        totals['files'],
+        len(totals['failed_files']),
+        totals['count'],
+        totals['errors'],
+        totals['suppressed'],
+        minutes,
+        totals['count'] / (minutes or 1.0)))
+    for filename in totals['failed_files']:
+        sys.stderr.write("\tFailed: {0}\n".format(filename))
+    for node in sorted(totals['nodes']):
+        sys.stderr.write("\tNode {0}: docs={1}\n".format(node, totals['nodes'][node]))
+    sys.stderr.write(run_stats.report())
+    if profile:
+        sys.stderr.write(profiler.report())
+        profiler.write_json(report_filename,
+                            marc_location=marc_location,
+                            totals=totals,
+                            run_stats=run_stats.to_dict(),
+                            minutes=minutes)
+        sys.stderr.write("\tProfile written to {0}\n".format(report_filename))
+    return totals
+
+
+if __name__ == '__main__':
+    args = arg_parser.parse_args()
+    if args.adaptive is not None and (args.connections or args.gzip):
+        arg_parser.error("--adaptive needs --connections 0 and no --gzip")
+    index_directory(args.solr_server,
+                    args.marc_location,
+                    processes=args.processes,
+                    max_batches=args.max_batches,
+                    reader=args.reader,
+                    profile=args.profile,
+                    commit_policy=args.commit,
+                    batch_docs=args.batch_docs,
+                    batch_bytes=args.batch_bytes,
+                    adaptive=args.adaptive,
+                    connections=args.connections,
+                    check_schema=not args.no_schema_check,
+                    marc_field=args.marc_field,
+                    gzip_level=args.gzip,
+                    nodes=args.nodes and args.nodes.split(','),
+                    route=args.route)
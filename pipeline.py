@@ -0,0 +1,217 @@
+"""
+ :mod:`pipeline` Threaded read -> extract -> write pipeline for indexing.
+
+ A reader thread feeds records into a bounded queue, a pool of worker
+ threads runs the extraction function on them, and the calling thread
+ writes the results it receives through a second bounded queue. On Jython,
+ which has no GIL, the extraction workers run in parallel. The reader and
+ writer callbacks always run on one thread each, so MARC4J readers and
+ writers and Solr clients do not need to be thread-safe.
+"""
+__author__ = "Jeremy Nelson"
+
+import sys
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# Seconds blocked queue operations wait before checking for a shutdown
+POLL_INTERVAL = 0.5
+
+_DONE = object()
+
+
+class PipelineError(Exception):
+    """
+    Raised by ExtractionPipeline.run when the reader or writer fails
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class ExtractionPipeline(object):
+    """
+    Runs extract(item) over the items of an iterable on worker threads.
+
+    write(item, result) is called on the thread calling run for every item
+    that was extracted, error(item, exc_info) for every item whose
+    extraction raised. With ordered=True both are called in input order,
+    otherwise in completion order; ordered workers do not start an item
+    more than queue_size items ahead of the next one to write, so a slow
+    item holds back at most queue_size results.
+
+    :param extract: Function run on the worker threads
+    :param write: Function called with each item and its result
+    :param error: Function called with each failed item and sys.exc_info()
+    :param workers: Number of extraction threads
+    :param queue_size: Bound of the input and output queues
+    :param ordered: Boolean, deliver results in input order
+    """
+
+    def __init__(self, extract, write, error=None, workers=4,
+                 queue_size=1000, ordered=False):
+        self.extract = extract
+        self.write = write
+        self.error = error
+        self.workers = max(1, workers)
+        self.ordered = ordered
+        self.window = max(1, queue_size)
+        self.next_sequence = 0
+        self.window_moved = threading.Condition()
+        self.input = queue.Queue(queue_size)
+        self.output = queue.Queue(queue_size)
+        self.stopping = threading.Event()
+        self.failure = None
+        self.read_count = 0
+        self.written = 0
+        self.failed = 0
+
+    def _put(self, target, value):
+        while not self.stopping.is_set():
+            try:
+                target.put(value, True, POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, source):
+        while True:
+            try:
+                return source.get(True, POLL_INTERVAL)
+            except queue.Empty:
+                if self.stopping.is_set():
+                    return _DONE
+
+    def _wait_for_window(self, sequence):
+        """
+        Blocks an ordered worker until sequence is within window items of
+        the next item to write, returns False if the pipeline stops first
+        """
+        self.window_moved.acquire()
+        try:
+            while sequence >= self.next_sequence + self.window:
+                if self.stopping.is_set():
+                    return False
+                self.window_moved.wait(POLL_INTERVAL)
+            return True
+        finally:
+            self.window_moved.release()
+
+    def _move_window(self, next_sequence):
+        self.window_moved.acquire()
+        try:
+            self.next_sequence = next_sequence
+            self.window_moved.notify_all()
+        finally:
+            self.window_moved.release()
+
+    def _fail(self, stage):
+        if self.failure is None:
+            self.failure = (stage, sys.exc_info())
+        self.stopping.set()
+
+    def _read(self, items):
+        try:
+            for item in items:
+                if not self._put(self.input, (self.read_count, item)):
+                    return
+                self.read_count += 1
+        except Exception:
+            self._fail('reader')
+        finally:
+            for i in range(self.workers):
+                self._put(self.input, _DONE)
+
+    def _work(self):
+        while True:
+            task = self._get(self.input)
+            if task is _DONE:
+                break
+            sequence, item = task
+            if self.ordered and not self._wait_for_window(sequence):
+                break
+            try:
+                result = (item, self.extract(item), None)
+            except Exception:
+                result = (item, None, sys.exc_info())
+            if not self._put(self.output, (sequence, result)):
+                break
+        self._put(self.output, _DONE)
+
+    def _deliver(self, result):
+        item, value, exc_info = result
+        if exc_info is None:
+            self.written += 1
+            self.write(item, value)
+        else:
+            self.failed += 1
+            if self.error is not None:
+                self.error(item, exc_info)
+
+    def _write(self):
+        finished, pending, next_sequence = 0, {}, 0
+        try:
+            while finished < self.workers:
+                task = self._get(self.output)
+                if task is _DONE:
+                    finished += 1
+                    if self.stopping.is_set() and self.failure is not None:
+                        break
+                    continue
+                sequence, result = task
+                if not self.ordered:
+                    self._deliver(result)
+                    continue
+                pending[sequence] = result
+                if next_sequence not in pending:
+                    continue
+                while next_sequence in pending:
+                    self._deliver(pending.pop(next_sequence))
+                    next_sequence += 1
+                self._move_window(next_sequence)
+        except Exception:
+            self._fail('writer')
+
+    def run(self, items):
+        """
+        Runs the pipeline over items and blocks until every result has
+        been written
+
+        :param items: Iterable of items, read on the reader thread
+        :rtype: int number of items read
+        """
+        threads = [threading.Thread(target=self._read, args=(items,),
+                                    name='pipeline-reader')]
+        for i in range(self.workers):
+            threads.append(threading.Thread(target=self._work,
+                                            name='pipeline-worker-{0}'.format(i)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        self._write()
+        self.stopping.set()
+        for thread in threads:
+            thread.join()
+        if self.failure is not None:
+            stage, exc_info = self.failure
+            raise PipelineError("Pipeline {0} failed: {1}".format(stage,
+                                                                  exc_info[1]))
+        return self.read_count
+
+
+def iter_reader(marc_reader):
+    """
+    Adapts a MARC4J style reader with hasNext()/next() to an iterator
+
+    :param marc_reader: MarcStreamReader or iso2709.MarcReader
+    """
+    while marc_reader.hasNext():
+        yield marc_reader.next()
@@ -9,10 +9,7 @@ import random
 import sys
 sys.path.append(os.path.join("lib",
                              "marc4j.jar"))
-import java.io.FileInputStream as FileInputStream
-import java.io.FileOutputStream as FileOutputStream
-import org.marc4j as marc4j
-from sharder import check_suppressed
+from sharder import check_suppressed, open_reader, open_writer
 
 arg_parser = argparse.ArgumentParser(description='Generate Random file of MARC Records')
 arg_parser.add_argument('input_marc', help="[input_marc] File path to input MARC file")
@@ -55,14 +52,9 @@ def create_sets(filepath, name=None):
     """
     if name is None:
         name = os.path.splitext(filepath)[0]
-    marc_file = FileInputStream(filepath)
-    marc_reader = marc4j.MarcStreamReader(marc_file)
-    test_writer = marc4j.MarcStreamWriter(
-        FileOutputStream("testing-{0}.mrc".format(name)))
-    test_writer.setConverter(marc4j.converter.impl.AnselToUnicode())
-    training_writer = marc4j.MarcStreamWriter(
-        FileOutputStream("training-{0}.mrc".format(name)))
-    training_writer.setConverter(marc4j.converter.impl.AnselToUnicode())
+    marc_reader = open_reader(filepath)
+    test_writer = open_writer("testing-{0}.mrc".format(name))
+    training_writer = open_writer("training-{0}.mrc".format(name))
     count = 0
     print('''Starting creation of Training and Testing sets
 for {0} at {1}'''.format(name, datetime.datetime.utcnow().isoformat()))
@@ -0,0 +1,95 @@
+"""
+ :mod:`record_view` Read-only view of a MARC record that buckets the
+ record's variable fields by tag, so the extractors in :mod:`marc` look
+ fields up in a dict instead of re-scanning the field list on every
+ ``getVariableField(s)`` call.
+"""
+__author__ = "Jeremy Nelson"
+
+
+class RecordView(object):
+    """
+    Wraps a MARC4J (or compatible) record and exposes the subset of the
+    record API used by :mod:`marc`. The record's field list is walked
+    once on construction.
+
+    :param marc_record: MARC record
+    """
+
+    def __init__(self, marc_record):
+        self.record = marc_record
+        self.fields = []
+        self.by_tag = {}
+        for field in marc_record.getVariableFields():
+            tag = field.getTag()
+            self.fields.append(field)
+            if tag in self.by_tag:
+                self.by_tag[tag].append(field)
+            else:
+                self.by_tag[tag] = [field]
+        self.by_range = {}
+
+    @classmethod
+    def wrap(cls, marc_record):
+        """
+        Returns a view of the record, reusing the record if it is already
+        a view.
+
+        :param marc_record: MARC record or RecordView
+        :rtype: RecordView
+        """
+        if isinstance(marc_record, cls):
+            return marc_record
+        return cls(marc_record)
+
+    def getLeader(self):
+        return self.record.getLeader()
+
+    def getVariableField(self, tag):
+        """
+        Returns the first field with the tag or None
+
+        :param tag: MARC tag
+        """
+        fields = self.by_tag.get(tag)
+        if fields:
+            return fields[0]
+        return None
+
+    def getVariableFields(self, tags=None):
+        """
+        Returns all fields, all fields for a tag, or all fields for a
+        sequence of tags in record order. The returned lists are shared
+        with the view and should not be modified.
+
+        :param tags: None, MARC tag or list of MARC tags
+        :rtype: List
+        """
+        if tags is None:
+            return self.fields
+        if isinstance(tags, str):
+            return self.by_tag.get(tags, [])
+        tags = set(tags)
+        return [field for field in self.fields if field.getTag() in tags]
+
+    def getRange(self, prefix):
+        """
+        Returns the fields whose tag starts with prefix, i.e. '6' for
+        all 6xx fields, in record order.
+
+        :param prefix: Leading characters of the MARC tag
+        :rtype: List
+        """
+        if prefix not in self.by_range:
+            self.by_range[prefix] = [field for field in self.fields
+                                     if field.getTag().startswith(prefix)]
+        return self.by_range[prefix]
+
+    def toString(self):
+        return self.record.toString()
+
+    def __str__(self):
+        return self.record.__str__()
+
+    def __getattr__(self, name):
+        return getattr(self.record, name)
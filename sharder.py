@@ -1,26 +1,75 @@
 """
  Creates a MARC records shards from a full MARC record load using the jython
- and MARC4J
+ and MARC4J. The raw mode copies each shard's byte ranges of the inputs
+ straight to the shard file instead, using the record offset index from
+ :mod:`marc_index`, with several shards written at once; converting the
+ shards from MARC-8 to Unicode is a separate step. The partition mode
+ puts each record in one of a fixed number of shards by a hash of its bib
+ id, so a record stays in the same shard from one export to the next.
+ Raw shards can be cut by bytes or by an estimated indexing cost instead
+ of by records, so shards of very different records take about the same
+ time to index.
 """
 __author__ = "Jeremy Nelson"
 
-import sys,argparse,datetime,os
+import sys,argparse,datetime,hashlib,os,threading,zlib
 sys.path.append(os.path.join("lib",
                              "marc4j.jar")) # Assumes MARC4j jar is in the same directory
-import java.io.FileInputStream as FileInputStream
-import java.io.FileOutputStream as FileOutputStream
-import org.marc4j as marc4j
+try:
+    import java.io.FileInputStream as FileInputStream
+    import java.io.FileOutputStream as FileOutputStream
+    import org.marc4j as marc4j
+except ImportError:
+    # Not running on Jython, records are read and written with iso2709
+    FileInputStream = FileOutputStream = marc4j = None
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 import codecs
+import iso2709
+import marc_index
 
 
+# Units a raw shard's size is measured in
+BALANCES = ('records', 'bytes', 'cost')
+
+# Estimated indexing cost of a record, in units of a plain record: each
+# record, each of its fields and each 945 item field adds its weight
+COST_WEIGHTS = {'record': 1.0, 'field': 0.05, '945': 0.5}
+
 arg_parser = argparse.ArgumentParser(description='Index MARC records into Solr')
 arg_parser.add_argument('filename',
                         nargs="+",
                         help="[filename] Name of MARC file to be shared")
 arg_parser.add_argument('--shard_size',
-                        nargs="+",
+                        type=int,
                         default=100000,
-                        help="[shard_size] Size of shard, default is 50000")
+                        help="[shard_size] Records per shard, or bytes or cost with --balance, default is 100000")
+arg_parser.add_argument('--balance',
+                        choices=BALANCES,
+                        default='records',
+                        help="[balance] Measure --raw shard sizes in records, bytes or estimated cost, default is records")
+arg_parser.add_argument('--raw',
+                        action='store_true',
+                        help="[raw] Copy the records' bytes to the shards without parsing them")
+arg_parser.add_argument('--workers',
+                        type=int,
+                        default=4,
+                        help="[workers] Raw shards written at once, default is 4")
+arg_parser.add_argument('--partitions',
+                        type=int,
+                        default=0,
+                        help="[partitions] Put each record in one of this many shards by a hash of its bib id")
+arg_parser.add_argument('--convert',
+                        action='store_true',
+                        help="[convert] Convert the raw shards from MARC-8 to Unicode with MARC4J")
+arg_parser.add_argument('--output',
+                        default='shards',
+                        help="[output] Directory of the shard files, default is shards")
+
+# Bytes copied at a time when sendfile is not available
+COPY_BUFFER = 8 * 1024 * 1024
 
 
 def check_suppressed(marc_record):
@@ -33,17 +82,410 @@ def check_suppressed(marc_record):
     return False        
 
 
-def shard(shard_size,input_marc_filename):
+def open_reader(input_marc_filename):
+    """
+    Returns a MARC4J stream reader on Jython, otherwise the native
+    iso2709 reader
+
+    :param input_marc_filename: MARC file name
+    """
+    if marc4j is None:
+        return iso2709.MarcReader(open(input_marc_filename, 'rb'))
+    return marc4j.MarcStreamReader(FileInputStream(input_marc_filename))
+
+def open_writer(output_marc_filename):
+    """
+    Returns a MARC4J stream writer converting MARC-8 to Unicode on Jython,
+    otherwise a native iso2709 writer that copies the records unconverted
+
+    :param output_marc_filename: MARC file name
+    """
+    if marc4j is None:
+        return iso2709.MarcWriter(open(output_marc_filename, 'wb'))
+    marc_writer = marc4j.MarcStreamWriter(FileOutputStream(output_marc_filename))
+    marc_writer.setConverter(marc4j.converter.impl.AnselToUnicode())
+    return marc_writer
+
+def copy_range(source, target, offset, length, buffer_size=COPY_BUFFER):
+    """
+    Copies length bytes of source starting at offset to the end of
+    target, with os.sendfile where the platform has it and large buffered
+    reads otherwise
+
+    :param source: Input file opened in binary mode
+    :param target: Output file opened in binary mode
+    :param offset: First byte copied
+    :param length: Bytes copied
+    :param buffer_size: Bytes read at a time by the buffered copy
+    """
+    if hasattr(os, 'sendfile'):
+        target.flush()
+        try:
+            while length > 0:
+                sent = os.sendfile(target.fileno(), source.fileno(), offset, length)
+                if not sent:
+                    break
+                offset += sent
+                length -= sent
+        except OSError:
+            # Not supported between these files, the rest is copied below
+            pass
+        if length <= 0:
+            return
+    source.seek(offset)
+    while length > 0:
+        data = source.read(min(buffer_size, length))
+        if not data:
+            raise iso2709.MarcReadError("Unexpected end of file at {0}".format(offset))
+        target.write(data)
+        offset += len(data)
+        length -= len(data)
+
+def shard_filename(output_dir, name, start, shard_size):
+    "Returns the file name of the shard starting at record start"
+    return os.path.join(output_dir,
+                        '{0}-shard-{1}k-{2}.mrc'.format(name, start,
+                                                        start + shard_size))
+
+def record_cost(directory, weights=COST_WEIGHTS):
+    """
+    Returns the estimated indexing cost of a record from its directory,
+    see COST_WEIGHTS
+
+    :param directory: Directory bytes of one record, after the leader
+    :param weights: dict of record, field and 945 weights
+    :rtype: float
+    """
+    entries = [directory[start:start + 3]
+               for start in range(0,
+                                  len(directory) - iso2709.DIRECTORY_ENTRY_LENGTH + 1,
+                                  iso2709.DIRECTORY_ENTRY_LENGTH)]
+    return (weights['record'] +
+            weights['field'] * len(entries) +
+            weights['945'] * entries.count(b'945'))
+
+def record_costs(marc_filename, index, weights=COST_WEIGHTS):
+    """
+    Returns the estimated cost of every record of an indexed MARC file,
+    reading only each record's leader and directory
+
+    :param marc_filename: MARC file name
+    :param index: marc_index.MarcIndex of the file
+    :param weights: dict of record, field and 945 weights
+    :rtype: List of float
+    """
+    costs = []
+    marc_file = open(marc_filename, 'rb')
+    try:
+        for offset in index.offsets:
+            marc_file.seek(offset)
+            leader = marc_file.read(iso2709.LEADER_LENGTH)
+            directory = marc_file.read(int(leader[12:17]) - iso2709.LEADER_LENGTH - 1)
+            costs.append(record_cost(directory, weights))
+    finally:
+        marc_file.close()
+    return costs
+
+def plan_shards(indexes, shard_size, sizes=None):
+    """
+    Cuts the records of several indexed files, taken in order, into
+    shards of shard_size records; the last shard holds the rest. Given
+    sizes, a shard instead ends at the first record that brings its total
+    size to shard_size.
+
+    :param indexes: List of marc_index.MarcIndex, one per input file
+    :param shard_size: Records per shard, or total size per shard
+    :param sizes: List of record sizes per input file, such as the index
+                  lengths or record_costs
+    :rtype: List of (records, ranges) per shard, ranges a list of
+            (file number, offset, length)
+    """
+    if sizes is not None:
+        return plan_sized_shards(indexes, shard_size, sizes)
+    shards, ranges, filled = [], [], 0
+    for file_number, index in enumerate(indexes):
+        start = 0
+        while start < len(index):
+            end = min(len(index), start + shard_size - filled)
+            offset = index.offsets[start]
+            ranges.append((file_number,
+                           offset,
+                           index.offsets[end - 1] + index.lengths[end - 1] - offset))
+            filled += end - start
+            start = end
+            if filled == shard_size:
+                shards.append((filled, ranges))
+                ranges, filled = [], 0
+    if ranges:
+        shards.append((filled, ranges))
+    return shards
+
+def plan_sized_shards(indexes, shard_size, sizes):
+    "Cuts shards by the total size of their records, see plan_shards"
+    shards, ranges, records, filled = [], [], 0, 0
+    for file_number, index in enumerate(indexes):
+        start = 0
+        for end, size in enumerate(sizes[file_number]):
+            filled += size
+            if filled < shard_size:
+                continue
+            offset = index.offsets[start]
+            ranges.append((file_number,
+                           offset,
+                           index.offsets[end] + index.lengths[end] - offset))
+            shards.append((records + end + 1 - start, ranges))
+            ranges, records, filled = [], 0, 0
+            start = end + 1
+        if start < len(index):
+            offset = index.offsets[start]
+            ranges.append((file_number,
+                           offset,
+                           index.offsets[-1] + index.lengths[-1] - offset))
+            records += len(index) - start
+    if ranges:
+        shards.append((records, ranges))
+    return shards
+
+def run_workers(tasks, work, workers):
+    """
+    Calls work(task) for every task on up to workers threads
+
+    :rtype: List of results in tasks order, raises the first error
+    """
+    pending = queue.Queue()
+    for number, task in enumerate(tasks):
+        pending.put((number, task))
+    results = [None] * len(tasks)
+    errors = []
+    def run():
+        while not errors:
+            try:
+                number, task = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[number] = work(task)
+            except Exception:
+                errors.append(sys.exc_info()[1])
+    threads = [threading.Thread(target=run, name='sharder-{0}'.format(i))
+               for i in range(max(1, min(workers, len(tasks))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+def raw_shard(shard_size, input_marc_filenames, output_dir='shards',
+              workers=1, name=None, balance='records'):
+    """
+    Splits MARC files into shards of shard_size records by copying each
+    shard's byte ranges, found from the record offset indexes, straight
+    to the shard file. The inputs are taken in the order given and
+    shards may span them, so the shards hold the records in the same
+    order whatever the number of workers. Each index is read from, or
+    saved to, the input's .idx file. Records are neither parsed nor
+    converted. Balanced by bytes or cost, shards are named by their first
+    record and record count.
+
+    :param shard_size: Records, bytes or cost per shard
+    :param input_marc_filenames: MARC file name or list of names
+    :param output_dir: Directory of the shard files
+    :param workers: Inputs indexed and shards written at once
+    :param name: Shard file name prefix, default the first input's name
+    :param balance: One of BALANCES, what shard_size measures
+    :rtype: List of shard file names
+    """
+    if balance not in BALANCES:
+        raise ValueError("Unknown shard balance {0}".format(balance))
+    if shard_size <= 0:
+        raise ValueError("Shard size must be positive, got {0}".format(shard_size))
+    start_time = datetime.datetime.today()
+    if not isinstance(input_marc_filenames, (list, tuple)):
+        input_marc_filenames = [input_marc_filenames]
+    if name is None:
+        name = os.path.splitext(os.path.basename(input_marc_filenames[0]))[0]
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    indexes = run_workers(input_marc_filenames, marc_index.open_index, workers)
+    sizes = None
+    if balance == 'bytes':
+        sizes = [index.lengths for index in indexes]
+    elif balance == 'cost':
+        sizes = run_workers(list(range(len(indexes))),
+                            lambda number: record_costs(input_marc_filenames[number],
+                                                        indexes[number]),
+                            workers)
+    shards = plan_shards(indexes, shard_size, sizes)
+    if sizes is None:
+        filenames = [shard_filename(output_dir, name, number * shard_size, shard_size)
+                     for number in range(len(shards))]
+    else:
+        filenames, start = [], 0
+        for records, ranges in shards:
+            filenames.append(shard_filename(output_dir, name, start, records))
+            start += records
+
+    def write_shard(number):
+        records, ranges = shards[number]
+        sources = {}
+        target = open(filenames[number], 'wb')
+        try:
+            for file_number, offset, length in ranges:
+                if file_number not in sources:
+                    sources[file_number] = open(input_marc_filenames[file_number], 'rb')
+                copy_range(sources[file_number], target, offset, length)
+        finally:
+            target.close()
+            for source in sources.values():
+                source.close()
+        print("Wrote shard {0} of {1} records".format(filenames[number], records))
+
+    run_workers(list(range(len(shards))), write_shard, workers)
+    print("Finished raw sharding at {0}, total record={1} shards={2} time={3}".format(
+        datetime.datetime.today().isoformat(),
+        sum([len(index) for index in indexes]),
+        len(filenames),
+        datetime.datetime.today() - start_time))
+    return filenames
+
+def record_key(raw):
+    """
+    Returns the key a record is partitioned by, its bib id from the 907
+    subfield a, or its 001, read from the raw bytes without parsing the
+    record; a record with neither is keyed by its bytes
+
+    :param raw: ISO 2709 bytes of one record
+    :rtype: bytes
+    """
+    bib_id = marc_index.raw_bib_id(raw)
+    if bib_id is not None:
+        return bib_id.encode('utf-8')
+    field001 = marc_index.raw_field(raw, '001')
+    if field001:
+        return field001.strip()
+    return hashlib.sha1(raw).hexdigest().encode('ascii')
+
+def partition_number(key, partitions):
+    "Returns the partition of a record key, stable across runs"
+    return (zlib.crc32(key) & 0xffffffff) % partitions
+
+def partition_filename(output_dir, name, number, partitions):
+    "Returns the file name of partition number"
+    return os.path.join(output_dir,
+                        '{0}-part-{1:03d}-of-{2:03d}.mrc'.format(name, number,
+                                                                 partitions))
+
+def same_file(first, second):
+    "Returns True if two files have the same bytes"
+    if os.path.getsize(first) != os.path.getsize(second):
+        return False
+    digests = []
+    for filename in (first, second):
+        digest = hashlib.sha1()
+        marc_file = open(filename, 'rb')
+        try:
+            data = marc_file.read(COPY_BUFFER)
+            while data:
+                digest.update(data)
+                data = marc_file.read(COPY_BUFFER)
+        finally:
+            marc_file.close()
+        digests.append(digest.digest())
+    return digests[0] == digests[1]
+
+def partition_shard(partitions, input_marc_filenames, output_dir='shards',
+                    name=None):
+    """
+    Splits MARC files into a fixed number of shards by a stable hash of
+    each record's bib id, see record_key, keeping the input order within
+    each shard. Records are copied without being parsed. A shard whose
+    bytes are the same as the existing file is left untouched, so only
+    the shards that changed since the last run need indexing again.
+
+    :param partitions: Number of shards
+    :param input_marc_filenames: MARC file name or list of names
+    :param output_dir: Directory of the shard files
+    :param name: Shard file name prefix, default the first input's name
+    :rtype: tuple of (list of shard file names, list of the changed ones)
+    """
+    start_time = datetime.datetime.today()
+    if not isinstance(input_marc_filenames, (list, tuple)):
+        input_marc_filenames = [input_marc_filenames]
+    if name is None:
+        name = os.path.splitext(os.path.basename(input_marc_filenames[0]))[0]
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    filenames = [partition_filename(output_dir, name, number, partitions)
+                 for number in range(partitions)]
+    targets = [open(filename + '.tmp', 'wb') for filename in filenames]
+    counts = [0] * partitions
+    try:
+        for input_marc_filename in input_marc_filenames:
+            source = open(input_marc_filename, 'rb')
+            try:
+                for record in iso2709.MarcReader(source):
+                    raw = record.as_marc()
+                    number = partition_number(record_key(raw), partitions)
+                    targets[number].write(raw)
+                    counts[number] += 1
+            finally:
+                source.close()
+    finally:
+        for target in targets:
+            target.close()
+    changed = []
+    for filename in filenames:
+        if os.path.exists(filename) and same_file(filename, filename + '.tmp'):
+            os.remove(filename + '.tmp')
+            continue
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(filename + '.tmp', filename)
+        changed.append(filename)
+    print("Finished partitioning at {0}, total record={1} shards={2} changed={3} time={4}".format(
+        datetime.datetime.today().isoformat(),
+        sum(counts),
+        partitions,
+        len(changed),
+        datetime.datetime.today() - start_time))
+    return filenames, changed
+
+def convert(marc_filename):
+    """
+    Converts a MARC file from MARC-8 to Unicode in place, reading and
+    writing it through open_reader and open_writer. Only MARC4J converts,
+    so this needs Jython.
+
+    :param marc_filename: MARC file name
+    :rtype: Number of records written
+    """
+    if marc4j is None:
+        raise ValueError("Converting MARC-8 to Unicode needs MARC4J on Jython")
+    converted_filename = marc_filename + '.tmp'
+    marc_reader = open_reader(marc_filename)
+    marc_writer = open_writer(converted_filename)
+    count = 0
+    try:
+        while marc_reader.hasNext():
+            marc_writer.write(marc_reader.next())
+            count += 1
+    finally:
+        marc_writer.close()
+    os.remove(marc_filename)
+    os.rename(converted_filename, marc_filename)
+    return count
+
+def shard(shard_size,input_marc_filename,output_dir='shards'):
     shard_name = os.path.splitext(input_marc_filename)[0]
-    marc_file = FileInputStream(input_marc_filename)
-    marc_reader = marc4j.MarcStreamReader(marc_file)
+    marc_reader = open_reader(input_marc_filename)
     count,error_count,suppressed = 0,0,0
-    marc_output_filename = os.path.join('shards',
+    marc_output_filename = os.path.join(output_dir,
                                         '{0}-shard-{1}k-{2}.mrc'.format(shard_name,
                                                                         count,
                                                                         count+shard_size))
-    marc_writer = marc4j.MarcStreamWriter(FileOutputStream(marc_output_filename))
-    marc_writer.setConverter(marc4j.converter.impl.AnselToUnicode())
+    marc_writer = open_writer(marc_output_filename)
     error_log = open('errors.log','w')
     while marc_reader.hasNext():
         try:
@@ -54,12 +496,11 @@ def shard(shard_size,input_marc_filename):
             marc_writer.write(record)
             if not count%shard_size: # Close current output file and open new
                 marc_writer.close()
-                new_output_filename = os.path.join('shards',
+                new_output_filename = os.path.join(output_dir,
                                                    'shard-{0}k-{1}.mrc'.format(count,
                                                                                shard_size+count))
-                output_file = FileOutputStream(new_output_filename)
                 print("Starting new shard {0}".format(new_output_filename))
-                marc_writer = marc4j.MarcStreamWriter(output_file)
+                marc_writer = open_writer(new_output_filename)
             if count%1000:
                 sys.stderr.write(".")
             else:
@@ -85,10 +526,25 @@ def shard(shard_size,input_marc_filename):
     
 if __name__ == '__main__':
     args = arg_parser.parse_args()
-    if 'shard_size' is args:
-        SHARD_SIZE = args.shard_size
+    SHARD_SIZE = args.shard_size
+    if SHARD_SIZE <= 0:
+        arg_parser.error("--shard_size must be positive")
+    if args.partitions:
+        filenames, changed = partition_shard(args.partitions, args.filename,
+                                             args.output)
+        for filename in changed:
+            print("Changed {0}".format(filename))
+    elif args.raw:
+        filenames = raw_shard(SHARD_SIZE, args.filename, args.output,
+                              args.workers, balance=args.balance)
+        if args.convert:
+            for filename in filenames:
+                print("Converted {0} records of {1}".format(convert(filename),
+                                                            filename))
+    elif len(args.filename) > 1:
+        arg_parser.error("Sharding several files needs --raw")
+    elif args.balance != 'records':
+        arg_parser.error("--balance needs --raw")
     else:
-        SHARD_SIZE = 100000 # Default
-        print("Using default shard_size of %s" % SHARD_SIZE)
-    shard(SHARD_SIZE,args.filename[0])
+        shard(SHARD_SIZE,args.filename[0],args.output)
     
@@ -0,0 +1,362 @@
+"""
+ :mod:`solr_http` Solr update client that keeps several batches in flight
+ over a pool of keep-alive HTTP connections, so records keep being
+ extracted while earlier batches are sent. Documents are posted as JSON to
+ Solr's /update/json handler, gzip compressed on the sender threads when
+ a compression level is given. Also a file-like writer that streams a
+ request body, such as CSV rows for /update/csv, as it is written.
+"""
+__author__ = "Jeremy Nelson"
+
+import gzip
+import io
+import json
+import socket
+import struct
+import sys
+import threading
+import zlib
+
+try:
+    import httplib as http_client
+    import Queue as queue
+    from urllib import urlencode
+    from urlparse import urlparse
+except ImportError:
+    import http.client as http_client
+    import queue
+    from urllib.parse import urlencode, urlparse
+
+from index_stats import clock
+
+# Compression level used when gzip is asked for without a level
+DEFAULT_GZIP_LEVEL = 6
+
+_DONE = object()
+
+
+def json_value(value):
+    "Serializes the sets the extractors build as JSON arrays"
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def gzip_body(body, level=DEFAULT_GZIP_LEVEL):
+    """
+    Returns a request body gzip compressed, for Content-Encoding: gzip
+
+    :param body: Request body bytes
+    :param level: Compression level, 1 is fastest and 9 smallest
+    :rtype: bytes
+    """
+    buffer = io.BytesIO()
+    gzip_file = gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=level)
+    try:
+        gzip_file.write(body)
+    finally:
+        gzip_file.close()
+    return buffer.getvalue()
+
+def gunzip_body(body):
+    """
+    Returns a gzip compressed request body decompressed, raises ValueError
+    for a body that is not valid gzip
+
+    :param body: Compressed bytes
+    :rtype: bytes
+    """
+    gzip_file = gzip.GzipFile(fileobj=io.BytesIO(body), mode='rb')
+    try:
+        return gzip_file.read()
+    except (IOError, EOFError, struct.error, zlib.error):
+        raise ValueError("Invalid gzip body: {0}".format(sys.exc_info()[1]))
+    finally:
+        gzip_file.close()
+
+
+class SolrUpdateError(Exception):
+    """
+    Raised when Solr rejects or fails an update request
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class ConnectionPool(object):
+    """
+    Pool of persistent HTTP/1.1 connections to one host. Connections are
+    opened as needed, up to size at once, and reused between requests.
+
+    :param solr_url: URL of the Solr server
+    :param size: Most connections open at once
+    :param timeout: Socket timeout in seconds
+    """
+
+    def __init__(self, solr_url, size=4, timeout=60):
+        url = urlparse(solr_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.opened = 0
+
+    def connect(self):
+        self.opened += 1
+        return http_client.HTTPConnection(self.host, self.port,
+                                          timeout=self.timeout)
+
+    def request(self, path, body, headers):
+        """
+        Sends a POST on a pooled connection and reads the whole response.
+        A connection the server closed while idle is replaced and the
+        request sent once more.
+
+        :param path: Request path and query
+        :param body: Request body bytes
+        :param headers: dict of request headers
+        :rtype: tuple of (status, response body)
+        """
+        self.slots.acquire()
+        try:
+            try:
+                connection = self.idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                connection = self.connect()
+                reused = False
+            try:
+                status, response = self._send(connection, path, body, headers)
+            except (http_client.HTTPException, socket.error):
+                connection.close()
+                if not reused:
+                    raise
+                connection = self.connect()
+                status, response = self._send(connection, path, body, headers)
+            self.idle.put(connection)
+            return status, response
+        finally:
+            self.slots.release()
+
+    def _send(self, connection, path, body, headers):
+        connection.request('POST', path, body, headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ConcurrentUpdateClient(object):
+    """
+    Sends batches to Solr on in_flight sender threads. add returns once
+    the batch is queued and only blocks while in_flight batches are
+    already outstanding. A failed request is raised from the next add,
+    flush or commit. As add returns before the batch is sent its time is
+    not a request time, so the client can not drive adaptive batch
+    sizing. Implements the add/commit calls the solr_update commit
+    policies use.
+
+    :param solr_url: URL of the Solr server, ending in /
+    :param in_flight: Batches sent at once, also the connection pool size
+    :param timeout: Socket timeout in seconds
+    :param stats: index_stats.RunStats, request times are recorded as
+                  request_seconds and body sizes as request_bytes
+    :param gzip_level: Compression level of the request bodies, compressed
+                       by the sender threads, 0 sends them uncompressed
+    :param semaphore: Semaphore the sender threads hold while a batch is
+                      being sent, shared to cap the batches in flight
+                      across several clients, None for no cap
+    """
+    asynchronous = True
+
+    def __init__(self, solr_url, in_flight=4, timeout=60, stats=None,
+                 gzip_level=0, semaphore=None):
+        self.path = urlparse(solr_url).path.rstrip('/') + '/update/json'
+        self.pool = ConnectionPool(solr_url, in_flight, timeout)
+        self.stats = stats
+        self.gzip_level = gzip_level
+        self.semaphore = semaphore
+        self.slots = threading.BoundedSemaphore(in_flight)
+        self.pending = queue.Queue()
+        self.failure = None
+        self.senders = []
+        for i in range(in_flight):
+            sender = threading.Thread(target=self._send,
+                                      name='solr-sender-{0}'.format(i))
+            sender.daemon = True
+            sender.start()
+            self.senders.append(sender)
+
+    def post(self, params, body):
+        """
+        Posts a JSON body to the update handler, gzip compressed when the
+        client has a gzip_level, raises SolrUpdateError if Solr does not
+        answer with 200
+
+        :param params: dict of request parameters
+        :param body: JSON string
+        :rtype: float seconds the request took
+        """
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        path = self.path
+        if params:
+            path += '?' + urlencode(params)
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+        if self.gzip_level:
+            if self.stats is not None:
+                self.stats.add('uncompressed_bytes', len(body))
+            body = gzip_body(body, self.gzip_level)
+            headers['Content-Encoding'] = 'gzip'
+        start = clock()
+        status, response = self.pool.request(path, body, headers)
+        elapsed = clock() - start
+        if status != 200:
+            raise SolrUpdateError("Solr returned {0} for {1}: {2}".format(
+                status, path, response[:200]))
+        if self.stats is not None:
+            self.stats.add('request_seconds', elapsed, 1e6)
+            self.stats.add('request_bytes', len(body))
+        return elapsed
+
+    def _send(self):
+        while True:
+            task = self.pending.get()
+            try:
+                if task is _DONE:
+                    return
+                params, body = task
+                if self.failure is None:
+                    if self.semaphore is not None:
+                        self.semaphore.acquire()
+                    try:
+                        self.post(params, body)
+                    finally:
+                        if self.semaphore is not None:
+                            self.semaphore.release()
+            except Exception:
+                if self.failure is None:
+                    self.failure = sys.exc_info()[1]
+            finally:
+                if task is not _DONE:
+                    self.slots.release()
+                self.pending.task_done()
+
+    def check(self):
+        "Raises the first failed request's error"
+        if self.failure is not None:
+            raise SolrUpdateError("Solr update failed: {0}".format(self.failure))
+
+    def add(self, docs, commit_within=None):
+        """
+        Serializes docs and queues them to be sent
+
+        :param docs: List of document dicts
+        :param commit_within: Milliseconds before Solr commits the docs
+        """
+        self.check()
+        params = {}
+        if commit_within is not None:
+            params['commitWithin'] = commit_within
+        body = json.dumps(docs, default=json_value)
+        self.slots.acquire()
+        self.pending.put((params, body))
+
+    def flush(self):
+        "Waits for every queued batch to be sent"
+        self.pending.join()
+        self.check()
+
+    def commit(self, soft=False):
+        self.flush()
+        params = {'commit': 'true'}
+        if soft:
+            params['softCommit'] = 'true'
+        self.post(params, '[]')
+
+    def close(self):
+        for sender in self.senders:
+            self.pending.put(_DONE)
+        for sender in self.senders:
+            sender.join()
+        self.pool.close()
+
+
+class ChunkedPost(object):
+    """
+    File-like object that streams everything written to it as the body of
+    one HTTP POST, using chunked transfer encoding so the length need not
+    be known. Writes are buffered into chunks of chunk_size bytes; close
+    ends the body and returns the response.
+
+    :param url: URL posted to, including any query string
+    :param content_type: Content-Type of the body
+    :param chunk_size: Bytes sent per chunk
+    :param timeout: Socket timeout in seconds
+    """
+
+    def __init__(self, url, content_type, chunk_size=64 * 1024, timeout=300):
+        parts = urlparse(url)
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.buffered = 0
+        self.bytes_sent = 0
+        self.connection = http_client.HTTPConnection(parts.hostname,
+                                                     parts.port or 80,
+                                                     timeout=timeout)
+        path = parts.path
+        if parts.query:
+            path += '?' + parts.query
+        self.connection.putrequest('POST', path)
+        self.connection.putheader('Content-Type', content_type)
+        self.connection.putheader('Transfer-Encoding', 'chunked')
+        self.connection.endheaders()
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.chunk_size:
+            self.send_chunk()
+
+    def send_chunk(self):
+        data = b''.join(self.buffer)
+        self.buffer, self.buffered = [], 0
+        if data:
+            self.connection.send(('%x\r\n' % len(data)).encode('ascii') +
+                                 data + b'\r\n')
+            self.bytes_sent += len(data)
+
+    def abort(self):
+        "Drops the connection without ending the body, Solr discards it"
+        self.connection.close()
+
+    def close(self):
+        """
+        Sends the rest of the body and reads the response, raises
+        SolrUpdateError if the server does not answer with 200
+
+        :rtype: response body
+        """
+        try:
+            self.send_chunk()
+            self.connection.send(b'0\r\n\r\n')
+            response = self.connection.getresponse()
+            body = response.read()
+        finally:
+            self.connection.close()
+        if response.status != 200:
+            raise SolrUpdateError("Solr returned {0}: {1}".format(
+                response.status, body[:200]))
+        return body
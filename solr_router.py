@@ -0,0 +1,234 @@
+"""
+ :mod:`solr_router` Sends each document straight to the Solr node that
+ owns it instead of letting one node forward documents to the others.
+ A router picks a document's node, by default from a stable hash of its
+ id, and a RoutedClient keeps a batch, an update client and throughput
+ statistics for every node behind the add/commit calls the submission
+ functions in :mod:`marc` already make.
+"""
+__author__ = "Jeremy Nelson"
+
+import zlib
+
+from index_stats import RunStats, clock
+from solr_update import Batcher, DEFAULT_BATCH_DOCS, estimate_size, \
+    make_batch_controller
+
+# Routing rule used when a submission is given nodes without one
+DEFAULT_ROUTE = 'hash'
+
+
+def field_value(doc, name):
+    """
+    Returns the first value of a field of a document dict or SolrJ
+    SolrInputDocument, None if it has none
+
+    :param doc: Document
+    :param name: Field name
+    """
+    if isinstance(doc, dict):
+        value = doc.get(name)
+    else:
+        value = doc.getFieldValue(name)
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    return value
+
+def doc_size(doc):
+    """
+    Returns the estimated bytes of a document dict or SolrJ
+    SolrInputDocument, see solr_update.estimate_size
+
+    :param doc: Document
+    :rtype: int
+    """
+    if not isinstance(doc, dict):
+        doc = dict([(name, list(doc.getFieldValues(name)))
+                    for name in doc.getFieldNames()])
+    return estimate_size(doc)
+
+
+class HashRouter(object):
+    """
+    Routes a document by the CRC-32 of one of its fields, the id by
+    default, so a document goes to the same node on every run and from
+    every process
+
+    :param field: Field hashed
+    """
+
+    def __init__(self, field='id'):
+        self.field = field
+
+    def __call__(self, doc, nodes):
+        """
+        Returns the index of the node that owns doc
+
+        :param doc: Document
+        :param nodes: Number of nodes
+        :rtype: int
+        """
+        value = field_value(doc, self.field)
+        if value is None:
+            value = u''
+        if not isinstance(value, bytes):
+            value = u'{0}'.format(value).encode('utf-8')
+        return (zlib.crc32(value) & 0xffffffff) % nodes
+
+
+def make_router(spec=None):
+    """
+    Creates a router from a spec, 'hash' hashes the id and
+    'hash:<field>' another field. A function of (doc, nodes) returning
+    a node index is used as is.
+
+    :param spec: Router spec, function or None for DEFAULT_ROUTE
+    """
+    if spec is None:
+        spec = DEFAULT_ROUTE
+    if callable(spec):
+        return spec
+    name, _, field = spec.partition(':')
+    if name == 'hash':
+        return HashRouter(field or 'id')
+    raise ValueError("Unknown routing rule {0}".format(spec))
+
+
+class RoutedClient(object):
+    """
+    Update client over several Solr nodes. add routes each document to
+    its node's batch and sends every batch that reaches batch_docs or
+    batch_bytes to that node's own client; flush and commit send the
+    partial batches first, with the commit_within of the last add. Every
+    node's batch sizes, add times and documents are recorded in its own
+    RunStats, and with adaptive every node's batch size follows its own
+    add latency. The client reports the slowest node's latest add time as
+    its latency.
+
+    :param nodes: List of Solr node URLs
+    :param open_client: Function of (url, stats) returning an update
+                        client with add, commit, flush and close
+    :param router: Function of (doc, nodes) returning a node index,
+                   default HashRouter
+    :param batch_docs: Documents per add to one node
+    :param batch_bytes: Estimated bytes per add to one node, None for no
+                        limit
+    :param adaptive: Adaptive batch size spec, see
+                     solr_update.make_batch_controller; the node clients
+                     must send in add, not asynchronously
+    """
+
+    asynchronous = True
+
+    def __init__(self, nodes, open_client, router=None,
+                 batch_docs=DEFAULT_BATCH_DOCS, batch_bytes=None,
+                 adaptive=None):
+        if not nodes:
+            raise ValueError("RoutedClient needs at least one node")
+        self.nodes = list(nodes)
+        self.router = router or HashRouter()
+        self.stats = [RunStats() for node in self.nodes]
+        self.clients = [open_client(node, stats)
+                        for node, stats in zip(self.nodes, self.stats)]
+        self.batchers = [Batcher(batch_docs, batch_bytes, stats,
+                                 make_batch_controller(adaptive))
+                         for stats in self.stats]
+        if adaptive is not None and [client for client in self.clients
+                                     if getattr(client, 'asynchronous', False)]:
+            self.close()
+            raise ValueError("Adaptive batch sizing needs node clients that send in add")
+        self.docs = [0] * len(self.nodes)
+        self.seconds = [0.0] * len(self.nodes)
+        self.commit_within = None
+
+    def send(self, index, commit_within=None):
+        "Sends node index's waiting batch"
+        docs = self.batchers[index].take()
+        if not docs:
+            return
+        client = self.clients[index]
+        start = clock()
+        client.add(docs, commit_within=commit_within)
+        elapsed = clock() - start
+        self.batchers[index].sent(elapsed)
+        self.seconds[index] = elapsed
+        self.docs[index] += len(docs)
+
+    @property
+    def semaphore(self):
+        "The semaphore the node clients hold while sending, if any"
+        return getattr(self.clients[0], 'semaphore', None)
+
+    def latency(self):
+        """
+        Returns the latest add time of the slowest node, used in place of
+        the add time for adaptive batch sizing
+
+        :rtype: float
+        """
+        return max(self.seconds)
+
+    def add(self, docs, commit_within=None):
+        """
+        Routes docs to their nodes, sending the node batches that fill
+
+        :param docs: List of documents
+        :param commit_within: Milliseconds before Solr commits the docs
+        """
+        self.commit_within = commit_within
+        sized = self.batchers[0].max_bytes is not None
+        for doc in docs:
+            index = self.router(doc, len(self.nodes))
+            if self.batchers[index].add(doc, doc_size(doc) if sized else 0):
+                self.send(index, commit_within)
+
+    def send_pending(self):
+        for index in range(len(self.nodes)):
+            self.send(index, self.commit_within)
+
+    def flush(self):
+        "Sends the partial batches and waits for every node's client"
+        self.send_pending()
+        for client in self.clients:
+            client.flush()
+
+    def commit(self, soft=False):
+        self.send_pending()
+        for client in self.clients:
+            client.commit(soft=soft)
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+
+    def to_dict(self):
+        """
+        Returns each node's documents and statistics
+
+        :rtype: dict of node URL to dict
+        """
+        return dict([(node, {'docs': docs, 'stats': stats.to_dict()})
+                     for node, docs, stats in zip(self.nodes, self.docs,
+                                                  self.stats)])
+
+    def report(self):
+        """
+        Returns one line per node with its documents, batches, add time
+        and documents per second
+
+        :rtype: String
+        """
+        lines = []
+        for node, docs, stats in zip(self.nodes, self.docs, self.stats):
+            seconds = 0.0
+            batches = 0
+            if 'add_seconds' in stats.histograms:
+                seconds = stats.histograms['add_seconds'].total
+                batches = stats.histograms['add_seconds'].count
+            lines.append("\tNode {0}: docs={1} batches={2} add time={3:.2f}s "
+                         "docs/s={4:.0f}\n".format(node,
+                                                   docs,
+                                                   batches,
+                                                   seconds,
+                                                   docs / (seconds or 1.0)))
+        return ''.join(lines)
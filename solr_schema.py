@@ -0,0 +1,321 @@
+"""
+ :mod:`solr_schema` Solr schema metadata, the names, types and
+ multiValued flags of the fields, fetched from the admin file handler
+ once and cached on disk and in memory. A SchemaConformer drops or
+ renames document fields the schema does not have, and keeps one value
+ of single-valued fields, so Solr does not reject a batch halfway through
+ a run.
+"""
+__author__ = "Jeremy Nelson"
+
+import datetime
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import xml.etree.ElementTree as et
+
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
+# Seconds a cached schema is used before it is fetched again
+CACHE_MAX_AGE = 3600
+
+# Directory of the solr-schema-*.json cache files
+CACHE_DIR = '.'
+
+# Bumped when the cache file layout changes, older files are ignored
+CACHE_VERSION = 1
+
+_SCHEMAS = {}
+_LOCK = threading.Lock()
+
+
+class SolrSchema(object):
+    """
+    Fields of a Solr schema
+
+    :param fields: dict of field name to (type, multi_valued)
+    :param dynamic_fields: List of (pattern, type, multi_valued), patterns
+                           start or end with *
+    :param unique_key: Name of the unique key field
+    :param checksum: SHA-1 of the schema.xml the fields came from
+    """
+
+    def __init__(self, fields, dynamic_fields=None, unique_key=None,
+                 checksum=None):
+        self.fields = fields
+        self.dynamic_fields = dynamic_fields or []
+        self.unique_key = unique_key
+        self.checksum = checksum
+        self.dynamic_res = [(re.compile('^' + '.*'.join(
+                                [re.escape(part) for part in pattern.split('*')]) + '$'),
+                             field_type,
+                             multi_valued)
+                            for pattern, field_type, multi_valued in self.dynamic_fields]
+
+    @classmethod
+    def from_xml(cls, schema_xml):
+        """
+        Parses schema.xml
+
+        :param schema_xml: schema.xml bytes
+        :rtype: SolrSchema
+        """
+        schema = et.fromstring(schema_xml)
+        field_types = {}
+        for element in schema.iter():
+            if element.tag in ('fieldType', 'fieldtype'):
+                field_types[element.get('name')] = element.get('multiValued') == 'true'
+        def multi_valued(element):
+            if element.get('multiValued') is not None:
+                return element.get('multiValued') == 'true'
+            return field_types.get(element.get('type'), False)
+        fields, dynamic_fields = {}, []
+        for element in schema.iter('field'):
+            fields[element.get('name')] = (element.get('type'), multi_valued(element))
+        for element in schema.iter('dynamicField'):
+            dynamic_fields.append((element.get('name'),
+                                   element.get('type'),
+                                   multi_valued(element)))
+        unique_key = schema.find('uniqueKey')
+        return cls(fields,
+                   dynamic_fields,
+                   unique_key.text.strip() if unique_key is not None else None,
+                   hashlib.sha1(schema_xml).hexdigest())
+
+    def to_dict(self):
+        return {'fields': self.fields,
+                'dynamic_fields': self.dynamic_fields,
+                'unique_key': self.unique_key,
+                'checksum': self.checksum}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(dict([(name, tuple(value))
+                         for name, value in values['fields'].items()]),
+                   [tuple(value) for value in values['dynamic_fields']],
+                   values['unique_key'],
+                   values['checksum'])
+
+    def field(self, name):
+        """
+        Returns (type, multi_valued) for a field or a matching dynamic
+        field, None if the schema has no such field
+
+        :param name: Field name
+        """
+        if name in self.fields:
+            return self.fields[name]
+        for pattern, field_type, multi_valued in self.dynamic_res:
+            if pattern.match(name):
+                return field_type, multi_valued
+        return None
+
+    def multi_valued_fields(self):
+        """
+        Returns the names of the multi-valued fields, not counting dynamic
+        fields
+
+        :rtype: List
+        """
+        return sorted([name for name, (field_type, multi_valued)
+                       in self.fields.items() if multi_valued])
+
+
+def cache_filename(solr_url):
+    "Returns the cache file for a Solr server's schema"
+    digest = hashlib.md5(solr_url.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, 'solr-schema-{0}.json'.format(digest))
+
+def fetch_schema_xml(solr_url):
+    return urlopen("{0}admin/file/?file=schema.xml".format(solr_url)).read()
+
+def read_cache(solr_url):
+    """
+    Returns the cached schema entry for solr_url, None if there is none
+    or it was written for another URL or cache version
+
+    :rtype: dict with fetched time and schema
+    """
+    try:
+        cache_file = open(cache_filename(solr_url))
+        try:
+            entry = json.load(cache_file)
+        finally:
+            cache_file.close()
+    except (IOError, ValueError):
+        return None
+    if entry.get('version') != CACHE_VERSION or entry.get('url') != solr_url:
+        return None
+    return entry
+
+def write_cache(solr_url, schema):
+    entry = {'version': CACHE_VERSION,
+             'url': solr_url,
+             'fetched': time.time(),
+             'fetched_at': datetime.datetime.today().isoformat(),
+             'schema': schema.to_dict()}
+    cache_file = open(cache_filename(solr_url), 'w')
+    try:
+        json.dump(entry, cache_file, indent=2, sort_keys=True)
+    finally:
+        cache_file.close()
+
+def load_schema(solr_url, max_age=CACHE_MAX_AGE, refresh=False):
+    """
+    Returns a Solr server's schema. A schema already loaded by this
+    process, or a cache file younger than max_age, is used without a
+    request; otherwise schema.xml is fetched and the cache rewritten. If
+    the fetch fails a stale cache file is used with a warning.
+
+    :param solr_url: URL to solr server, ending in /
+    :param max_age: Seconds a cached schema stays valid
+    :param refresh: Boolean, fetch schema.xml even if the cache is valid
+    :rtype: SolrSchema
+    """
+    _LOCK.acquire()
+    try:
+        loaded = _SCHEMAS.get(solr_url)
+        if not refresh and loaded is not None and time.time() - loaded[0] < max_age:
+            return loaded[1]
+        entry = read_cache(solr_url)
+        if not refresh and entry is not None and time.time() - entry['fetched'] < max_age:
+            schema = SolrSchema.from_dict(entry['schema'])
+            _SCHEMAS[solr_url] = (entry['fetched'], schema)
+            return schema
+        try:
+            schema = SolrSchema.from_xml(fetch_schema_xml(solr_url))
+        except Exception:
+            if entry is None:
+                raise
+            sys.stderr.write("Using schema cached at {0}, fetch failed: {1}\n".format(
+                entry['fetched_at'], sys.exc_info()[1]))
+            schema = SolrSchema.from_dict(entry['schema'])
+            _SCHEMAS[solr_url] = (time.time(), schema)
+            return schema
+        write_cache(solr_url, schema)
+        _SCHEMAS[solr_url] = (time.time(), schema)
+        return schema
+    finally:
+        _LOCK.release()
+
+def clear_cache():
+    "Forgets the schemas loaded by this process, the files are kept"
+    _SCHEMAS.clear()
+
+
+class SchemaConformer(object):
+    """
+    Makes record dicts fit a schema before they are serialized: fields in
+    renames are renamed, fields the schema does not have are dropped, and
+    single-valued fields given several values keep the first, the
+    smallest of a set. The fields changed are counted for the run
+    summary, and the first truncation of each field is logged.
+
+    :param schema: SolrSchema
+    :param renames: dict of record field name to schema field name
+    :param log: Function called with the first truncation message of each
+                field, None for no log
+    """
+
+    def __init__(self, schema, renames=None, log=sys.stderr.write):
+        self.schema = schema
+        self.renames = renames or {}
+        self.log = log
+        self.dropped = {}
+        self.renamed = {}
+        self.truncated = {}
+        self.lock = threading.Lock()
+        # Field name to (schema name or None, multi_valued), filled in as
+        # names are seen
+        self.plan = {}
+
+    def field_plan(self, name):
+        if name not in self.plan:
+            target = self.renames.get(name, name)
+            field = self.schema.field(target)
+            if field is None:
+                self.plan[name] = (None, False)
+            else:
+                self.plan[name] = (target, field[1])
+        return self.plan[name]
+
+    def count(self, counts, name):
+        """
+        Counts a change to field name, returns True for its first change
+
+        :rtype: Boolean
+        """
+        self.lock.acquire()
+        try:
+            counts[name] = counts.get(name, 0) + 1
+            return counts[name] == 1
+        finally:
+            self.lock.release()
+
+    def fieldnames(self, names):
+        """
+        Returns the schema names of a list of field names, dropping those
+        not in the schema, used for CSV headers
+
+        :param names: Field names
+        :rtype: List
+        """
+        conformed = []
+        for name in names:
+            target = self.field_plan(name)[0]
+            if target is not None:
+                conformed.append(target)
+        return conformed
+
+    def __call__(self, record):
+        """
+        Returns record fitted to the schema
+
+        :param record: Dictionary of indexed values
+        :rtype: dict
+        """
+        conformed = {}
+        for name, value in record.items():
+            target, multi_valued = self.field_plan(name)
+            if target is None:
+                if value:
+                    self.count(self.dropped, name)
+                continue
+            if target != name:
+                self.count(self.renamed, name)
+            if not multi_valued and isinstance(value, (list, tuple, set, frozenset)):
+                if isinstance(value, (set, frozenset)):
+                    value = sorted(value)
+                if len(value) > 1 and self.count(self.truncated, target) \
+                   and self.log is not None:
+                    self.log("\tSingle-valued field {0} given {1} values, keeping {2!r}\n".format(
+                        target, len(value), value[0]))
+                value = next(iter(value), None)
+                if value is None:
+                    continue
+            conformed[target] = value
+        return conformed
+
+    def report(self):
+        """
+        Returns lines naming the fields dropped, renamed and truncated
+
+        :rtype: String
+        """
+        lines = []
+        for label, counts in (('Dropped', self.dropped),
+                              ('Renamed', self.renamed),
+                              ('Truncated to one value', self.truncated)):
+            if counts:
+                lines.append("\t{0} fields: {1}\n".format(
+                    label,
+                    ', '.join(["{0}={1}".format(name, counts[name])
+                               for name in sorted(counts)])))
+        return ''.join(lines)
@@ -0,0 +1,302 @@
+"""
+ :mod:`solr_standin` Local HTTP stand-in for a Solr server's update
+ handlers, used by the tests and benchmarks of the update clients. It
+ accepts JSON, XML, javabin and CSV updates, records every request and the
+ JSON and XML documents and commits it received, and can add a fixed
+ latency to each response to simulate a busy Solr node. HTTP/1.1
+ keep-alive, chunked and gzip encoded request bodies are supported so
+ connection reuse, streamed uploads and compression can be checked; a
+ gzip body that does not decompress is rejected with a 400. Responses are
+ JSON, or XML when the client asks for wt=xml as SolrJ's
+ XMLResponseParser does. A schema.xml is served the way Solr's admin file
+ handler does.
+"""
+__author__ = "Jeremy Nelson"
+
+import argparse
+import csv
+import json
+import threading
+import time
+import xml.etree.ElementTree as et
+
+try:
+    import BaseHTTPServer as http_server
+    import SocketServer as socketserver
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    import http.server as http_server
+    import socketserver
+    from urllib.parse import parse_qs, urlparse
+
+from solr_http import gunzip_body
+
+arg_parser = argparse.ArgumentParser(description='Run a Solr update stand-in')
+arg_parser.add_argument('--port',
+                        type=int,
+                        default=8983,
+                        help="[port] Port to listen on, default is 8983")
+arg_parser.add_argument('--latency',
+                        type=float,
+                        default=0.0,
+                        help="[latency] Seconds added to every response")
+
+SCHEMA = ('<?xml version="1.0" encoding="UTF-8"?>\n<schema name="standin"><fields>'
+          '<field name="id" type="string" multiValued="false"/>'
+          '<dynamicField name="*" type="string" multiValued="true"/>'
+          '</fields><uniqueKey>id</uniqueKey></schema>')
+RESPONSE = '{"responseHeader":{"status":0,"QTime":0}}'
+XML_RESPONSE = ('<?xml version="1.0" encoding="UTF-8"?>\n<response>'
+                '<lst name="responseHeader"><int name="status">0</int>'
+                '<int name="QTime">0</int></lst></response>')
+
+
+def xml_docs(body):
+    """
+    Returns the documents of an XML update message as dicts, repeated
+    fields as lists
+
+    :param body: XML update message bytes
+    :rtype: tuple of (list of dicts, Boolean commit)
+    """
+    root = et.fromstring(body)
+    docs = []
+    for doc_element in root.iter('doc'):
+        doc = {}
+        for field in doc_element.findall('field'):
+            name, value = field.get('name'), field.text or ''
+            if name in doc:
+                if not isinstance(doc[name], list):
+                    doc[name] = [doc[name]]
+                doc[name].append(value)
+            else:
+                doc[name] = value
+        docs.append(doc)
+    return docs, root.tag == 'commit'
+
+
+def csv_docs(body, params):
+    """
+    Returns the rows of a CSV update as dicts, splitting the fields that
+    have f.<field>.split=true on their f.<field>.separator
+
+    :param body: CSV bytes with a header row
+    :param params: dict of request parameters
+    :rtype: list of dicts
+    """
+    if not isinstance(body, str):
+        body = body.decode('utf-8')
+    rows = csv.reader(body.splitlines(True))
+    header = next(rows, [])
+    docs = []
+    for row in rows:
+        doc = {}
+        for name, value in zip(header, row):
+            if not value:
+                continue
+            if not isinstance(value, type(u'')):
+                # Python 2's csv module only reads bytes
+                value = value.decode('utf-8')
+            if params.get('f.{0}.split'.format(name)) == 'true':
+                value = value.split(params.get('f.{0}.separator'.format(name), ','))
+            doc[name] = value
+        docs.append(doc)
+    return docs
+
+
+class StandInHandler(http_server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if not size:
+                    # Trailers end with a blank line
+                    while self.rfile.readline().strip():
+                        pass
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def reply(self, status, body, content_type='application/json'):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path.endswith('/admin/file/') and params.get('file') == ['schema.xml']:
+            self.reply(200, self.server.standin.schema, 'application/xml')
+        else:
+            self.reply(404, '{"error":"not found"}')
+
+    def do_POST(self):
+        standin = self.server.standin
+        url = urlparse(self.path)
+        params = dict([(key, values[-1])
+                       for key, values in parse_qs(url.query).items()])
+        body = self.read_body()
+        encoding = self.headers.get('Content-Encoding', '').lower()
+        received = len(body)
+        if encoding == 'gzip':
+            try:
+                body = gunzip_body(body)
+            except ValueError as error:
+                standin.record(self.client_address, url.path, params,
+                               received, None, encoding)
+                self.reply(400, json.dumps({'error': str(error)}))
+                return
+        standin.record(self.client_address, url.path, params, received,
+                       len(body), encoding)
+        standin.started()
+        try:
+            self.respond(standin, url, params, body)
+        finally:
+            standin.finished()
+
+    def respond(self, standin, url, params, body):
+        "Applies a recorded update request and replies after the latency"
+        if standin.latency:
+            time.sleep(standin.latency)
+        if standin.fail:
+            self.reply(500, '{"error":"stand-in failure"}')
+            return
+        try:
+            standin.update(url.path, params, body,
+                           self.headers.get('Content-Type', ''))
+        except (ValueError, SyntaxError) as error:
+            self.reply(400, json.dumps({'error': str(error)}))
+            return
+        if params.get('wt') == 'xml':
+            self.reply(200, XML_RESPONSE, 'application/xml')
+        else:
+            self.reply(200, RESPONSE)
+
+
+class ThreadingServer(socketserver.ThreadingMixIn, http_server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SolrStandIn(object):
+    """
+    Runs a stand-in Solr on a background thread
+
+    :param latency: Seconds added to every response
+    :param port: Port to listen on, 0 picks a free port
+    :param schema: schema.xml served at admin/file/?file=schema.xml
+    """
+
+    def __init__(self, latency=0.0, port=0, schema=SCHEMA):
+        self.latency = latency
+        self.schema = schema
+        self.fail = False
+        self.lock = threading.Lock()
+        self.server = ThreadingServer(('127.0.0.1', port), StandInHandler)
+        self.server.standin = self
+        self.url = 'http://127.0.0.1:{0}/solr/'.format(self.server.server_address[1])
+        self.thread = None
+        self.reset()
+
+    def reset(self):
+        self.requests = []
+        self.docs = []
+        self.commits = []
+        self.connections = set()
+        # Requests being handled now, and the most handled at once
+        self.active = 0
+        self.most_active = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='solr-standin')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def record(self, client_address, path, params, received, decoded=None,
+               encoding=''):
+        """
+        Records a request as (path, params, bytes received, bytes after
+        decoding, Content-Encoding), decoded is None for a body that
+        failed to decode
+        """
+        self.lock.acquire()
+        try:
+            self.connections.add(client_address)
+            self.requests.append((path, params, received, decoded, encoding))
+        finally:
+            self.lock.release()
+
+    def started(self):
+        "Counts a request being handled, see most_active"
+        self.lock.acquire()
+        try:
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        finally:
+            self.lock.release()
+
+    def finished(self):
+        self.lock.acquire()
+        try:
+            self.active -= 1
+        finally:
+            self.lock.release()
+
+    def update(self, path, params, body, content_type=''):
+        """
+        Applies an update request, raises ValueError or SyntaxError for a
+        body the handler cannot parse. javabin bodies are only counted.
+
+        :param path: Request path
+        :param params: dict of request parameters
+        :param body: Request body bytes
+        :param content_type: Content-Type header
+        """
+        docs = []
+        if path.endswith('/update/json'):
+            values = json.loads(body.decode('utf-8') or '[]')
+            if isinstance(values, dict):
+                if 'commit' in values:
+                    params = dict(params, commit='true')
+            else:
+                docs = values
+        elif path.endswith('/update/csv'):
+            docs = csv_docs(body, params)
+        elif path.endswith('/update') and body and 'xml' in content_type:
+            docs, commit = xml_docs(body)
+            if commit:
+                params = dict(params, commit='true')
+        self.lock.acquire()
+        try:
+            self.docs.extend(docs)
+            if params.get('commit') == 'true' or params.get('softCommit') == 'true':
+                self.commits.append(params.get('softCommit') == 'true')
+        finally:
+            self.lock.release()
+
+
+if __name__ == '__main__':
+    args = arg_parser.parse_args()
+    standin = SolrStandIn(args.latency, args.port)
+    print("Solr stand-in at {0}".format(standin.url))
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        standin.server.server_close()
@@ -0,0 +1,469 @@
+"""
+ :mod:`solr_update` Client-side Solr update helpers shared by the
+ submission functions in :mod:`marc`: compacting records before they are
+ serialized, commit policies, document batching with optional latency
+ driven batch sizing, a log of failed background updates, and a small
+ adapter around pysolr.
+"""
+__author__ = "Jeremy Nelson"
+
+import datetime
+import sys
+import threading
+
+from index_stats import Histogram, clock
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+# Commit policy used when a submission function is not given one
+DEFAULT_COMMIT_POLICY = 'final'
+
+# Batch limits, a batch is sent when either is reached
+DEFAULT_BATCH_DOCS = 1000
+DEFAULT_BATCH_BYTES = 8 * 1024 * 1024
+
+# Adaptive batch size defaults: seconds per add aimed for, and bounds
+DEFAULT_TARGET_LATENCY = 2.0
+DEFAULT_MIN_BATCH_DOCS = 100
+DEFAULT_MAX_BATCH_DOCS = 10000
+
+# Approximate bytes of XML markup around each field and each document,
+# <field name=""></field> and <doc></doc>
+FIELD_OVERHEAD = 22
+DOC_OVERHEAD = 11
+
+
+class CommitPolicy(object):
+    """
+    Decides when a submission commits. Subclasses override after_batch,
+    finish, and params; the elapsed time of every commit is recorded in
+    commit_times.
+    """
+    name = None
+    # Milliseconds passed as commitWithin on every add, None for no limit
+    commit_within = None
+
+    def __init__(self):
+        self.commit_times = Histogram()
+
+    def commit(self, client, soft=False):
+        """
+        Commits and records how long the commit took
+
+        :param client: Update client with a commit(soft) method
+        :param soft: Boolean, send a soft commit
+        """
+        start = clock()
+        try:
+            client.commit(soft=soft)
+        finally:
+            self.commit_times.add(clock() - start)
+
+    def after_batch(self, client):
+        "Called after every batch is added"
+        pass
+
+    def finish(self, client):
+        "Called once after the last batch is added"
+        pass
+
+    def params(self):
+        """
+        Returns the request parameters for a single update request that
+        carries the whole load, used by the CSV loader
+
+        :rtype: dict
+        """
+        return {}
+
+    def report(self):
+        """
+        Returns a one line summary of the time spent committing
+
+        :rtype: String
+        """
+        return "\tCommit policy:{0} Commits:{1} Commit time:{2:.2f}s\n".format(
+            self.name,
+            self.commit_times.count,
+            self.commit_times.total)
+
+
+class BatchCommit(CommitPolicy):
+    """
+    Hard commit after every batch, the indexer's original behaviour
+    """
+    name = 'batch'
+
+    def after_batch(self, client):
+        self.commit(client)
+
+    def params(self):
+        return {'commit': 'true'}
+
+
+class FinalCommit(CommitPolicy):
+    """
+    One hard commit after the last batch
+    """
+    name = 'final'
+
+    def finish(self, client):
+        self.commit(client)
+
+    def params(self):
+        return {'commit': 'true'}
+
+
+class CommitWithin(CommitPolicy):
+    """
+    Leaves committing to Solr by sending commitWithin with every add
+
+    :param milliseconds: Maximum time before added documents are committed
+    """
+    name = 'within'
+
+    def __init__(self, milliseconds):
+        CommitPolicy.__init__(self)
+        self.commit_within = int(milliseconds)
+
+    def params(self):
+        return {'commitWithin': str(self.commit_within)}
+
+
+class SoftCommit(CommitPolicy):
+    """
+    Soft commits at most every interval seconds while loading, then a
+    single hard commit at the end
+
+    :param interval: Seconds between soft commits
+    """
+    name = 'soft'
+
+    def __init__(self, interval):
+        CommitPolicy.__init__(self)
+        self.interval = float(interval)
+        self.last_commit = clock()
+
+    def after_batch(self, client):
+        if clock() - self.last_commit >= self.interval:
+            self.commit(client, soft=True)
+            self.last_commit = clock()
+
+    def finish(self, client):
+        self.commit(client)
+
+    def params(self):
+        # A single request is both the load and its end, so it hard commits
+        return {'commit': 'true'}
+
+
+def make_commit_policy(spec=None):
+    """
+    Builds a commit policy from a spec string: 'batch', 'final',
+    'within:<milliseconds>' or 'soft:<seconds>'. CommitPolicy instances
+    are returned unchanged.
+
+    :param spec: Commit policy spec, defaults to DEFAULT_COMMIT_POLICY
+    :rtype: CommitPolicy
+    """
+    if isinstance(spec, CommitPolicy):
+        return spec
+    if spec is None:
+        spec = DEFAULT_COMMIT_POLICY
+    name, _, value = spec.partition(':')
+    if name == 'batch':
+        return BatchCommit()
+    if name == 'final':
+        return FinalCommit()
+    if name == 'within':
+        return CommitWithin(value or 60000)
+    if name == 'soft':
+        return SoftCommit(value or 60)
+    raise ValueError("Unknown commit policy {0}".format(spec))
+
+
+def compact_record(record):
+    """
+    Returns a copy of a record dict without None or empty values, with
+    repeated values of multi-valued fields removed, first one kept, and
+    sets turned into lists
+
+    :param record: Dictionary of indexed values
+    :rtype: dict
+    """
+    compacted = {}
+    for key, value in record.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set, frozenset)):
+            values, seen = [], set()
+            for item in value:
+                if item is None or item == '' or item in seen:
+                    continue
+                seen.add(item)
+                values.append(item)
+            if not values:
+                continue
+            value = values
+        elif isinstance(value, string_types) and not value:
+            continue
+        compacted[key] = value
+    return compacted
+
+def estimate_size(record):
+    """
+    Estimates the bytes a record dict takes in an XML update request from
+    the lengths of its field names and values, without serializing it
+
+    :param record: Dictionary of indexed values
+    :rtype: int
+    """
+    size = DOC_OVERHEAD
+    for key, value in record.items():
+        if value is None:
+            continue
+        if not isinstance(value, (list, tuple, set, frozenset)):
+            value = [value]
+        for item in value:
+            if not isinstance(item, string_types):
+                item = str(item)
+            size += FIELD_OVERHEAD + len(key) + len(item)
+    return size
+
+
+class AdaptiveBatchSize(object):
+    """
+    Additive increase, multiplicative decrease control of the documents
+    per batch. A batch whose add took longer than target seconds cuts the
+    size by the decrease factor, a faster one grows it by increase
+    documents, always within minimum and maximum. Every change is written
+    to log so the bounds can be tuned.
+
+    :param target: Seconds per add aimed for
+    :param minimum: Smallest batch size
+    :param maximum: Largest batch size
+    :param increase: Documents added after a fast batch
+    :param decrease: Factor applied after a slow batch
+    :param log: Function called with each change message
+    """
+
+    def __init__(self, target=DEFAULT_TARGET_LATENCY,
+                 minimum=DEFAULT_MIN_BATCH_DOCS,
+                 maximum=DEFAULT_MAX_BATCH_DOCS,
+                 increase=None, decrease=0.5, log=sys.stderr.write):
+        if not 0 < minimum <= maximum:
+            raise ValueError("Batch size bounds {0}:{1} are invalid".format(
+                minimum, maximum))
+        self.target = float(target)
+        self.minimum = int(minimum)
+        self.maximum = int(maximum)
+        self.increase = increase or self.minimum
+        self.decrease = decrease
+        self.log = log
+        self.changes = 0
+
+    def clamp(self, size):
+        return max(self.minimum, min(self.maximum, int(size)))
+
+    def update(self, seconds, size):
+        """
+        Returns the batch size to use after a batch of size documents
+        took seconds to add
+
+        :param seconds: Elapsed time of the add
+        :param size: Current batch size
+        :rtype: int
+        """
+        if seconds > self.target:
+            new_size = self.clamp(size * self.decrease)
+        else:
+            new_size = self.clamp(size + self.increase)
+        if new_size != size:
+            self.changes += 1
+            if self.log is not None:
+                self.log("\n\tBatch size {0} -> {1}, add took {2:.2f}s for a {3:.2f}s target\n".format(
+                    size, new_size, seconds, self.target))
+        return new_size
+
+
+def make_batch_controller(spec=None):
+    """
+    Builds an AdaptiveBatchSize from a spec string
+    '<target seconds>[:<minimum>:<maximum>]'. None returns None, for fixed
+    size batches, and AdaptiveBatchSize instances are returned unchanged.
+
+    :param spec: Adaptive batch size spec
+    :rtype: AdaptiveBatchSize or None
+    """
+    if spec is None or isinstance(spec, AdaptiveBatchSize):
+        return spec
+    values = str(spec).split(':')
+    if len(values) not in (1, 3):
+        raise ValueError("Unknown adaptive batch spec {0}".format(spec))
+    if len(values) == 1:
+        return AdaptiveBatchSize(float(values[0]))
+    return AdaptiveBatchSize(float(values[0]), int(values[1]), int(values[2]))
+
+
+class Batcher(object):
+    """
+    Collects documents for a Solr add until either max_docs documents or
+    max_bytes estimated bytes are waiting, whichever comes first. The size
+    of every batch taken is recorded in stats as batch_docs and
+    batch_bytes, and the time of every add reported to sent as
+    add_seconds. With a controller, max_docs follows the add latency.
+
+    :param max_docs: Documents per batch, the starting size with a
+                     controller
+    :param max_bytes: Estimated bytes per batch, None for no byte limit
+    :param stats: index_stats.RunStats
+    :param controller: AdaptiveBatchSize or None for a fixed size
+    """
+
+    def __init__(self, max_docs=DEFAULT_BATCH_DOCS,
+                 max_bytes=DEFAULT_BATCH_BYTES, stats=None, controller=None):
+        self.controller = controller
+        if controller is not None:
+            max_docs = controller.clamp(max_docs)
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.stats = stats
+        self.docs = []
+        self.size = 0
+        # Whether the last batch taken was full, for the controller
+        self.taken_full = False
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, doc, size=0):
+        """
+        Adds a document, returns True when the batch is full
+
+        :param doc: Document sent to Solr
+        :param size: Estimated bytes of the document
+        :rtype: Boolean
+        """
+        self.docs.append(doc)
+        self.size += size
+        return self.full()
+
+    def full(self):
+        if len(self.docs) >= self.max_docs:
+            return True
+        return self.max_bytes is not None and self.size >= self.max_bytes
+
+    def take(self):
+        """
+        Returns the waiting documents and starts a new batch
+
+        :rtype: List
+        """
+        docs = self.docs
+        if self.stats is not None and docs:
+            self.stats.add('batch_docs', len(docs))
+            self.stats.add('batch_bytes', self.size)
+        self.taken_full = self.full()
+        self.docs, self.size = [], 0
+        return docs
+
+    def sent(self, seconds):
+        """
+        Records how long the last batch taken took to add and lets the
+        controller resize the batches. Partial batches, such as the last
+        one of a file, do not change the size.
+
+        :param seconds: Elapsed time of the add
+        """
+        if self.stats is not None:
+            self.stats.add('add_seconds', seconds, 1e6)
+        if self.controller is not None and self.taken_full:
+            self.max_docs = self.controller.update(seconds, self.max_docs)
+
+
+class UpdateErrorLog(object):
+    """
+    Log file of update requests that failed on a background connection,
+    such as those of a streaming SolrJ server, opened on the first
+    failure and flushed after every entry so it is complete while the run
+    goes on
+
+    :param log_filename: Log file name
+    :param echo: Function also called with each failure message, None
+                 for none
+    """
+
+    def __init__(self, log_filename, echo=sys.stderr.write):
+        self.log_filename = log_filename
+        self.echo = echo
+        self.log_file = None
+        self.failed_batches = 0
+        self.lock = threading.Lock()
+
+    def failed(self, error):
+        """
+        Records a failed update request
+
+        :param error: The exception or message of the failure
+        """
+        self.lock.acquire()
+        try:
+            self.failed_batches += 1
+            if self.log_file is None:
+                self.log_file = open(self.log_filename, 'a')
+            self.log_file.write("{0} Solr update failed: {1}\n".format(
+                datetime.datetime.today().isoformat(),
+                error))
+            self.log_file.flush()
+        finally:
+            self.lock.release()
+        if self.echo is not None:
+            self.echo("\nSolr update failed: {0}\n".format(error))
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+    def report(self):
+        """
+        Returns the number of failed batches and, if any, the log file
+
+        :rtype: String
+        """
+        message = "\tFailed Solr batches:{0}\n".format(self.failed_batches)
+        if self.failed_batches:
+            message += "\tErrors logged to {0}\n".format(self.log_filename)
+        return message
+
+
+class PySolrClient(object):
+    """
+    Adapts pysolr.Solr to the add/commit calls the commit policies use.
+    pysolr commits on every add by default, so adds never commit here.
+
+    :param solr: pysolr.Solr instance
+    """
+
+    def __init__(self, solr):
+        self.solr = solr
+
+    def add(self, docs, commit_within=None):
+        if commit_within is None:
+            return self.solr.add(docs, commit=False)
+        return self.solr.add(docs, commit=False, commitWithin=commit_within)
+
+    def commit(self, soft=False):
+        if soft:
+            return self.solr.commit(softCommit=True)
+        return self.solr.commit()
+
+    def flush(self):
+        "Adds are synchronous, nothing is waiting to be sent"
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,60 @@
+"""
+ :mod:`test_csv_parts` Tests for the CSV part file writer and parallel
+ loader, run against the local Solr stand-in
+"""
+__author__ = "Jeremy Nelson"
+
+import os
+import tempfile
+
+import csv_parts
+from solr_standin import SolrStandIn
+
+
+def write_parts(rows=5, part_rows=2):
+    pattern = os.path.join(tempfile.mkdtemp(), 'tmp-part{0:03d}.csv')
+    writer = csv_parts.PartWriter(pattern, ['id', 'subject'], part_rows)
+    for i in range(rows):
+        writer.writerow({'id': 'b{0}'.format(i), 'subject': 'Trains|Railroads'})
+    writer.close()
+    return writer
+
+def test_part_writer_rotates():
+    writer = write_parts(rows=9)
+    # A rerun with fewer parts removes the parts of the earlier run
+    writer = csv_parts.PartWriter(writer.filename_pattern, ['id', 'subject'], 2)
+    for i in range(5):
+        writer.writerow({'id': 'b{0}'.format(i), 'subject': 'Trains|Railroads'})
+    writer.close()
+    assert sorted(os.listdir(os.path.dirname(writer.filenames[0]))) == [
+        'tmp-part000.csv', 'tmp-part001.csv', 'tmp-part002.csv']
+    assert writer.rows == [2, 2, 1]
+    assert [os.path.basename(name) for name in writer.filenames] == [
+        'tmp-part000.csv', 'tmp-part001.csv', 'tmp-part002.csv']
+    lines = open(writer.filenames[1]).read().splitlines()
+    assert lines == ['id,subject', 'b2,Trains|Railroads', 'b3,Trains|Railroads']
+
+def test_load_parts_reports_each_part():
+    writer = write_parts()
+    filenames = writer.filenames + ['missing-part.csv']
+    standin = SolrStandIn(latency=0.05).start()
+    try:
+        loaded = []
+        update_url = standin.url + 'update/csv?f.subject.split=true&f.subject.separator=%7C'
+        results = csv_parts.load_parts(filenames, update_url, threads=4,
+                                       after_part=loaded.append,
+                                       remove_loaded=True)
+        assert [os.path.exists(name) for name in writer.filenames] == [False] * 3
+        csv_parts.CommitClient(standin.url).commit()
+        assert [result['filename'] for result in results] == filenames
+        assert [result['error'] is None for result in results] == [True, True, True, False]
+        assert len(loaded) == 3
+        assert len(standin.docs) == 5
+        assert standin.docs[0]['subject'] == ['Trains', 'Railroads']
+        assert standin.commits == [False]
+        report = csv_parts.report(results, writer.rows + [0])
+        assert 'rows=2 bytes=' in report
+        assert 'missing-part.csv: rows=0 time=' in report
+        assert report.count('FAILED') == 1
+    finally:
+        standin.stop()
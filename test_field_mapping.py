@@ -0,0 +1,85 @@
+"""
+ :mod:`test_field_mapping` Tests for the declarative field mapping compiler
+"""
+__author__ = "Jeremy Nelson"
+
+import field_mapping
+from field_mapping import compile_mappings, computed, field, run_extractors, step
+
+
+class Subfield(object):
+
+    def __init__(self, code, data):
+        self.code = code
+        self.data = data
+
+    def getData(self):
+        return self.data
+
+
+class DataField(object):
+
+    def __init__(self, tag, subfields):
+        self.tag = tag
+        self.subfields = [Subfield(code, data) for code, data in subfields]
+
+    def getSubfields(self, code):
+        return [x for x in self.subfields if x.code == code]
+
+    def getSubfield(self, code):
+        subfields = self.getSubfields(code)
+        if subfields:
+            return subfields[0]
+
+
+class Record(object):
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.lookups = []
+
+    def getVariableFields(self, tag):
+        self.lookups.append(tag)
+        return [x for x in self.fields if x.tag == tag]
+
+
+def make_record():
+    return Record([DataField('260', [('a', 'Denver :'), ('b', 'Pub.,')]),
+                   DataField('260', [('a', 'Boulder')]),
+                   DataField('856', [('u', 'http://a'), ('u', 'http://b')]),
+                   DataField('650', [('a', 'Trains')])])
+
+def test_single_and_multi_valued():
+    extractors = compile_mappings([
+        field('publisher_location', tags=('260',), subfields='a',
+              normalizer=lambda value: value.strip(' :')),
+        field('publisher', tags=('260',), subfields='b'),
+        field('url', tags=('856',), subfields='u', multi_valued=True),
+        field('series', tags=('490',), subfields='a', multi_valued=True),
+        field('title', tags=('245',), subfields='a')])
+    record = run_extractors(extractors, make_record(), {'url': ['http://c']})
+    assert record == {'publisher_location': 'Denver',
+                      'publisher': 'Pub.,',
+                      'url': ['http://c', 'http://a', 'http://b'],
+                      'series': []}
+
+def test_same_tags_merged():
+    mappings = [field('publisher_location', tags=('260',), subfields='a'),
+                field('publisher', tags=('260',), subfields='b'),
+                field('topic', tags=('650',), subfields='a', multi_valued=True)]
+    extractors = compile_mappings(mappings)
+    assert len(extractors) == 2
+    marc_record = make_record()
+    run_extractors(extractors, marc_record, {})
+    assert marc_record.lookups == ['260', '650']
+
+def test_computed_and_steps_keep_order():
+    def set_both(marc_record, record, ils):
+        record['a'], record['b'] = 1, 2
+    mappings = [step(('a', 'b'), set_both),
+                computed('c', lambda marc_record, record, ils: record['a'] + 1),
+                computed('ils', lambda marc_record, record, ils: ils)]
+    record = run_extractors(compile_mappings(mappings), make_record(), {},
+                            ils='III')
+    assert record == {'a': 1, 'b': 2, 'c': 2, 'ils': 'III'}
+    assert field_mapping.fieldnames(mappings) == ['a', 'b', 'c', 'ils']
@@ -0,0 +1,70 @@
+"""
+ :mod:`test_format_classifier` Tests for the decision-table format classifier
+"""
+__author__ = "Jeremy Nelson"
+
+from format_classifier import FormatClassifier
+
+
+class Field(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def getData(self):
+        return self.data
+
+    def toString(self):
+        return self.data
+
+
+class Leader(object):
+
+    def __init__(self, value):
+        self.value = value
+
+    def toString(self):
+        return self.value
+
+
+class Record(object):
+
+    def __init__(self, leader, **fields):
+        self.leader = Leader(leader)
+        self.fields = fields
+
+    def getLeader(self):
+        return self.leader
+
+    def getVariableField(self, tag):
+        if 'f' + tag in self.fields:
+            return Field(self.fields['f' + tag])
+
+
+def test_format_classifier():
+    for leader, fields, format in [
+        ('00000nam a2200000 a 4500', {'f008': ' ' * 40}, 'Book'),
+        ('00000nas a2200000 a 4500', {'f008': ' ' * 21 + 'm' + ' ' * 18}, 'Book'),
+        ('00000nas a2200000 a 4500', {'f008': ' ' * 21 + 'w' + ' ' * 18}, 'Journal'),
+        ('00000ngm a2200000 a 4500', {'f007': 'vd cvaizq'}, 'DVD Video'),
+        ('00000njm a2200000 a 4500', {'f007': 'sd fsngnnmmned'}, 'Music CD'),
+        ('00000nim a2200000 a 4500', {'f007': 'ss lsnjlcnnnuu'}, 'Book On Cassette'),
+        ('00000ntm a2200000 a 4500', {'f008': ' ' * 40,
+                                      'f502': 'Thesis (M.A.)'}, 'Thesis'),
+        ('00000ntm a2200000 a 4500', {'f008': ' ' * 40}, 'Manuscript'),
+        ('00000nzm a2200000 a 4500', {'f006': 'm     o  d        '}, 'Electronic'),
+        ('00000nzm a2200000 a 4500', {}, 'Unknown')]:
+        check_format(leader, fields, format)
+
+def check_format(leader, fields, format):
+    classifier = FormatClassifier()
+    assert classifier.classify(Record(leader, **fields)) == format
+
+def test_memoized():
+    classifier = FormatClassifier(maxsize=2)
+    for i in range(3):
+        classifier.classify(Record('00000nam a2200000 a 4500', f008=' ' * 40))
+    assert (classifier.hits, classifier.misses) == (2, 1)
+    for leader6 in 'bceg':
+        classifier.classify(Record('00000n{0}m a2200000 a 4500'.format(leader6)))
+    assert len(classifier.cache) <= 2
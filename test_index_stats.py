@@ -0,0 +1,57 @@
+"""
+ :mod:`test_index_stats` Tests for the indexing run statistics
+"""
+__author__ = "Jeremy Nelson"
+
+import json
+import os
+import tempfile
+
+from index_stats import ExtractorProfiler, Histogram
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    for i in range(90):
+        histogram.add(0.001)
+    for i in range(10):
+        histogram.add(0.1)
+    assert histogram.count == 100
+    assert 0.001 <= histogram.percentile(50) < 0.0012
+    assert 0.1 <= histogram.percentile(99) <= 0.1
+    assert histogram.to_dict()['max'] == 0.1
+
+def test_histogram_merge():
+    first, second = Histogram(), Histogram()
+    first.add(0.002)
+    second.add(0.004)
+    second.add(0.000001)
+    first.merge(Histogram.from_dict(second.to_dict()))
+    assert first.count == 3
+    assert first.minimum == 0.000001
+    assert first.maximum == 0.004
+
+def extractor(value):
+    return value * 2
+
+def test_instrument_namespace():
+    profiler = ExtractorProfiler()
+    namespace = {'extractor': extractor}
+    profiler.instrument(namespace, ['extractor'])
+    assert profiler.enabled
+    assert namespace['extractor'](2) == 4
+    assert namespace['extractor'](3) == 6
+    assert profiler.timings['extractor'].count == 2
+    profiler.uninstrument(namespace)
+    assert namespace['extractor'] is extractor
+    assert not profiler.enabled
+
+def test_write_json():
+    profiler = ExtractorProfiler()
+    profiler.add('get_format', 0.5)
+    json_filename = os.path.join(tempfile.mkdtemp(), 'profile.json')
+    profiler.write_json(json_filename, marc_filename='shard.mrc')
+    values = json.load(open(json_filename))
+    assert values['marc_filename'] == 'shard.mrc'
+    assert values['timings']['get_format']['count'] == 1
+    assert 'get_format' in profiler.report()
@@ -0,0 +1,73 @@
+"""
+ :mod:`test_iso2709` Tests for the pure-Python ISO 2709 reader
+"""
+__author__ = "Jeremy Nelson"
+
+import io
+
+import iso2709
+from record_view import RecordView
+from sharder import check_suppressed
+
+FIELDS = [('001', u'ocm12345'),
+          ('008', u'020101s2002    nyu           000 0 eng d'),
+          ('245', (u'14', [('a', u'The caf\xe9 /'), ('c', u'Jane Doe.')])),
+          ('650', (u' 0', [('a', u'Trains'), ('z', u'Colorado')])),
+          ('650', (u' 0', [('a', u'Railroads')])),
+          ('907', (u'  ', [('a', u'.b12345678')]))]
+
+def make_file(count=3):
+    records = [iso2709.as_marc(FIELDS) for i in range(count)]
+    return io.BytesIO(b'\n'.join(records))
+
+def test_read_records():
+    reader = iso2709.MarcReader(make_file(3), chunk_size=100)
+    records = []
+    while reader.hasNext():
+        records.append(reader.next())
+    assert len(records) == 3
+    assert records[0].as_marc() == iso2709.as_marc(FIELDS)
+    assert len(list(iso2709.MarcReader(make_file(2)))) == 2
+
+def test_field_access():
+    record = next(iso2709.MarcReader(make_file(1)))
+    assert record.getLeader().toString()[6:8] == 'am'
+    assert record.getControlNumber() == 'ocm12345'
+    field245 = record.getVariableField('245')
+    assert field245.indicator2 == '4'
+    assert field245.getSubfield('a').getData() == u'The caf\xe9 /'
+    assert [x.code for x in field245.subfields] == ['a', 'c']
+    assert field245.getSubfield('b') is None
+    assert len(record.getVariableFields('650')) == 2
+    assert [x.getTag() for x in record.getVariableFields(['907', '001'])] == ['001', '907']
+    assert record.getVariableField('100') is None
+
+def test_fields_decoded_lazily():
+    record = next(iso2709.MarcReader(make_file(1)))
+    fields = record.getVariableFields('650')
+    assert fields[0]._subfields is None
+    fields[0].getSubfields('z')
+    assert fields[0]._subfields is not None
+    assert fields[1]._subfields is None
+
+def test_to_string():
+    record = next(iso2709.MarcReader(make_file(1)))
+    lines = record.toString().splitlines()
+    assert lines[0].startswith('LEADER ')
+    assert lines[3] == u'245 14$aThe caf\xe9 /$cJane Doe.'
+
+def test_record_view_and_suppressed():
+    view = RecordView(next(iso2709.MarcReader(make_file(1))))
+    assert len(view.getRange('6')) == 2
+    assert check_suppressed(view) is False
+    suppressed = iso2709.as_marc(FIELDS + [('999', (u'  ', [('f', u'n')]))])
+    assert check_suppressed(iso2709.Record(suppressed)) is True
+
+def test_truncated_record():
+    reader = iso2709.MarcReader(io.BytesIO(iso2709.as_marc(FIELDS)[:-10]))
+    try:
+        reader.read()
+    except iso2709.MarcReadError:
+        pass
+    else:
+        assert False, "Expected MarcReadError"
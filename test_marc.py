@@ -0,0 +1,67 @@
+"""
+ :mod:`test_marc` Tests that the FIELD_MAPPINGS extractors build the same
+ record dicts as get_record, run where marc imports, on Jython or on
+ CPython 2 with pysolr and tutt-checkin.csv
+"""
+__author__ = "Jeremy Nelson"
+
+import iso2709
+import marc
+from field_mapping import fieldnames
+
+FIELDS = [('001', u'ocm12345'),
+          ('008', u'020101s2002    nyu           000 0 eng d'),
+          ('020', (u'  ', [('a', u'0123456789 (pbk.)')])),
+          ('041', (u'1 ', [('a', u'eng'), ('h', u'fre')])),
+          ('050', (u'00', [('a', u'PS3553'), ('b', u'.H15')])),
+          ('100', (u'1 ', [('a', u'Doe, Jane,'), ('d', u'1950-')])),
+          ('245', (u'14', [('a', u'The caf\xe9 /'), ('c', u'Jane Doe.')])),
+          ('260', (u'  ', [('a', u'New York :'), ('b', u'Pub,'), ('c', u'2002.')])),
+          ('300', (u'  ', [('a', u'200 p.')])),
+          ('490', (u'0 ', [('a', u'Rail history')])),
+          ('500', (u'  ', [('a', u'Note one.')])),
+          ('505', (u'0 ', [('a', u'Contents.')])),
+          ('520', (u'  ', [('a', u'A summary.')])),
+          ('600', (u'10', [('a', u'Smith, John'), ('x', u'Travel')])),
+          ('650', (u' 0', [('a', u'Trains'), ('z', u'Colorado'), ('y', u'1900-')])),
+          ('650', (u' 0', [('a', u'Railroads'), ('v', u'History')])),
+          ('655', (u' 7', [('a', u'Travel writing')])),
+          ('700', (u'1 ', [('a', u'Smith, J.'), ('d', u'1900-')])),
+          ('710', (u'2 ', [('a', u'Union Pacific.')])),
+          ('856', (u'40', [('u', u'http://example.org/')])),
+          ('907', (u'  ', [('a', u'.b12345678')])),
+          ('945', (u'  ', [('c', u'v.1'), ('y', u'.i1234567x')])),
+          ('994', (u'  ', [('a', u'tb')]))]
+
+
+def sample_records():
+    "Returns variations of FIELDS as iso2709 records"
+    variations = [FIELDS,
+                  [field for field in FIELDS if field[0] not in ('100', '6')],
+                  [field for field in FIELDS if not field[0].startswith('6')],
+                  [field for field in FIELDS if field[0] not in ('008', '945')],
+                  [field for field in FIELDS if field[0] != '907'] +
+                  [('035', (u'  ', [('a', u'(b7654321)')])),
+                   ('907', (u'  ', [('a', u'.b1')]))],
+                  [field for field in FIELDS if field[0] != '907']]
+    return [iso2709.Record(iso2709.as_marc(fields)) for fields in variations]
+
+def test_fieldnames_cover_mappings():
+    assert sorted(marc.FIELDNAMES) == sorted(['id'] + fieldnames(marc.FIELD_MAPPINGS))
+    assert len(set(marc.FIELDNAMES)) == len(marc.FIELDNAMES)
+
+def test_mapped_record_matches_get_record():
+    assert marc.get_record(sample_records()[4], 'III')['id'] == 'b7654321'
+    for ils in ('III', None):
+        for marc_record in sample_records():
+            assert marc.get_mapped_record(marc_record, ils) == marc.get_record(marc_record, ils)
+
+def test_suppressed_in_both():
+    fields = FIELDS + [('999', (u'  ', [('f', u'n')]))]
+    for get in (marc.get_record, marc.get_mapped_record):
+        try:
+            get(iso2709.Record(iso2709.as_marc(fields)), 'III')
+        except marc.RecordSuppressedError:
+            pass
+        else:
+            assert False, "Expected RecordSuppressedError"
@@ -0,0 +1,92 @@
+"""
+ :mod:`test_marc_index` Tests for the MARC record offset index
+"""
+__author__ = "Jeremy Nelson"
+
+import os
+import tempfile
+
+import iso2709
+import marc_index
+
+FIELDS = [('001', u'ocm12345'),
+          ('245', (u'14', [('a', u'The caf\xe9 /'), ('c', u'Jane Doe.')])),
+          ('907', (u'  ', [('a', u'.b1234567x')]))]
+
+
+def make_records(count=5):
+    records = []
+    for i in range(count):
+        fields = FIELDS[:2] + [('500', (u'  ', [('a', u'Note ' * i)])),
+                               ('907', (u'  ', [('a', u'.b{0:07d}x'.format(i))]))]
+        records.append(iso2709.as_marc(fields))
+    return records
+
+def write_file(records, separator=b''):
+    filename = os.path.join(tempfile.mkdtemp(), 'records.mrc')
+    marc_file = open(filename, 'wb')
+    marc_file.write(separator.join(records))
+    marc_file.close()
+    return filename
+
+def test_raw_fields():
+    raw = iso2709.as_marc(FIELDS)
+    assert marc_index.raw_field(raw, '001') == b'ocm12345'
+    assert marc_index.raw_field(raw, '650') is None
+    field245 = marc_index.raw_field(raw, '245')
+    assert marc_index.raw_subfield(field245, 'c') == b'Jane Doe.'
+    assert marc_index.raw_bib_id(raw) == u'b1234567'
+
+def test_build_and_load_index():
+    records = make_records()
+    filename = write_file(records, b'\r\n')
+    index = marc_index.build_index(filename, bib_ids=True)
+    assert len(index) == 5
+    assert [index[i][1] for i in range(5)] == [len(record) for record in records]
+    marc_file = open(filename, 'rb')
+    assert index.read(marc_file, 3) == records[3]
+    marc_file.close()
+    assert index.bib_ids[2] == u'b0000002'
+    assert index.find(u'b0000004') == 4
+    assert index.split(2) == [(0, 3), (3, 5)]
+    assert index.split(10)[-1][1] == 5
+    reader = index.reader(filename, 3)
+    assert [record.as_marc() for record in reader] == records[3:]
+    reader.stream.close()
+    index_filename = marc_index.index_filename(filename)
+    index.write(index_filename)
+    loaded = marc_index.MarcIndex.load(index_filename, filename)
+    assert list(loaded.offsets) == list(index.offsets)
+    assert list(loaded.lengths) == list(index.lengths)
+    assert loaded.bib_ids == index.bib_ids
+
+def test_open_index_rebuilds_stale_index():
+    filename = write_file(make_records(2))
+    index = marc_index.open_index(filename)
+    assert len(index) == 2 and index.bib_ids is None
+    marc_file = open(filename, 'ab')
+    marc_file.write(make_records(3)[2])
+    marc_file.close()
+    try:
+        marc_index.MarcIndex.load(marc_index.index_filename(filename), filename)
+    except marc_index.MarcIndexError:
+        pass
+    else:
+        assert False, "Expected MarcIndexError"
+    index = marc_index.open_index(filename, bib_ids=True)
+    assert len(index) == 3
+    assert index.bib_ids == [u'b0000000', u'b0000001', u'b0000002']
+
+def test_same_size_rewrite_rebuilds_index():
+    records = make_records(3)
+    filename = write_file(records)
+    index = marc_index.open_index(filename)
+    # Same size, records swapped and the modification time kept
+    mtime = os.path.getmtime(filename)
+    marc_file = open(filename, 'wb')
+    marc_file.write(records[2] + records[0] + records[1])
+    marc_file.close()
+    os.utime(filename, (mtime, mtime))
+    assert os.path.getsize(filename) == index.size
+    index = marc_index.open_index(filename)
+    assert list(index.lengths) == [len(records[2]), len(records[0]), len(records[1])]
@@ -0,0 +1,43 @@
+"""
+ :mod:`test_parallel_index` Tests for the parallel shard indexer
+"""
+__author__ = "Jeremy Nelson"
+
+import os
+import tempfile
+
+import parallel_index
+from index_stats import ExtractorProfiler, RunStats
+
+
+def test_shard_filenames():
+    directory = tempfile.mkdtemp()
+    for filename in ('b-shard.mrc', 'a-shard.mrc', 'errors.log'):
+        open(os.path.join(directory, filename), 'w').close()
+    assert parallel_index.shard_filenames(directory) == [
+        os.path.join(directory, 'a-shard.mrc'),
+        os.path.join(directory, 'b-shard.mrc')]
+
+def test_combine_results():
+    profiler = ExtractorProfiler()
+    profiler.add('get_format', 0.25)
+    run_stats = RunStats()
+    run_stats.add('batch_docs', 10)
+    results = [{'filename': 'a.mrc', 'count': 10, 'errors': 1,
+                'suppressed': 2, 'timings': profiler.to_dict(),
+                'run_stats': run_stats.to_dict(),
+                'nodes': {'http://a/solr/': {'docs': 4},
+                          'http://b/solr/': {'docs': 5}}},
+               {'filename': 'b.mrc', 'count': 5, 'errors': 0,
+                'suppressed': 1, 'timings': profiler.to_dict(),
+                'nodes': {'http://a/solr/': {'docs': 3}}},
+               {'filename': 'c.mrc', 'failed': True}]
+    totals, combined, stats = parallel_index.combine_results(results)
+    assert totals['files'] == 3
+    assert (totals['count'], totals['errors'], totals['suppressed']) == (15, 1, 3)
+    assert totals['failed_files'] == ['c.mrc']
+    assert totals['nodes'] == {'http://a/solr/': 7, 'http://b/solr/': 5}
+    assert combined.timings['get_format'].count == 2
+    assert combined.timings['get_format'].total == 0.5
+    assert stats.histograms['batch_docs'].count == 1
+    assert stats.histograms['batch_docs'].total == 10
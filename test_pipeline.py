@@ -0,0 +1,70 @@
+"""
+ :mod:`test_pipeline` Tests for the threaded extraction pipeline
+"""
+__author__ = "Jeremy Nelson"
+
+import random
+import time
+
+from pipeline import ExtractionPipeline, PipelineError
+
+
+def slow_square(value):
+    time.sleep(random.random() / 1000.0)
+    if value % 10 == 3:
+        raise ValueError("bad record {0}".format(value))
+    return value * value
+
+def run(ordered, workers=4):
+    written, errors = [], []
+    pipeline = ExtractionPipeline(slow_square,
+                                  lambda item, result: written.append((item, result)),
+                                  lambda item, exc_info: errors.append(item),
+                                  workers=workers,
+                                  queue_size=8,
+                                  ordered=ordered)
+    assert pipeline.run(range(200)) == 200
+    return pipeline, written, errors
+
+def test_ordered():
+    pipeline, written, errors = run(ordered=True)
+    expected = [x for x in range(200) if x % 10 != 3]
+    assert written == [(x, x * x) for x in expected]
+    assert errors == [x for x in range(200) if x % 10 == 3]
+    assert (pipeline.written, pipeline.failed) == (180, 20)
+
+def test_ordered_slow_item_bounds_results():
+    started, first_done = [], []
+    def extract(value):
+        started.append(value)
+        if value == 0:
+            time.sleep(0.3)
+            first_done.append(len(started))
+        return value
+    written = []
+    pipeline = ExtractionPipeline(extract,
+                                  lambda item, result: written.append(item),
+                                  workers=4,
+                                  queue_size=5,
+                                  ordered=True)
+    pipeline.run(range(100))
+    assert written == list(range(100))
+    # Only the items within queue_size of item 0 ran while it was slow
+    assert first_done[0] <= 5
+
+def test_unordered():
+    pipeline, written, errors = run(ordered=False, workers=8)
+    assert sorted(written) == [(x, x * x) for x in range(200) if x % 10 != 3]
+    assert len(errors) == 20
+
+def test_writer_failure():
+    def write(item, result):
+        if item == 50:
+            raise IOError("Solr is down")
+    pipeline = ExtractionPipeline(lambda item: item, write, queue_size=4)
+    try:
+        pipeline.run(range(1000))
+    except PipelineError:
+        pass
+    else:
+        assert False, "Expected PipelineError"
@@ -0,0 +1,69 @@
+"""
+ :mod:`test_record_view` Tests for the tag-bucketed record view
+"""
+__author__ = "Jeremy Nelson"
+
+from record_view import RecordView
+
+
+class Field(object):
+
+    def __init__(self, tag, data):
+        self.tag = tag
+        self.data = data
+
+    def getTag(self):
+        return self.tag
+
+
+class Record(object):
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.scans = 0
+
+    def getLeader(self):
+        return '00000nam a2200000 a 4500'
+
+    def getVariableFields(self):
+        self.scans += 1
+        return self.fields
+
+    def toString(self):
+        return 'record'
+
+
+def make_record():
+    return Record([Field('001', 'ocm1'),
+                   Field('500', 'first note'),
+                   Field('650', 'topic'),
+                   Field('500', 'second note'),
+                   Field('600', 'name'),
+                   Field('945', 'item')])
+
+def test_wrap_scans_once():
+    record = make_record()
+    view = RecordView.wrap(record)
+    view.getVariableField('001')
+    view.getVariableFields('500')
+    view.getRange('6')
+    assert record.scans == 1
+    assert RecordView.wrap(view) is view
+
+def test_tag_lookup():
+    view = RecordView(make_record())
+    assert view.getVariableField('001').data == 'ocm1'
+    assert view.getVariableField('100') is None
+    assert [f.data for f in view.getVariableFields('500')] == ['first note',
+                                                               'second note']
+    assert view.getVariableFields('700') == []
+
+def test_multiple_tags_in_record_order():
+    view = RecordView(make_record())
+    fields = view.getVariableFields(['600', '500'])
+    assert [f.tag for f in fields] == ['500', '500', '600']
+
+def test_range():
+    view = RecordView(make_record())
+    assert [f.data for f in view.getRange('6')] == ['topic', 'name']
+    assert len(view.getVariableFields()) == 6
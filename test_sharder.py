@@ -0,0 +1,107 @@
+"""
+ :mod:`test_sharder` Tests for splitting MARC files into shards
+"""
+__author__ = "Jeremy Nelson"
+
+import io
+import os
+import tempfile
+
+import iso2709
+import sharder
+from test_marc_index import make_records, write_file
+
+
+def test_copy_range():
+    source = io.BytesIO(b'0123456789')
+    target = io.BytesIO()
+    sharder.copy_range(source, target, 2, 5, buffer_size=2)
+    assert target.getvalue() == b'23456'
+
+def test_raw_shard():
+    records = make_records(7)
+    filename = write_file(records, b'\n')
+    output_dir = os.path.join(tempfile.mkdtemp(), 'shards')
+    filenames = sharder.raw_shard(3, filename, output_dir)
+    assert [os.path.basename(name) for name in filenames] == [
+        'records-shard-0k-3.mrc', 'records-shard-3k-6.mrc', 'records-shard-6k-9.mrc']
+    copied = []
+    for name in filenames:
+        copied.append([record.as_marc()
+                       for record in iso2709.MarcReader(open(name, 'rb'))])
+    assert [len(shard) for shard in copied] == [3, 3, 1]
+    assert sum(copied, []) == records
+    for shard_size in (0, -3):
+        try:
+            sharder.raw_shard(shard_size, filename, output_dir)
+        except ValueError:
+            pass
+        else:
+            assert False, "Expected ValueError"
+
+def test_parallel_raw_shard_spans_inputs():
+    records = make_records(11)
+    inputs = [write_file(records[:4]), write_file(records[4:9], b'\n'),
+              write_file(records[9:])]
+    results = []
+    for workers in (1, 4):
+        output_dir = os.path.join(tempfile.mkdtemp(), 'shards')
+        filenames = sharder.raw_shard(3, inputs, output_dir, workers, 'full')
+        results.append([open(name, 'rb').read() for name in filenames])
+        assert [os.path.basename(name) for name in filenames] == [
+            'full-shard-0k-3.mrc', 'full-shard-3k-6.mrc',
+            'full-shard-6k-9.mrc', 'full-shard-9k-12.mrc']
+    assert results[0] == results[1]
+    copied = [[record.as_marc() for record in iso2709.MarcReader(io.BytesIO(data))]
+              for data in results[1]]
+    assert [len(shard) for shard in copied] == [3, 3, 3, 2]
+    assert sum(copied, []) == records
+
+def test_balanced_raw_shard():
+    records = [iso2709.as_marc([('001', u'ocm{0}'.format(number))] +
+                               [('945', (u'  ', [('a', u'Item {0}'.format(item))]))
+                                for item in range(items)])
+               for number, items in enumerate([0, 0, 8, 0, 0, 0, 0, 8])]
+    inputs = [write_file(records[:3]), write_file(records[3:])]
+    index = sharder.marc_index.build_index(inputs[0])
+    assert sharder.record_costs(inputs[0], index) == [1.05, 1.05, 5.45]
+    output_dir = os.path.join(tempfile.mkdtemp(), 'shards')
+    filenames = sharder.raw_shard(5.5, inputs, output_dir, 2, 'full', 'cost')
+    assert [os.path.basename(name) for name in filenames] == [
+        'full-shard-0k-3.mrc', 'full-shard-3k-8.mrc']
+    copied = [[record.as_marc() for record in iso2709.MarcReader(open(name, 'rb'))]
+              for name in filenames]
+    assert sum(copied, []) == records
+    filenames = sharder.raw_shard(len(records[2]), inputs, tempfile.mkdtemp(),
+                                  name='full', balance='bytes')
+    assert [os.path.basename(name) for name in filenames] == [
+        'full-shard-0k-3.mrc', 'full-shard-3k-8.mrc']
+
+def test_record_key():
+    records = make_records(2)
+    assert sharder.record_key(records[1]) == b'b0000001'
+    no_907 = iso2709.as_marc([('001', u'ocm12345 ')])
+    assert sharder.record_key(no_907) == b'ocm12345'
+    assert len(sharder.record_key(iso2709.as_marc([('245', (u'10', [('a', u'X')]))]))) == 40
+
+def test_partition_shard_is_stable():
+    records = make_records(12)
+    output_dir = os.path.join(tempfile.mkdtemp(), 'shards')
+    filenames, changed = sharder.partition_shard(3, write_file(records),
+                                                 output_dir, 'full')
+    assert changed == filenames
+    assert [os.path.basename(name) for name in filenames] == [
+        'full-part-000-of-003.mrc', 'full-part-001-of-003.mrc',
+        'full-part-002-of-003.mrc']
+    partitions = [[record.as_marc() for record in iso2709.MarcReader(open(name, 'rb'))]
+                  for name in filenames]
+    assert sorted(sum(partitions, [])) == sorted(records)
+    for number, partition in enumerate(partitions):
+        assert partition == [record for record in records
+                             if sharder.partition_number(sharder.record_key(record), 3) == number]
+    # A new record only changes the shard it lands in
+    added = make_records(13)[12]
+    filenames, changed = sharder.partition_shard(
+        3, [write_file(records), write_file([added])], output_dir, 'full')
+    number = sharder.partition_number(sharder.record_key(added), 3)
+    assert changed == [filenames[number]]
@@ -0,0 +1,137 @@
+"""
+ :mod:`test_solr_http` Tests for the concurrent Solr update client, run
+ against the local Solr stand-in
+"""
+__author__ = "Jeremy Nelson"
+
+import threading
+
+import solr_http
+from index_stats import RunStats
+from solr_standin import SolrStandIn
+
+
+def batches(count, size=10):
+    return [[{'id': 'b{0}-{1}'.format(batch, i),
+              'title': u'caf\xe9',
+              'subject': set([u'Trains'])}
+             for i in range(size)]
+            for batch in range(count)]
+
+def test_batches_sent_concurrently():
+    standin = SolrStandIn(latency=0.1).start()
+    try:
+        stats = RunStats()
+        client = solr_http.ConcurrentUpdateClient(standin.url, in_flight=4,
+                                                  stats=stats)
+        for docs in batches(8):
+            client.add(docs)
+        client.commit()
+        client.close()
+        # 8 batches at 0.1s each, several and at most 4 at a time, then
+        # the commit once they are all answered
+        assert 1 < standin.most_active <= 4
+        assert [request[1] for request in standin.requests] == [{}] * 8 + [{'commit': 'true'}]
+        assert len(standin.docs) == 80
+        assert standin.docs[0]['title'] == u'caf\xe9'
+        assert standin.docs[0]['subject'] == [u'Trains']
+        assert standin.commits == [False]
+        assert len(standin.connections) <= 4
+        assert client.pool.opened <= 4
+        assert stats.histograms['request_seconds'].count == 9
+    finally:
+        standin.stop()
+
+def test_semaphore_caps_batches_across_clients():
+    standin = SolrStandIn(latency=0.1).start()
+    try:
+        semaphore = threading.BoundedSemaphore(2)
+        clients = [solr_http.ConcurrentUpdateClient(standin.url, in_flight=4,
+                                                    semaphore=semaphore)
+                   for i in range(2)]
+        for docs in batches(8):
+            for client in clients:
+                client.add(docs)
+        for client in clients:
+            client.flush()
+            client.close()
+        # 8 in flight without the shared semaphore
+        assert standin.most_active == 2
+        assert len(standin.docs) == 160
+    finally:
+        standin.stop()
+
+def test_commit_within_and_soft_commit():
+    standin = SolrStandIn().start()
+    try:
+        client = solr_http.ConcurrentUpdateClient(standin.url, in_flight=2)
+        client.add(batches(1)[0], commit_within=5000)
+        client.commit(soft=True)
+        client.close()
+        assert standin.requests[0][1] == {'commitWithin': '5000'}
+        assert standin.commits == [True]
+    finally:
+        standin.stop()
+
+def test_failed_request_raised():
+    standin = SolrStandIn().start()
+    standin.fail = True
+    try:
+        client = solr_http.ConcurrentUpdateClient(standin.url, in_flight=2)
+        client.add(batches(1)[0])
+        try:
+            client.flush()
+        except solr_http.SolrUpdateError as error:
+            assert '500' in str(error)
+        else:
+            assert False, "Expected SolrUpdateError"
+        client.close()
+    finally:
+        standin.stop()
+
+def test_chunked_csv_post():
+    standin = SolrStandIn().start()
+    try:
+        url = standin.url + 'update/csv?f.subject.split=true&f.subject.separator=%7C&commit=true'
+        upload = solr_http.ChunkedPost(url, 'text/csv; charset=utf-8',
+                                       chunk_size=16)
+        upload.write('id,title,subject\r\n')
+        for i in range(5):
+            upload.write(u'b{0},caf\xe9,Trains|Railroads\r\n'.format(i))
+        upload.close()
+        assert len(standin.requests) == 1
+        assert standin.requests[0][2] == upload.bytes_sent
+        assert len(standin.docs) == 5
+        assert standin.docs[0] == {'id': 'b0', 'title': u'caf\xe9',
+                                   'subject': ['Trains', 'Railroads']}
+        assert standin.commits == [False]
+    finally:
+        standin.stop()
+
+def test_gzip_bodies():
+    standin = SolrStandIn().start()
+    try:
+        stats = RunStats()
+        client = solr_http.ConcurrentUpdateClient(standin.url, in_flight=2,
+                                                  stats=stats, gzip_level=6)
+        for docs in batches(3, 50):
+            client.add(docs)
+        client.commit()
+        client.close()
+        assert len(standin.docs) == 150
+        assert standin.docs[0]['title'] == u'caf\xe9'
+        assert standin.commits == [False]
+        for path, params, received, decoded, encoding in standin.requests:
+            assert encoding == 'gzip'
+            assert decoded is not None
+        assert standin.requests[0][2] < standin.requests[0][3] / 4
+        assert stats.histograms['request_bytes'].total < \
+            stats.histograms['uncompressed_bytes'].total / 4
+    finally:
+        standin.stop()
+
+def test_gzip_round_trip():
+    body = u'{"id": "caf\xe9"}'.encode('utf-8') * 100
+    compressed = solr_http.gzip_body(body, 1)
+    assert len(compressed) < len(body)
+    assert solr_http.gunzip_body(compressed) == body
@@ -0,0 +1,110 @@
+"""
+ :mod:`test_solr_router` Tests for routing documents to their Solr nodes,
+ run against local Solr stand-ins
+"""
+__author__ = "Jeremy Nelson"
+
+import solr_router
+from solr_http import ConcurrentUpdateClient
+from solr_standin import SolrStandIn
+
+
+def test_hash_router_is_stable():
+    router = solr_router.make_router('hash')
+    nodes = [router({'id': 'b{0}'.format(i)}, 3) for i in range(300)]
+    assert nodes == [router({'id': u'b{0}'.format(i)}, 3) for i in range(300)]
+    assert sorted(set(nodes)) == [0, 1, 2]
+    assert min([nodes.count(node) for node in range(3)]) > 70
+    # Same key, same node, whatever the other fields
+    assert router({'id': 'b1', 'title': 'One'}, 3) == router({'id': ['b1']}, 3)
+    by_title = solr_router.make_router('hash:title')
+    assert by_title({'id': 'b1', 'title': 'One'}, 5) == by_title({'id': 'b2', 'title': 'One'}, 5)
+    try:
+        solr_router.make_router('random')
+    except ValueError:
+        pass
+    else:
+        assert False, "Expected ValueError"
+
+def test_routed_client():
+    standins = [SolrStandIn().start() for i in range(2)]
+    try:
+        nodes = [standin.url for standin in standins]
+        client = solr_router.RoutedClient(
+            nodes,
+            lambda url, stats: ConcurrentUpdateClient(url, in_flight=2, stats=stats),
+            batch_docs=10)
+        docs = [{'id': 'b{0}'.format(i), 'title': 'Title'} for i in range(45)]
+        client.add(docs[:30])
+        client.add(docs[30:])
+        client.flush()
+        client.commit()
+        client.close()
+        router = solr_router.HashRouter()
+        for index, standin in enumerate(standins):
+            expected = [doc['id'] for doc in docs if router(doc, 2) == index]
+            assert sorted([doc['id'] for doc in standin.docs]) == sorted(expected)
+            assert standin.commits == [False]
+            assert client.docs[index] == len(expected)
+        assert sum(client.docs) == 45
+        assert client.stats[0].histograms['batch_docs'].maximum <= 10
+        node_stats = client.to_dict()
+        assert node_stats[nodes[1]]['docs'] == client.docs[1]
+        report = client.report()
+        assert report.count('\tNode ') == 2
+        assert 'docs={0} '.format(client.docs[0]) in report
+    finally:
+        for standin in standins:
+            standin.stop()
+
+class RecordingClient(object):
+    "Update client that records every add"
+
+    def __init__(self, url, adds):
+        self.url = url
+        self.adds = adds
+
+    def add(self, docs, commit_within=None):
+        self.adds.append((self.url, len(docs), commit_within))
+
+    def flush(self):
+        pass
+
+def test_routed_client_partial_batches():
+    adds = []
+    client = solr_router.RoutedClient(
+        ['a', 'b'], lambda url, stats: RecordingClient(url, adds),
+        router=lambda doc, nodes: 0 if doc['id'] < 'b2' else 1,
+        batch_docs=2)
+    client.add([{'id': 'b{0}'.format(i)} for i in range(5)], commit_within=60000)
+    assert adds == [('a', 2, 60000), ('b', 2, 60000)]
+    # The partial batches keep the commitWithin of the add
+    client.flush()
+    assert adds[2:] == [('b', 1, 60000)]
+    assert client.asynchronous and client.latency() >= 0.0
+    del adds[:]
+    client = solr_router.RoutedClient(
+        ['a'], lambda url, stats: RecordingClient(url, adds),
+        batch_docs=10, batch_bytes=1)
+    client.add([{'id': 'b{0}'.format(i)} for i in range(3)])
+    assert adds == [('a', 1, None)] * 3
+
+def test_adaptive_needs_synchronous_nodes():
+    standin = SolrStandIn().start()
+    try:
+        solr_router.RoutedClient(
+            [standin.url],
+            lambda url, stats: ConcurrentUpdateClient(url, stats=stats),
+            adaptive='0.5')
+    except ValueError:
+        pass
+    else:
+        assert False, "Expected ValueError"
+    finally:
+        standin.stop()
+    adds = []
+    client = solr_router.RoutedClient(
+        ['a'], lambda url, stats: RecordingClient(url, adds),
+        batch_docs=2, adaptive='0.5:1:4')
+    client.add([{'id': 'b1'}, {'id': 'b2'}])
+    assert adds == [('a', 2, None)]
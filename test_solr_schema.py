@@ -0,0 +1,88 @@
+"""
+ :mod:`test_solr_schema` Tests for the cached Solr schema and the
+ record conformer
+"""
+__author__ = "Jeremy Nelson"
+
+import json
+import os
+import tempfile
+
+import solr_schema
+from solr_standin import SolrStandIn
+
+SCHEMA_XML = b'''<?xml version="1.0" encoding="UTF-8"?>
+<schema name="test">
+ <types>
+  <fieldType name="string" class="solr.StrField"/>
+  <fieldType name="strings" class="solr.StrField" multiValued="true"/>
+ </types>
+ <fields>
+  <field name="id" type="string" required="true"/>
+  <field name="title" type="string"/>
+  <field name="subject" type="string" multiValued="true"/>
+  <field name="author" type="strings"/>
+  <dynamicField name="*_facet" type="string" multiValued="true"/>
+ </fields>
+ <uniqueKey>id</uniqueKey>
+</schema>'''
+
+
+def test_parse_schema():
+    schema = solr_schema.SolrSchema.from_xml(SCHEMA_XML)
+    assert schema.unique_key == 'id'
+    assert schema.multi_valued_fields() == ['author', 'subject']
+    assert schema.field('title') == ('string', False)
+    assert schema.field('format_facet') == ('string', True)
+    assert schema.field('facet_format') is None
+    copy = solr_schema.SolrSchema.from_dict(json.loads(json.dumps(schema.to_dict())))
+    assert copy.field('format_facet') == ('string', True)
+    assert copy.checksum == schema.checksum
+
+def test_conformer():
+    schema = solr_schema.SolrSchema.from_xml(SCHEMA_XML)
+    logged = []
+    conform = solr_schema.SchemaConformer(schema, {'series': 'series_facet'},
+                                          log=logged.append)
+    record = conform({'id': 'b1',
+                      'title': set(['Second', 'First']),
+                      'subject': ['Trains', 'Railroads'],
+                      'series': ['Rail history'],
+                      'notes': ['A note'],
+                      'url': []})
+    assert record == {'id': 'b1',
+                      'title': 'First',
+                      'subject': ['Trains', 'Railroads'],
+                      'series_facet': ['Rail history']}
+    assert conform.dropped == {'notes': 1}
+    assert conform.renamed == {'series': 1}
+    assert conform.truncated == {'title': 1}
+    conform({'id': 'b2', 'title': ['Third', 'Fourth']})
+    assert conform.truncated == {'title': 2}
+    assert logged == ["\tSingle-valued field title given 2 values, keeping 'First'\n"]
+    assert conform.fieldnames(['id', 'notes', 'series']) == ['id', 'series_facet']
+    assert 'Dropped fields: notes=1' in conform.report()
+
+def test_schema_cached_on_disk():
+    solr_schema.CACHE_DIR = tempfile.mkdtemp()
+    solr_schema.clear_cache()
+    try:
+        standin = SolrStandIn(schema=SCHEMA_XML.decode('utf-8')).start()
+        try:
+            schema = solr_schema.load_schema(standin.url)
+            assert schema.multi_valued_fields() == ['author', 'subject']
+            assert os.path.exists(solr_schema.cache_filename(standin.url))
+            standin.schema = SCHEMA_XML.decode('utf-8').replace('title', 'name')
+            solr_schema.clear_cache()
+            # Still valid, read from the cache file without a request
+            assert solr_schema.load_schema(standin.url).field('title') is not None
+            # Expired, fetched again
+            assert solr_schema.load_schema(standin.url, max_age=0).field('title') is None
+        finally:
+            standin.stop()
+        solr_schema.clear_cache()
+        # Server gone, the stale cache file is used
+        assert solr_schema.load_schema(standin.url, max_age=0).field('name') is not None
+    finally:
+        solr_schema.CACHE_DIR = '.'
+        solr_schema.clear_cache()
@@ -0,0 +1,74 @@
+"""
+ :mod:`test_solr_standin` Tests for the local Solr stand-in used by the
+ update client tests and benchmarks
+"""
+__author__ = "Jeremy Nelson"
+
+try:
+    import httplib as http_client
+except ImportError:
+    import http.client as http_client
+
+from solr_http import gzip_body
+from solr_standin import SolrStandIn
+
+XML_UPDATE = (b'<add><doc><field name="id">b1</field>'
+              b'<field name="subject">Trains</field>'
+              b'<field name="subject">Railroads</field></doc></add>')
+
+
+def post(standin, path, body, headers):
+    connection = http_client.HTTPConnection('127.0.0.1',
+                                            standin.server.server_address[1])
+    try:
+        connection.request('POST', '/solr/' + path, body, headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+def test_xml_update_with_xml_response():
+    standin = SolrStandIn().start()
+    try:
+        status, body = post(standin, 'update?wt=xml&version=2.2', XML_UPDATE,
+                            {'Content-Type': 'application/xml; charset=UTF-8'})
+        assert status == 200
+        assert b'<int name="status">0</int>' in body
+        assert standin.docs == [{'id': 'b1', 'subject': ['Trains', 'Railroads']}]
+        post(standin, 'update', b'<commit/>', {'Content-Type': 'text/xml'})
+        assert standin.commits == [False]
+    finally:
+        standin.stop()
+
+def test_chunked_body():
+    standin = SolrStandIn().start()
+    try:
+        chunks = [XML_UPDATE[:20], XML_UPDATE[20:]]
+        body = b''.join([('%x\r\n' % len(chunk)).encode('ascii') + chunk + b'\r\n'
+                         for chunk in chunks]) + b'0\r\n\r\n'
+        status, response = post(standin, 'update', body,
+                                {'Content-Type': 'text/xml',
+                                 'Transfer-Encoding': 'chunked'})
+        assert status == 200
+        assert standin.requests[0][2] == len(XML_UPDATE)
+        assert len(standin.docs) == 1
+    finally:
+        standin.stop()
+
+def test_gzip_body_checked():
+    standin = SolrStandIn().start()
+    try:
+        status, body = post(standin, 'update', gzip_body(XML_UPDATE),
+                            {'Content-Type': 'text/xml',
+                             'Content-Encoding': 'gzip'})
+        assert status == 200
+        assert standin.docs[0]['subject'] == ['Trains', 'Railroads']
+        assert standin.requests[0][3:] == (len(XML_UPDATE), 'gzip')
+        status, body = post(standin, 'update', gzip_body(XML_UPDATE)[:-6],
+                            {'Content-Type': 'text/xml',
+                             'Content-Encoding': 'gzip'})
+        assert status == 400
+        assert standin.requests[1][3] is None
+        assert len(standin.docs) == 1
+    finally:
+        standin.stop()
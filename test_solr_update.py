@@ -0,0 +1,173 @@
+"""
+ :mod:`test_solr_update` Tests for the Solr update helpers
+"""
+__author__ = "Jeremy Nelson"
+
+import os
+import tempfile
+import threading
+import time
+
+import solr_update
+from index_stats import RunStats
+
+
+class Client(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def add(self, docs, commit_within=None):
+        self.calls.append(('add', len(docs), commit_within))
+
+    def commit(self, soft=False):
+        self.calls.append(('commit', soft))
+
+
+def run_policy(spec, batches=3):
+    client, policy = Client(), solr_update.make_commit_policy(spec)
+    for i in range(batches):
+        client.add([{}], commit_within=policy.commit_within)
+        policy.after_batch(client)
+    policy.finish(client)
+    return client.calls, policy
+
+def test_batch_commit():
+    calls, policy = run_policy('batch')
+    assert calls.count(('commit', False)) == 3
+    assert policy.commit_times.count == 3
+    assert policy.params() == {'commit': 'true'}
+
+def test_final_commit():
+    calls, policy = run_policy('final')
+    assert calls[-1] == ('commit', False)
+    assert calls.count(('commit', False)) == 1
+    assert 'Commits:1' in policy.report()
+
+def test_commit_within():
+    calls, policy = run_policy('within:5000')
+    assert calls == [('add', 1, 5000)] * 3
+    assert policy.params() == {'commitWithin': '5000'}
+
+def test_soft_commit():
+    policy = solr_update.make_commit_policy('soft:0.01')
+    client = Client()
+    policy.after_batch(client)
+    time.sleep(0.02)
+    policy.after_batch(client)
+    policy.finish(client)
+    assert client.calls == [('commit', True), ('commit', False)]
+    assert policy.params() == {'commit': 'true'}
+
+def test_unknown_policy():
+    try:
+        solr_update.make_commit_policy('sometimes')
+    except ValueError:
+        pass
+    else:
+        assert False, "Expected ValueError"
+
+def test_estimate_size():
+    small = solr_update.estimate_size({'id': 'b1'})
+    assert small == solr_update.DOC_OVERHEAD + solr_update.FIELD_OVERHEAD + 4
+    large = solr_update.estimate_size({'id': 'b1',
+                                       'subject': ['Trains', 'Railroads'],
+                                       'pubyear': 1999,
+                                       'notes': None})
+    assert large == small + 3 * solr_update.FIELD_OVERHEAD + (7 + 6) + (7 + 9) + (7 + 4)
+
+def test_batcher_flushes_at_first_limit():
+    stats = RunStats()
+    batcher = solr_update.Batcher(max_docs=3, max_bytes=100, stats=stats)
+    assert not batcher.add('a', 40)
+    assert batcher.add('b', 60)
+    assert batcher.take() == ['a', 'b']
+    assert len(batcher) == 0
+    for doc in 'cde':
+        full = batcher.add(doc, 1)
+    assert full
+    assert batcher.take() == ['c', 'd', 'e']
+    assert batcher.take() == []
+    assert stats.histograms['batch_docs'].total == 5
+    assert stats.histograms['batch_bytes'].total == 103
+    assert stats.histograms['batch_bytes'].maximum == 100
+    unbounded = solr_update.Batcher(max_docs=2, max_bytes=None)
+    assert not unbounded.add('a', 10 ** 9)
+
+def test_adaptive_batch_size():
+    messages = []
+    controller = solr_update.AdaptiveBatchSize(target=1.0, minimum=100,
+                                               maximum=400, log=messages.append)
+    assert controller.update(0.5, 100) == 200
+    assert controller.update(0.5, 350) == 400
+    assert controller.update(0.5, 400) == 400
+    assert controller.update(3.0, 400) == 200
+    assert controller.update(3.0, 150) == 100
+    assert controller.changes == 4
+    assert len(messages) == 4
+    assert '400 -> 200' in messages[2]
+    assert solr_update.make_batch_controller(None) is None
+    spec = solr_update.make_batch_controller('1.5:50:500')
+    assert (spec.target, spec.minimum, spec.maximum) == (1.5, 50, 500)
+    try:
+        solr_update.make_batch_controller('1:2')
+    except ValueError:
+        pass
+    else:
+        assert False, "Expected ValueError"
+
+def test_batcher_follows_controller():
+    controller = solr_update.AdaptiveBatchSize(target=1.0, minimum=2,
+                                               maximum=8, log=None)
+    batcher = solr_update.Batcher(max_docs=20, max_bytes=None,
+                                  stats=RunStats(), controller=controller)
+    assert batcher.max_docs == 8
+    for doc in range(8):
+        batcher.add(doc)
+    batcher.take()
+    batcher.sent(2.0)
+    assert batcher.max_docs == 4
+    batcher.add('partial')
+    batcher.take()
+    batcher.sent(5.0)
+    assert batcher.max_docs == 4
+    assert batcher.stats.histograms['add_seconds'].count == 2
+
+def test_compact_record():
+    record = solr_update.compact_record({'id': 'b1',
+                                         'title': u'',
+                                         'series': [],
+                                         'notes': None,
+                                         'url': set(),
+                                         'pubyear': 0,
+                                         'subject': ['Trains', 'Railroads',
+                                                     'Trains', '', None],
+                                         'author': ('Doe, Jane',)})
+    assert record == {'id': 'b1',
+                      'pubyear': 0,
+                      'subject': ['Trains', 'Railroads'],
+                      'author': ['Doe, Jane']}
+    assert solr_update.estimate_size(record) < solr_update.estimate_size(
+        dict(record, subject=['Trains', 'Railroads', 'Trains']))
+
+def test_update_error_log():
+    log_filename = os.path.join(tempfile.mkdtemp(), 'errors.log')
+    echoed = []
+    error_log = solr_update.UpdateErrorLog(log_filename, echo=echoed.append)
+    assert error_log.report() == "\tFailed Solr batches:0\n"
+    assert not os.path.exists(log_filename)
+    threads = [threading.Thread(target=error_log.failed,
+                                args=(IOError('Bad request {0}'.format(i)),))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Flushed after every failure, readable before the log is closed
+    lines = open(log_filename).read().splitlines()
+    assert len(lines) == 4 and len(echoed) == 4
+    assert sorted([line.split(' ', 1)[1] for line in lines]) == [
+        'Solr update failed: Bad request {0}'.format(i) for i in range(4)]
+    error_log.close()
+    assert error_log.report() == "\tFailed Solr batches:4\n\tErrors logged to {0}\n".format(
+        log_filename)